@@ -1,9 +1,15 @@
+import json
 import os
+import click
 from flask import Flask, jsonify
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+from utils.llm_client import llm
+from utils.semantic_cache import chat_cache
+from utils.metrics import metrics
 
 # Cargar variables de entorno
 load_dotenv()
@@ -11,6 +17,7 @@ load_dotenv()
 # Inicializar extensiones
 db = SQLAlchemy()
 jwt = JWTManager()
+migrate = Migrate()
 
 # Crear la aplicación Flask directamente
 app = Flask(__name__)
@@ -35,9 +42,100 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Configuración de OpenAI
 app.config['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
 
+# Cliente LLM (URL base intercambiable por un servicio compatible con OpenAI)
+app.config['LLM_BASE_URL'] = os.getenv('LLM_BASE_URL')
+app.config['LLM_MODEL'] = os.getenv('LLM_MODEL')
+app.config['LLM_CONNECT_TIMEOUT'] = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+app.config['LLM_READ_TIMEOUT'] = float(os.getenv('LLM_READ_TIMEOUT', 60))
+app.config['LLM_MAX_CONNECTIONS'] = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+app.config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', 2))
+
+# Resiliencia del cliente LLM: circuito por caso de uso y timeouts según el p99 observado
+app.config['LLM_BREAKER_FAILURE_THRESHOLD'] = int(os.getenv('LLM_BREAKER_FAILURE_THRESHOLD', 5))
+app.config['LLM_BREAKER_RESET_SECONDS'] = float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+app.config['LLM_TIMEOUT_P99_MULTIPLIER'] = float(os.getenv('LLM_TIMEOUT_P99_MULTIPLIER', 1.5))
+app.config['LLM_MIN_TIMEOUT'] = float(os.getenv('LLM_MIN_TIMEOUT', 5))
+app.config['LLM_LATENCY_WINDOW'] = int(os.getenv('LLM_LATENCY_WINDOW', 200))
+app.config['LLM_LATENCY_MIN_SAMPLES'] = int(os.getenv('LLM_LATENCY_MIN_SAMPLES', 20))
+
+# Planificador de llamadas al LLM por prioridad de suscripción (pro > premium > basic)
+app.config['LLM_SCHEDULER_CONCURRENCY'] = int(os.getenv('LLM_SCHEDULER_CONCURRENCY', 8))
+app.config['LLM_SCHEDULER_INTERACTIVE_WAIT'] = float(os.getenv('LLM_SCHEDULER_INTERACTIVE_WAIT', 5))
+
+# Límites de IA por usuario y por nivel (tokens por minuto; chat = 1, plan = 2, masivo = 10)
+app.config['AI_RATE_LIMITS'] = {
+    tier: {
+        'user_per_minute': int(os.getenv(f'AI_RATE_{tier.upper()}_USER_PER_MINUTE', user_limit)),
+        'tier_per_minute': int(os.getenv(f'AI_RATE_{tier.upper()}_TIER_PER_MINUTE', tier_limit))
+    }
+    for tier, user_limit, tier_limit in (('basic', 10, 300), ('premium', 30, 600), ('pro', 60, 1200))
+}
+
+# Configuración de trabajos de IA en segundo plano
+app.config['AI_JOB_WORKERS'] = int(os.getenv('AI_JOB_WORKERS', 4))
+app.config['AI_JOB_QUEUE_SIZE'] = int(os.getenv('AI_JOB_QUEUE_SIZE', 32))
+app.config['AI_JOB_TIMEOUT_SECONDS'] = int(os.getenv('AI_JOB_TIMEOUT_SECONDS', 300))
+app.config['AI_JOB_DEDUPE_GRACE_SECONDS'] = int(os.getenv('AI_JOB_DEDUPE_GRACE_SECONDS', 30))
+
+# Generación masiva de planes para entrenadores
+app.config['AI_BULK_MAX_USERS'] = int(os.getenv('AI_BULK_MAX_USERS', 200))
+app.config['AI_BULK_CONCURRENCY'] = int(os.getenv('AI_BULK_CONCURRENCY', 8))
+app.config['AI_BULK_COMMIT_BATCH'] = int(os.getenv('AI_BULK_COMMIT_BATCH', 25))
+app.config['AI_BULK_MAX_RATE_LIMIT_RETRIES'] = int(os.getenv('AI_BULK_MAX_RATE_LIMIT_RETRIES', 5))
+app.config['AI_BULK_TIMEOUT_SECONDS'] = int(os.getenv('AI_BULK_TIMEOUT_SECONDS', 1800))
+
+# Caché de planes generados por IA
+app.config['PLAN_CACHE_TTL_SECONDS'] = int(os.getenv('PLAN_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+app.config['PLAN_CACHE_MAX_ENTRIES'] = int(os.getenv('PLAN_CACHE_MAX_ENTRIES', 1000))
+
+# Pool de planes pregenerados en la franja valle (horas UTC) para los arquetipos más pedidos
+app.config['PLAN_POOL_ENABLED'] = os.getenv('PLAN_POOL_ENABLED', 'true').lower() == 'true'
+app.config['PLAN_POOL_OFFPEAK_HOURS'] = os.getenv('PLAN_POOL_OFFPEAK_HOURS', '1-6')
+app.config['PLAN_POOL_ARCHETYPES'] = int(os.getenv('PLAN_POOL_ARCHETYPES', 20))
+app.config['PLAN_POOL_TARGET_SIZE'] = int(os.getenv('PLAN_POOL_TARGET_SIZE', 5))
+app.config['PLAN_POOL_LOW_WATER'] = int(os.getenv('PLAN_POOL_LOW_WATER', 2))
+app.config['PLAN_POOL_MAX_PER_RUN'] = int(os.getenv('PLAN_POOL_MAX_PER_RUN', 100))
+app.config['PLAN_POOL_MINING_DAYS'] = int(os.getenv('PLAN_POOL_MINING_DAYS', 30))
+app.config['PLAN_POOL_TTL_SECONDS'] = int(os.getenv('PLAN_POOL_TTL_SECONDS', 7 * 24 * 3600))
+app.config['PLAN_POOL_CHECK_SECONDS'] = int(os.getenv('PLAN_POOL_CHECK_SECONDS', 900))
+
+# Caché semántica del chat (en memoria de cada worker)
+app.config['CHAT_CACHE_ENABLED'] = os.getenv('CHAT_CACHE_ENABLED', 'true').lower() == 'true'
+app.config['CHAT_CACHE_THRESHOLD'] = float(os.getenv('CHAT_CACHE_THRESHOLD', 0.8))
+app.config['CHAT_CACHE_MAX_ENTRIES'] = int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 1000))
+app.config['CHAT_CACHE_TTL_SECONDS'] = int(os.getenv('CHAT_CACHE_TTL_SECONDS', 24 * 3600))
+app.config['CHAT_CACHE_DIMENSIONS'] = int(os.getenv('CHAT_CACHE_DIMENSIONS', 2048))
+
+# Caché de respuestas de las rutas de lectura por usuario (en memoria de cada worker)
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Paginación por cursor de los listados
+app.config['PAGE_SIZE_DEFAULT'] = int(os.getenv('PAGE_SIZE_DEFAULT', 20))
+app.config['PAGE_SIZE_MAX'] = int(os.getenv('PAGE_SIZE_MAX', 100))
+
+# Almacenamiento de los planes de entrenamiento nuevos: blob (JSON en plan_data) o normalized (tablas)
+app.config['WORKOUT_PLAN_STORAGE'] = os.getenv('WORKOUT_PLAN_STORAGE', 'blob')
+
+# Telemetría de IA (métricas Prometheus en /api/ai/metrics)
+app.config['METRICS_FLUSH_SECONDS'] = int(os.getenv('METRICS_FLUSH_SECONDS', 10))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+# Precios por 1K tokens por prefijo de modelo, p. ej. {"gpt-4o": [0.005, 0.015]}
+app.config['LLM_PRICES'] = json.loads(os.getenv('LLM_PRICES', '{}'))
+
 # Inicializar extensiones
 db.init_app(app)
 jwt.init_app(app)
+# El esquema se crea y actualiza con las migraciones: flask db upgrade
+migrate.init_app(app, db)
+llm.init_app(app)
+chat_cache.init_app(app)
+metrics.init_app(app)
+
+# La caché de respuestas usa los modelos (versión de datos del usuario): se importa con db ya creado
+from utils.response_cache import response_cache
+response_cache.init_app(app)
 
 # Configurar CORS
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -57,9 +155,70 @@ app.register_blueprint(nutrition_bp, url_prefix='/api/nutrition')
 app.register_blueprint(progress_bp, url_prefix='/api/progress')
 app.register_blueprint(ai_bp, url_prefix='/api/ai')
 
-# Crear tablas
-with app.app_context():
-    db.create_all()
+# Reposición del pool de planes en la franja valle
+from utils.plan_pool import start_pool_refiller, refill_pool
+
+if app.config['PLAN_POOL_ENABLED']:
+    start_pool_refiller(app)
+
+@app.cli.command('refill-plan-pool')
+def refill_plan_pool_command():
+    """Repone el pool de planes ahora, aunque no sea la franja valle (para cron)"""
+    print(refill_pool(app, force=True))
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Comprueba con EXPLAIN que las consultas de las rutas usan sus índices"""
+    from utils.query_plans import check_query_plans
+    if not check_query_plans():
+        raise SystemExit(1)
+
+@app.cli.command('rebuild-user-stats')
+@click.option('--user-id', type=int, default=None, help='Solo este usuario')
+def rebuild_user_stats_command(user_id):
+    """Recalcula los agregados de user_stats desde los planes y registros (repara desviaciones)"""
+    from models.user_stats import rebuild_user_stats
+    print(rebuild_user_stats(user_id))
+
+@app.cli.command('rebuild-progress-rollups')
+@click.option('--user-id', type=int, default=None, help='Solo este usuario')
+def rebuild_progress_rollups_command(user_id):
+    """Recalcula los resúmenes semanales y mensuales de progreso desde los registros"""
+    from models.progress_rollups import rebuild_rollups
+    print(rebuild_rollups(user_id))
+
+@app.cli.command('convert-workout-plans')
+@click.option('--storage', type=click.Choice(['blob', 'normalized']), required=True)
+@click.option('--batch-size', default=200, show_default=True)
+def convert_workout_plans_command(storage, batch_size):
+    """Pasa los planes de entrenamiento existentes a otro almacenamiento"""
+    from models.user import WorkoutPlan
+    from models.workout_structure import convert_plan_storage
+    converted = 0
+    while True:
+        plans = WorkoutPlan.query.filter(WorkoutPlan.storage != storage).order_by(WorkoutPlan.id).limit(batch_size).all()
+        if not plans:
+            break
+        converted += sum(convert_plan_storage(plan, storage) for plan in plans)
+        db.session.commit()
+    print({'converted': converted, 'storage': storage})
+
+@app.cli.command('benchmark-plan-storage')
+@click.option('--repeat', default=50, show_default=True)
+@click.option('--weeks', default=8, show_default=True)
+def benchmark_plan_storage_command(repeat, weeks):
+    """Compara los tiempos de los planes en blob y normalizados (sin guardar nada)"""
+    from utils.benchmarks import benchmark_plan_storage
+    print(json.dumps(benchmark_plan_storage(repeat=repeat, weeks=weeks), indent=2))
+
+@app.cli.command('benchmark-progress-analytics')
+@click.option('--sizes', default='1000,10000', show_default=True, help='Registros por historial, separados por comas')
+@click.option('--repeat', default=20, show_default=True)
+def benchmark_progress_analytics_command(sizes, repeat):
+    """Compara las analíticas de progreso registro a registro y vectorizadas (sin guardar nada)"""
+    from utils.benchmarks import benchmark_progress_analytics
+    sizes = [int(size) for size in sizes.split(',')]
+    print(json.dumps(benchmark_progress_analytics(sizes=sizes, repeat=repeat), indent=2))
 
 # Ruta de salud
 @app.route('/api/health')
@@ -0,0 +1,223 @@
+"""Esquema inicial (el que creaba db.create_all)
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 04:16:03.928383
+
+Las bases de datos creadas antes con db.create_all se adoptan sin
+perder datos: las tablas que ya existen solo reciben las columnas e
+índices que les falten, y en Postgres plan_data pasa de texto a JSONB.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+PlanJSON = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+
+
+def _ensure_table(name, *columns, indexes=()):
+    """Crea la tabla o completa la que ya existe con sus columnas e índices"""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(name):
+        op.create_table(name, *columns)
+        existing_indexes = set()
+    else:
+        existing_columns = {column['name'] for column in inspector.get_columns(name)}
+        for column in columns:
+            if isinstance(column, sa.Column) and column.name not in existing_columns:
+                op.add_column(name, column)
+        existing_indexes = {index['name'] for index in inspector.get_indexes(name)}
+
+    for index_name, index_columns, unique in indexes:
+        if index_name not in existing_indexes:
+            op.create_index(index_name, name, index_columns, unique=unique)
+
+
+def _migrate_plan_data(table):
+    """Pasa plan_data de texto a JSON nativo.
+
+    En Postgres convierte la columna a JSONB (los textos vacíos pasan a NULL)
+    y crea el índice GIN de las búsquedas por contenido. En SQLite la columna
+    sigue siendo texto, así que solo se anulan los valores vacíos o inválidos
+    que ya no se podrían decodificar.
+    """
+    if op.get_bind().dialect.name != 'postgresql':
+        op.execute(f"UPDATE {table} SET plan_data = NULL "
+                   f"WHERE plan_data IS NOT NULL AND (plan_data = '' OR NOT json_valid(plan_data))")
+        return
+    column = next(c for c in sa.inspect(op.get_bind()).get_columns(table) if c['name'] == 'plan_data')
+    if not isinstance(column['type'], postgresql.JSONB):
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN plan_data TYPE JSONB USING NULLIF(plan_data, '')::jsonb")
+    op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_plan_data ON {table} USING gin (plan_data jsonb_path_ops)")
+
+
+def upgrade():
+    _ensure_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('password_hash', sa.String(length=255), nullable=False),
+        sa.Column('age', sa.Integer(), nullable=True),
+        sa.Column('gender', sa.String(length=20), nullable=True),
+        sa.Column('height', sa.Float(), nullable=True),
+        sa.Column('weight', sa.Float(), nullable=True),
+        sa.Column('fitness_goal', sa.String(length=50), nullable=True),
+        sa.Column('activity_level', sa.String(length=20), nullable=True),
+        sa.Column('dietary_restrictions', sa.String(length=100), nullable=True),
+        sa.Column('subscription_type', sa.String(length=20), nullable=True),
+        sa.Column('subscription_expires', sa.DateTime(), nullable=True),
+        sa.Column('coach_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('last_login', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('ix_users_email', ['email'], True), ('ix_users_coach_id', ['coach_id'], False)]
+    )
+
+    _ensure_table(
+        'workout_plans',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('duration_weeks', sa.Integer(), nullable=True),
+        sa.Column('workouts_per_week', sa.Integer(), nullable=True),
+        sa.Column('difficulty', sa.String(length=20), nullable=True),
+        sa.Column('plan_data', PlanJSON, nullable=True),
+        sa.Column('token_usage', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('progress', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('ix_workout_plans_user_created', ['user_id', 'created_at', 'id'], False)]
+    )
+    _migrate_plan_data('workout_plans')
+
+    _ensure_table(
+        'nutrition_plans',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('daily_calories', sa.Integer(), nullable=True),
+        sa.Column('duration_weeks', sa.Integer(), nullable=True),
+        sa.Column('protein_percentage', sa.Float(), nullable=True),
+        sa.Column('carbs_percentage', sa.Float(), nullable=True),
+        sa.Column('fats_percentage', sa.Float(), nullable=True),
+        sa.Column('plan_data', PlanJSON, nullable=True),
+        sa.Column('token_usage', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('progress', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('ix_nutrition_plans_user_created', ['user_id', 'created_at', 'id'], False)]
+    )
+    _migrate_plan_data('nutrition_plans')
+
+    _ensure_table(
+        'progress_entries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('weight', sa.Float(), nullable=True),
+        sa.Column('body_fat', sa.Float(), nullable=True),
+        sa.Column('muscle_mass', sa.Float(), nullable=True),
+        sa.Column('chest', sa.Float(), nullable=True),
+        sa.Column('waist', sa.Float(), nullable=True),
+        sa.Column('hips', sa.Float(), nullable=True),
+        sa.Column('arms', sa.Float(), nullable=True),
+        sa.Column('thighs', sa.Float(), nullable=True),
+        sa.Column('notes', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('ix_progress_entries_user_date', ['user_id', 'date', 'id'], False)]
+    )
+
+    _ensure_table(
+        'ai_jobs',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('job_type', sa.String(length=30), nullable=False),
+        sa.Column('params', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('result_plan_id', sa.Integer(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('ix_ai_jobs_user_id', ['user_id'], False)]
+    )
+
+    _ensure_table(
+        'ai_generation_leases',
+        sa.Column('lease_key', sa.String(length=64), nullable=False),
+        sa.Column('job_id', sa.String(length=32), sa.ForeignKey('ai_jobs.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('lease_key'),
+        indexes=[('ix_ai_generation_leases_job_id', ['job_id'], False)]
+    )
+
+    _ensure_table(
+        'ai_rate_limit_buckets',
+        sa.Column('bucket_key', sa.String(length=64), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket_key')
+    )
+
+    _ensure_table(
+        'plan_cache',
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('plan_type', sa.String(length=20), nullable=False),
+        sa.Column('plan_data', sa.Text(), nullable=False),
+        sa.Column('hit_count', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('last_accessed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('cache_key'),
+        indexes=[('ix_plan_cache_last_accessed_at', ['last_accessed_at'], False)]
+    )
+
+    _ensure_table(
+        'plan_pool',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('archetype_key', sa.String(length=64), nullable=False),
+        sa.Column('plan_type', sa.String(length=20), nullable=False),
+        sa.Column('archetype', sa.Text(), nullable=True),
+        sa.Column('plan_data', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('ix_plan_pool_archetype_key', ['archetype_key'], False),
+                 ('ix_plan_pool_expires_at', ['expires_at'], False)]
+    )
+
+    _ensure_table(
+        'ai_metrics',
+        sa.Column('series_key', sa.String(length=255), nullable=False),
+        sa.Column('family', sa.String(length=100), nullable=False),
+        sa.Column('sample', sa.String(length=100), nullable=False),
+        sa.Column('labels', sa.Text(), nullable=True),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('series_key'),
+        indexes=[('ix_ai_metrics_family', ['family'], False)]
+    )
+
+
+def downgrade():
+    for table in ('ai_metrics', 'plan_pool', 'plan_cache', 'ai_rate_limit_buckets', 'ai_generation_leases',
+                  'ai_jobs', 'progress_entries', 'nutrition_plans', 'workout_plans', 'users'):
+        op.drop_table(table)
@@ -0,0 +1,44 @@
+"""Índices de las consultas frecuentes y un registro de progreso por día
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 04:30:00.000000
+
+- (user_id, status, created_at) en los planes: listados y estadísticas por estado.
+- UNIQUE (user_id, date) en progress_entries: sustituye al índice
+  (user_id, date, id) de la paginación y permite el upsert del registro
+  diario. Antes se eliminan los duplicados que dejó la comprobación previa
+  no atómica (se conserva el registro más antiguo de cada día).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_workout_plans_user_status_created', 'workout_plans',
+                    ['user_id', 'status', 'created_at'], unique=False)
+    op.create_index('ix_nutrition_plans_user_status_created', 'nutrition_plans',
+                    ['user_id', 'status', 'created_at'], unique=False)
+
+    op.execute("""
+        DELETE FROM progress_entries
+        WHERE id NOT IN (SELECT MIN(id) FROM progress_entries GROUP BY user_id, date)
+    """)
+    op.drop_index('ix_progress_entries_user_date', table_name='progress_entries')
+    with op.batch_alter_table('progress_entries', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_progress_entries_user_date', ['user_id', 'date'])
+
+
+def downgrade():
+    with op.batch_alter_table('progress_entries', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_progress_entries_user_date', type_='unique')
+    op.create_index('ix_progress_entries_user_date', 'progress_entries', ['user_id', 'date', 'id'], unique=False)
+
+    op.drop_index('ix_nutrition_plans_user_status_created', table_name='nutrition_plans')
+    op.drop_index('ix_workout_plans_user_status_created', table_name='workout_plans')
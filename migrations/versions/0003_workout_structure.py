@@ -0,0 +1,75 @@
+"""Estructura normalizada de los planes de entrenamiento
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 04:22:33.402177
+
+Tablas plan_weeks, plan_workouts y plan_exercises para los planes con
+storage='normalized'. Los planes existentes siguen en plan_data (blob);
+se convierten con flask convert-workout-plans --storage normalized.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+PlanJSON = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+
+
+def _plan_id():
+    return sa.Column('plan_id', sa.Integer(), sa.ForeignKey('workout_plans.id', ondelete='CASCADE'), nullable=False)
+
+
+def upgrade():
+    with op.batch_alter_table('workout_plans', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage', sa.String(length=20), server_default='blob', nullable=True))
+
+    op.create_table(
+        'plan_weeks',
+        _plan_id(),
+        sa.Column('week_index', sa.Integer(), nullable=False),
+        sa.Column('week', sa.Integer(), nullable=True),
+        sa.Column('focus', sa.Text(), nullable=True),
+        sa.Column('extra', PlanJSON, nullable=True),
+        sa.PrimaryKeyConstraint('plan_id', 'week_index')
+    )
+    op.create_table(
+        'plan_workouts',
+        _plan_id(),
+        sa.Column('week_index', sa.Integer(), nullable=False),
+        sa.Column('workout_index', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Text(), nullable=True),
+        sa.Column('name', sa.Text(), nullable=True),
+        sa.Column('duration_minutes', sa.Integer(), nullable=True),
+        sa.Column('completed', sa.Boolean(), nullable=True),
+        sa.Column('extra', PlanJSON, nullable=True),
+        sa.PrimaryKeyConstraint('plan_id', 'week_index', 'workout_index')
+    )
+    op.create_table(
+        'plan_exercises',
+        _plan_id(),
+        sa.Column('week_index', sa.Integer(), nullable=False),
+        sa.Column('workout_index', sa.Integer(), nullable=False),
+        sa.Column('section', sa.String(length=20), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('name', sa.Text(), nullable=True),
+        sa.Column('sets', sa.Integer(), nullable=True),
+        sa.Column('reps', sa.Text(), nullable=True),
+        sa.Column('rest_seconds', sa.Integer(), nullable=True),
+        sa.Column('extra', PlanJSON, nullable=True),
+        sa.PrimaryKeyConstraint('plan_id', 'week_index', 'workout_index', 'section', 'position')
+    )
+
+
+def downgrade():
+    op.drop_table('plan_exercises')
+    op.drop_table('plan_workouts')
+    op.drop_table('plan_weeks')
+
+    with op.batch_alter_table('workout_plans', schema=None) as batch_op:
+        batch_op.drop_column('storage')
@@ -0,0 +1,49 @@
+"""Agregados por usuario para las estadísticas
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 04:40:12.512310
+
+La tabla nace vacía: la fila de cada usuario se calcula desde los planes y
+registros la primera vez que se lee o se escribe. flask rebuild-user-stats
+la rellena de una vez y repara desviaciones.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_stats',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('workout_plans', sa.Integer(), nullable=False),
+        sa.Column('workout_active', sa.Integer(), nullable=False),
+        sa.Column('workout_completed', sa.Integer(), nullable=False),
+        sa.Column('workout_progress_sum', sa.Float(), nullable=False),
+        sa.Column('workout_latest_id', sa.Integer(), nullable=True),
+        sa.Column('nutrition_plans', sa.Integer(), nullable=False),
+        sa.Column('nutrition_active', sa.Integer(), nullable=False),
+        sa.Column('nutrition_completed', sa.Integer(), nullable=False),
+        sa.Column('nutrition_progress_sum', sa.Float(), nullable=False),
+        sa.Column('nutrition_calories_sum', sa.Float(), nullable=False),
+        sa.Column('nutrition_calories_count', sa.Integer(), nullable=False),
+        sa.Column('nutrition_latest_id', sa.Integer(), nullable=True),
+        sa.Column('progress_entries', sa.Integer(), nullable=False),
+        sa.Column('first_entry_date', sa.Date(), nullable=True),
+        sa.Column('last_entry_date', sa.Date(), nullable=True),
+        sa.Column('first_weight', sa.Float(), nullable=True),
+        sa.Column('last_weight', sa.Float(), nullable=True),
+        sa.Column('streak_days', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_stats')
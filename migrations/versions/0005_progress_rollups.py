@@ -0,0 +1,90 @@
+"""Resúmenes semanales y mensuales de progreso
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 04:29:25.454169
+
+Crea progress_rollups y la rellena con los registros existentes: las
+analíticas de trimestre y año solo leen los resúmenes, así que no pueden
+faltar periodos anteriores a la migración. Después, flask
+rebuild-progress-rollups los recalcula si hiciera falta.
+"""
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+MEASUREMENT_FIELDS = ('weight', 'body_fat', 'muscle_mass', 'chest', 'waist', 'hips', 'arms', 'thighs')
+
+
+def _period_start(granularity, day):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _rollup_rows(user_id, granularity, start, entries):
+    rows = [{'metric': 'entries', 'count': len(entries),
+             'first_date': entries[0]['date'], 'last_date': entries[-1]['date']}]
+    for metric in MEASUREMENT_FIELDS:
+        points = [(entry['date'], entry[metric]) for entry in entries if entry[metric] is not None]
+        if not points:
+            continue
+        series = [value for _, value in points]
+        rows.append({
+            'metric': metric, 'count': len(series), 'min_value': min(series), 'max_value': max(series),
+            'sum_value': math.fsum(series), 'sum_squares': math.fsum(value * value for value in series),
+            'first_date': points[0][0], 'first_value': points[0][1],
+            'last_date': points[-1][0], 'last_value': points[-1][1]
+        })
+    for row in rows:
+        row.update(user_id=user_id, granularity=granularity, period_start=start)
+    return rows
+
+
+def _backfill(table):
+    entries = sa.table('progress_entries', sa.column('user_id', sa.Integer()), sa.column('date', sa.Date()),
+                       *(sa.column(metric, sa.Float()) for metric in MEASUREMENT_FIELDS))
+    periods = defaultdict(list)
+    query = sa.select(entries).order_by(entries.c.user_id, entries.c.date)
+    for entry in op.get_bind().execute(query).mappings():
+        for granularity in ('week', 'month'):
+            periods[(entry['user_id'], granularity, _period_start(granularity, entry['date']))].append(entry)
+
+    rows = [row for key, period in periods.items() for row in _rollup_rows(*key, period)]
+    columns = [column.name for column in table.columns]
+    if rows:
+        op.bulk_insert(table, [{column: row.get(column) for column in columns} for row in rows])
+
+
+def upgrade():
+    table = op.create_table(
+        'progress_rollups',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('granularity', sa.String(length=10), nullable=False),
+        sa.Column('period_start', sa.Date(), nullable=False),
+        sa.Column('metric', sa.String(length=20), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('min_value', sa.Float(), nullable=True),
+        sa.Column('max_value', sa.Float(), nullable=True),
+        sa.Column('sum_value', sa.Float(), nullable=True),
+        sa.Column('sum_squares', sa.Float(), nullable=True),
+        sa.Column('first_date', sa.Date(), nullable=True),
+        sa.Column('first_value', sa.Float(), nullable=True),
+        sa.Column('last_date', sa.Date(), nullable=True),
+        sa.Column('last_value', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id', 'granularity', 'period_start', 'metric')
+    )
+    _backfill(table)
+
+
+def downgrade():
+    op.drop_table('progress_rollups')
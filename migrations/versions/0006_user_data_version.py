@@ -0,0 +1,27 @@
+"""Versión de los datos de cada usuario (ETag de las rutas de lectura)
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 04:36:05.628352
+
+Los usuarios existentes empiezan en 0; cualquier escritura posterior en sus
+planes, registros o perfil la incrementa.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
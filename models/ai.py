@@ -0,0 +1,133 @@
+from app import db
+from datetime import datetime
+from uuid import uuid4
+import json
+
+
+class AIJob(db.Model):
+    """Trabajo de generación con IA ejecutado en segundo plano"""
+    __tablename__ = 'ai_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    
+    job_type = db.Column(db.String(30), nullable=False)  # workout, nutrition, workout_bulk
+    params = db.Column(db.Text)  # JSON con los parámetros de generación
+    
+    # Estado
+    status = db.Column(db.String(20), default='pending')  # pending, running, completed, failed
+    result_plan_id = db.Column(db.Integer)
+    result = db.Column(db.Text)  # JSON con resultados por usuario (generación masiva)
+    error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def get_params(self):
+        """Obtiene los parámetros del trabajo como diccionario"""
+        if self.params:
+            return json.loads(self.params)
+        return {}
+    
+    def set_params(self, data):
+        """Establece los parámetros del trabajo desde un diccionario"""
+        self.params = json.dumps(data)
+    
+    def get_result(self):
+        """Obtiene el resultado del trabajo como diccionario"""
+        if self.result:
+            return json.loads(self.result)
+        return None
+    
+    def set_result(self, data):
+        """Establece el resultado del trabajo desde un diccionario"""
+        self.result = json.dumps(data)
+    
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.job_type,
+            'status': self.status,
+            'result_plan_id': self.result_plan_id,
+            'result': self.get_result(),
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class PlanCacheEntry(db.Model):
+    """Plan generado por IA reutilizable para parámetros equivalentes"""
+    __tablename__ = 'plan_cache'
+    
+    cache_key = db.Column(db.String(64), primary_key=True)  # sha256 de los parámetros normalizados
+    plan_type = db.Column(db.String(20), nullable=False)  # workout
+    plan_data = db.Column(db.Text, nullable=False)
+    
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    last_accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def get_plan_data(self):
+        return json.loads(self.plan_data)
+    
+    def set_plan_data(self, data):
+        self.plan_data = json.dumps(data)
+
+
+class GenerationLease(db.Model):
+    """Reserva de una generación en curso para deduplicar peticiones idénticas entre workers"""
+    __tablename__ = 'ai_generation_leases'
+    
+    lease_key = db.Column(db.String(64), primary_key=True)  # sha256 de usuario + parámetros normalizados
+    job_id = db.Column(db.String(32), db.ForeignKey('ai_jobs.id', ondelete='CASCADE'), nullable=False, index=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class RateLimitBucket(db.Model):
+    """Cubo de tokens compartido entre workers (por usuario o por nivel de suscripción)"""
+    __tablename__ = 'ai_rate_limit_buckets'
+    
+    bucket_key = db.Column(db.String(64), primary_key=True)  # user:<id> o tier:<nivel>
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # epoch en segundos (se compara en la actualización)
+
+
+class PlanPoolEntry(db.Model):
+    """Plan pregenerado fuera de hora punta para un arquetipo; se entrega a un solo usuario"""
+    __tablename__ = 'plan_pool'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    archetype_key = db.Column(db.String(64), nullable=False, index=True)  # misma clave que plan_cache
+    plan_type = db.Column(db.String(20), nullable=False)  # workout
+    archetype = db.Column(db.Text)  # JSON con los parámetros, edad y género del arquetipo
+    plan_data = db.Column(db.Text, nullable=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def get_plan_data(self):
+        return json.loads(self.plan_data)
+    
+    def set_plan_data(self, data):
+        self.plan_data = json.dumps(data)
+
+
+class AIMetric(db.Model):
+    """Serie de métricas Prometheus acumulada por todos los workers"""
+    __tablename__ = 'ai_metrics'
+    
+    series_key = db.Column(db.String(255), primary_key=True)  # nombre{etiquetas} de la serie
+    family = db.Column(db.String(100), nullable=False, index=True)  # métrica a la que pertenece
+    sample = db.Column(db.String(100), nullable=False)  # p. ej. <familia>_bucket, _sum, _count
+    labels = db.Column(db.Text)  # JSON con las etiquetas
+    value = db.Column(db.Float, nullable=False, default=0)
@@ -0,0 +1,43 @@
+"""Versión de los datos de cada usuario para las respuestas condicionales.
+
+users.data_version aumenta en la misma transacción que cualquier escritura
+en los planes, los registros de progreso o el perfil del usuario. Las rutas
+de lectura derivan de ella su ETag: si la versión no ha cambiado, la
+respuesta tampoco (ver utils.response_cache).
+
+Las escrituras que no pasan por el ORM (el upsert de progreso, el marcado
+de sesiones de los planes normalizados) llaman a ``bump_data_version``.
+"""
+from sqlalchemy import event
+
+from app import db
+from models.user import NutritionPlan, ProgressEntry, User, WorkoutPlan
+
+
+def bump_data_version(connection, user_id):
+    table = User.__table__
+    connection.execute(
+        table.update().where(table.c.id == int(user_id)).values(data_version=table.c.data_version + 1)
+    )
+
+
+def current_data_version(user_id):
+    """Versión actual de los datos del usuario (None si no existe)"""
+    return db.session.execute(db.select(User.data_version).where(User.id == int(user_id))).scalar()
+
+
+def _after_user_data_write(mapper, connection, target):
+    bump_data_version(connection, target.user_id)
+
+
+for _model in (WorkoutPlan, NutritionPlan, ProgressEntry):
+    event.listen(_model, 'after_insert', _after_user_data_write)
+    event.listen(_model, 'after_update', _after_user_data_write)
+    event.listen(_model, 'after_delete', _after_user_data_write)
+
+
+@event.listens_for(User, 'before_update')
+def _bump_own_version(mapper, connection, user):
+    # Se incrementa en SQL: las escrituras de planes y registros pueden haberla cambiado ya en esta transacción
+    if db.object_session(user).is_modified(user, include_collections=False):
+        user.data_version = User.data_version + 1
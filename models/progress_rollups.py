@@ -0,0 +1,197 @@
+"""Resúmenes semanales y mensuales de los registros de progreso.
+
+Por usuario, periodo (semana que empieza en lunes o mes natural) y métrica
+se guardan el recuento, mínimo, máximo, suma, suma de cuadrados y el primer
+y último valor con su fecha. La métrica ``entries`` cuenta los registros
+del periodo, tengan o no cada medida.
+
+Cada alta, cambio o baja de un registro recalcula desde las filas de origen
+los periodos a los que afecta (como mucho una semana y un mes por fecha),
+así que los resúmenes son exactos y no acumulan errores de redondeo. Con
+ellos, la media y la desviación típica de un trimestre o un año se obtienen
+sin leer los registros.
+"""
+import math
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from app import db
+from models.user import ProgressEntry, User
+
+GRANULARITIES = ('week', 'month')
+ENTRIES_METRIC = 'entries'
+
+
+class ProgressRollup(db.Model):
+    __tablename__ = 'progress_rollups'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)  # week, month
+    period_start = db.Column(db.Date, primary_key=True)  # lunes de la semana o día 1 del mes
+    metric = db.Column(db.String(20), primary_key=True)  # weight, body_fat, ..., entries
+
+    count = db.Column(db.Integer, nullable=False)
+    min_value = db.Column(db.Float)
+    max_value = db.Column(db.Float)
+    sum_value = db.Column(db.Float)
+    sum_squares = db.Column(db.Float)
+    first_date = db.Column(db.Date)
+    first_value = db.Column(db.Float)
+    last_date = db.Column(db.Date)
+    last_value = db.Column(db.Float)
+
+    @property
+    def mean(self):
+        return self.sum_value / self.count if self.count and self.sum_value is not None else None
+
+
+def period_bounds(granularity, day):
+    """(inicio, fin exclusivo) del periodo que contiene ``day``"""
+    if granularity == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def rollup_rows(user_id, granularity, start, entries):
+    """Filas de resumen de un periodo a partir de sus registros (pares fecha, {métrica: valor}) por fecha"""
+    rows = []
+    if entries:
+        rows.append({'metric': ENTRIES_METRIC, 'count': len(entries),
+                     'first_date': entries[0][0], 'last_date': entries[-1][0]})
+
+    for metric in ProgressEntry.MEASUREMENT_FIELDS:
+        points = [(day, values[metric]) for day, values in entries if values[metric] is not None]
+        if not points:
+            continue
+        series = [value for _, value in points]
+        rows.append({
+            'metric': metric,
+            'count': len(series),
+            'min_value': min(series),
+            'max_value': max(series),
+            'sum_value': math.fsum(series),
+            'sum_squares': math.fsum(value * value for value in series),
+            'first_date': points[0][0],
+            'first_value': points[0][1],
+            'last_date': points[-1][0],
+            'last_value': points[-1][1]
+        })
+
+    # Un INSERT masivo toma las columnas de la primera fila: todas llevan las mismas claves
+    columns = [column.name for column in ProgressRollup.__table__.columns]
+    return [{column: dict(row, user_id=user_id, granularity=granularity, period_start=start).get(column)
+             for column in columns} for row in rows]
+
+
+def refresh_rollups(connection, user_id, days):
+    """Recalcula los periodos (semana y mes) que contienen cada fecha de ``days``"""
+    entries_table, table = ProgressEntry.__table__, ProgressRollup.__table__
+    periods = {(granularity, period_bounds(granularity, day)) for day in days if day for granularity in GRANULARITIES}
+
+    for granularity, (start, end) in periods:
+        query = db.select(entries_table.c.date, *(entries_table.c[m] for m in ProgressEntry.MEASUREMENT_FIELDS))\
+            .where(entries_table.c.user_id == user_id, entries_table.c.date >= start, entries_table.c.date < end)\
+            .order_by(entries_table.c.date)
+        entries = [(row.date, row._mapping) for row in connection.execute(query)]
+
+        connection.execute(table.delete().where(table.c.user_id == user_id, table.c.granularity == granularity,
+                                                table.c.period_start == start))
+        rows = rollup_rows(user_id, granularity, start, entries)
+        if rows:
+            connection.execute(table.insert(), rows)
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+@event.listens_for(ProgressEntry, 'before_update')
+def _remember_previous_date(mapper, connection, entry):
+    if db.inspect(entry).attrs.date.history.has_changes():
+        table = ProgressEntry.__table__
+        entry.__dict__['_rollup_previous_date'] = connection.execute(
+            db.select(table.c.date).where(table.c.id == entry.id)
+        ).scalar()
+
+
+@event.listens_for(ProgressEntry, 'after_insert')
+@event.listens_for(ProgressEntry, 'after_update')
+@event.listens_for(ProgressEntry, 'after_delete')
+def _refresh_entry_rollups(mapper, connection, entry):
+    days = {_as_date(entry.date), entry.__dict__.pop('_rollup_previous_date', None)}
+    refresh_rollups(connection, int(entry.user_id), days)
+
+
+@event.listens_for(User, 'before_delete')
+def _delete_user_rollups(mapper, connection, user):
+    table = ProgressRollup.__table__
+    connection.execute(table.delete().where(table.c.user_id == user.id))
+
+
+def load_rollups(user_id, granularity, start, end, metrics):
+    """Resúmenes de los periodos que empiezan entre ``start`` y ``end``, por métrica y en orden"""
+    rows = ProgressRollup.query.filter(
+        ProgressRollup.user_id == int(user_id),
+        ProgressRollup.granularity == granularity,
+        ProgressRollup.period_start >= start,
+        ProgressRollup.period_start <= end,
+        ProgressRollup.metric.in_(metrics)
+    ).order_by(ProgressRollup.period_start).all()
+
+    by_metric = {metric: [] for metric in metrics}
+    for row in rows:
+        by_metric[row.metric].append(row)
+    return by_metric
+
+
+def combine_rollups(rollups):
+    """Estadísticas de la unión de varios periodos: recuento, media, desviación típica, extremos y cambio"""
+    rollups = [rollup for rollup in rollups if rollup.count]
+    if not rollups:
+        return None
+    count = sum(rollup.count for rollup in rollups)
+    mean = math.fsum(rollup.sum_value for rollup in rollups) / count
+
+    # Suma de desviaciones al cuadrado combinando periodos (Chan et al.): cada periodo aporta la
+    # suya, calculada con pocos valores, más la distancia de su media a la media global
+    squared = 0.0
+    for rollup in rollups:
+        period_mean = rollup.sum_value / rollup.count
+        squared += max(rollup.sum_squares - rollup.sum_value * period_mean, 0.0)
+        squared += rollup.count * (period_mean - mean) ** 2
+
+    return {
+        'count': count,
+        'mean': mean,
+        'stdev': math.sqrt(squared / (count - 1)) if count > 1 else 0.0,
+        'min': min(rollup.min_value for rollup in rollups),
+        'max': max(rollup.max_value for rollup in rollups),
+        'first': rollups[0].first_value,
+        'last': rollups[-1].last_value
+    }
+
+
+def rebuild_rollups(user_id=None):
+    """Recalcula desde los registros todos los resúmenes de un usuario (o de todos)"""
+    connection = db.session.connection()
+    entries_table, table = ProgressEntry.__table__, ProgressRollup.__table__
+    user_ids = [int(user_id)] if user_id is not None else \
+        [row[0] for row in db.session.execute(db.select(User.id).order_by(User.id))]
+    summary = {'users': 0, 'rows': 0}
+
+    for uid in user_ids:
+        connection.execute(table.delete().where(table.c.user_id == uid))
+        days = connection.execute(db.select(entries_table.c.date).where(entries_table.c.user_id == uid)).scalars()
+        refresh_rollups(connection, uid, set(days))
+        summary['users'] += 1
+        summary['rows'] += connection.execute(
+            db.select(db.func.count()).select_from(table).where(table.c.user_id == uid)
+        ).scalar()
+        db.session.commit()
+        connection = db.session.connection()
+    return summary
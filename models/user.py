@@ -1,7 +1,98 @@
 from app import db
 from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm.attributes import flag_modified
 from werkzeug.security import generate_password_hash, check_password_hash
-import json
+
+# JSON nativo: JSONB en Postgres (indexable con GIN), JSON (texto) en SQLite
+PlanJSON = db.JSON().with_variant(JSONB(), 'postgresql')
+
+
+def default_workout_storage():
+    """Almacenamiento de los planes nuevos: blob (plan_data) o normalized (tablas de estructura)"""
+    return current_app.config.get('WORKOUT_PLAN_STORAGE', 'blob') if has_app_context() else 'blob'
+
+
+def plan_data_index(table):
+    """Índice GIN sobre plan_data para las búsquedas por contenido (solo Postgres)"""
+    return db.Index(f'ix_{table}_plan_data', 'plan_data', postgresql_using='gin',
+                    postgresql_ops={'plan_data': 'jsonb_path_ops'}).ddl_if(dialect='postgresql')
+
+
+def plan_contains(column, section, items_keys, name):
+    """Condición SQL: algún elemento de las listas ``items_keys`` de ``section`` se llama ``name``.
+    
+    En Postgres es una consulta de contención JSONB que usa el índice GIN;
+    en SQLite recorre el JSON con json_tree. En ambos casos se filtra en la
+    base de datos sin cargar los planes en Python.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # La contención de arrays anidados cubre cualquier semana y entrenamiento
+        conditions = []
+        for key in items_keys:
+            item = {key: [{'name': name}]}
+            containment = {section: [{'workouts': [item]} if section == 'weeks' else item]}
+            conditions.append(db.type_coerce(column, JSONB).contains(containment))
+        return db.or_(*conditions)
+    
+    # json_tree entrecomilla en la ruta las claves con caracteres especiales (."main_exercises"[0])
+    tree = db.func.json_tree(column, f'$.{section}').table_valued('key', 'value', 'path').alias()
+    paths = [tree.c.path.like(pattern) for key in items_keys for pattern in (f'%.{key}[%', f'%."{key}"[%')]
+    return db.exists().where(tree.c.key == 'name', tree.c.value == name, db.or_(*paths))
+
+
+class PlanFieldsMixin:
+    """Respuestas parciales de los planes (``fields=`` o ``view=summary``).
+    
+    Cada clase declara en FIELD_COLUMNS las columnas que necesita cada campo
+    de to_dict(); al pedir solo algunos campos, la consulta carga solo esas
+    columnas y las demás (sobre todo plan_data) no se leen de la base de datos.
+    """
+    FIELD_COLUMNS: dict = {}
+    SUMMARY_FIELDS: tuple = ()
+    
+    @classmethod
+    def select_fields(cls, fields=None, view=None):
+        """Campos pedidos en la query string, o None para el plan completo.
+        
+        Lanza ValueError si algún campo o la vista no existen.
+        """
+        if fields:
+            selected = [field.strip() for field in fields.split(',') if field.strip()]
+            unknown = [field for field in selected if field not in cls.FIELD_COLUMNS]
+            if unknown:
+                raise ValueError(f"Campos no válidos: {', '.join(unknown)}")
+            # El id siempre se incluye para poder pedir después el plan completo
+            return ['id'] + [field for field in dict.fromkeys(selected) if field != 'id']
+        if view in (None, '', 'full'):
+            return None
+        if view == 'summary':
+            return list(cls.SUMMARY_FIELDS)
+        raise ValueError(f"Vista no válida: {view}")
+    
+    @classmethod
+    def load_options(cls, fields):
+        """Opciones de consulta que cargan solo las columnas de ``fields``"""
+        if fields is None:
+            return []
+        columns = dict.fromkeys(column for field in fields for column in cls.FIELD_COLUMNS[field])
+        return [load_only(*(getattr(cls, column) for column in columns))]
+    
+    def to_dict(self, fields=None):
+        """Convierte el plan a diccionario; ``fields`` limita los campos incluidos"""
+        return {field: self._field_value(field) for field in (fields or self.FIELD_COLUMNS)}
+    
+    def _field_value(self, field):
+        if field == 'plan_data':
+            return self.get_plan_data()
+        if field == 'token_usage':
+            return self.token_usage or 0
+        if field == 'created_at':
+            return self.created_at.isoformat() if self.created_at else None
+        return getattr(self, field)
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -26,11 +117,16 @@ class User(db.Model):
     subscription_type = db.Column(db.String(20), default='basic')  # basic, premium, pro
     subscription_expires = db.Column(db.DateTime)
     
+    # Entrenador que gestiona al usuario (cuentas pro)
+    coach_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    
     # Metadatos
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     is_active = db.Column(db.Boolean, default=True)
+    # Aumenta con cada cambio del perfil, planes o registros (ETag de las rutas de lectura)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relaciones
     workout_plans = db.relationship('WorkoutPlan', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -59,10 +155,19 @@ class User(db.Model):
             'activity_level': self.activity_level,
             'dietary_restrictions': self.dietary_restrictions,
             'subscription_type': self.subscription_type,
+            'tier': self.tier,  # nivel vigente: basic si la suscripción caducó
+            'coach_id': self.coach_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login': self.last_login.isoformat() if self.last_login else None
         }
     
+    @property
+    def tier(self):
+        """Nivel de suscripción vigente (las suscripciones caducadas cuentan como basic)"""
+        if self.subscription_expires and self.subscription_expires <= datetime.utcnow():
+            return 'basic'
+        return self.subscription_type or 'basic'
+    
     def update_from_dict(self, data):
         """Actualiza el usuario desde un diccionario"""
         allowed_fields = [
@@ -80,8 +185,23 @@ class User(db.Model):
         return f'<User {self.email}>'
 
 
-class WorkoutPlan(db.Model):
+class WorkoutPlan(PlanFieldsMixin, db.Model):
     __tablename__ = 'workout_plans'
+    __table_args__ = (
+        # Paginación por cursor: cada página es un rango del índice
+        db.Index('ix_workout_plans_user_created', 'user_id', 'created_at', 'id'),
+        # Listados y estadísticas filtrados por estado
+        db.Index('ix_workout_plans_user_status_created', 'user_id', 'status', 'created_at'),
+        plan_data_index('workout_plans')
+    )
+    
+    FIELD_COLUMNS = {field: (field,) for field in (
+        'id', 'name', 'description', 'duration_weeks', 'workouts_per_week', 'difficulty',
+        'status', 'progress', 'token_usage', 'created_at'
+    )}
+    FIELD_COLUMNS['plan_data'] = ('plan_data', 'storage')
+    SUMMARY_FIELDS = ('id', 'name', 'duration_weeks', 'workouts_per_week', 'difficulty', 'status', 'progress',
+                      'created_at')
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -93,42 +213,89 @@ class WorkoutPlan(db.Model):
     difficulty = db.Column(db.String(20))  # beginner, intermediate, advanced
     
     # Plan generado por IA
-    plan_data = db.Column(db.Text)  # JSON con los entrenamientos
+    plan_data = db.Column(PlanJSON)  # entrenamientos (se decodifica una vez al cargar la fila)
+    token_usage = db.Column(db.Integer, default=0)  # tokens del LLM consumidos al generarlo
+    # blob: todo en plan_data; normalized: semanas, sesiones y ejercicios en tablas propias
+    storage = db.Column(db.String(20), default=default_workout_storage, server_default='blob')
     
     # Estado
-    status = db.Column(db.String(20), default='active')  # active, completed, paused
+    status = db.Column(db.String(20), default='active')  # generating, active, completed, paused
     progress = db.Column(db.Float, default=0.0)  # porcentaje de completado
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def get_plan_data(self):
-        """Obtiene los datos del plan como diccionario"""
-        if self.plan_data:
-            return json.loads(self.plan_data)
-        return {}
+        """Obtiene los datos del plan como diccionario (el ya decodificado, sin copiarlo)"""
+        if self.storage != 'normalized':
+            return self.plan_data or {}
+        if self.__dict__.get('_assembled') is None:
+            from models.workout_structure import assemble_plans
+            assemble_plans([self])
+        return self._assembled
     
     def set_plan_data(self, data):
-        """Establece los datos del plan desde un diccionario"""
-        self.plan_data = json.dumps(data)
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'duration_weeks': self.duration_weeks,
-            'workouts_per_week': self.workouts_per_week,
-            'difficulty': self.difficulty,
-            'status': self.status,
-            'progress': self.progress,
-            'plan_data': self.get_plan_data(),
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+        """Establece los datos del plan; solo se reescribe en la base de datos si cambian"""
+        if self.storage is None:
+            self.storage = default_workout_storage()
+        if self.storage == 'normalized':
+            from models.workout_structure import split_plan_data
+            # La estructura se escribe con inserciones masivas en el flush, cuando ya hay id
+            self.__dict__['_pending_structure'] = data
+            self._assembled = data
+            self.plan_data = split_plan_data(None, data)[0]
+            self.updated_at = datetime.utcnow()
+        # __dict__ para no recargar la fila si el atributo caducó tras un commit
+        elif data is self.__dict__.get('plan_data'):
+            # Modificado en el sitio: el ORM no puede detectarlo comparando con el valor cargado
+            flag_modified(self, 'plan_data')
+        else:
+            self.plan_data = data
+    
+    def mark_workout(self, week_index, workout_index, completed):
+        """Marca una sesión como hecha; False si no existe. No hace commit.
+        
+        En los planes normalizados es un UPDATE de una sola fila; en los demás
+        se reescribe plan_data.
+        """
+        if self.storage == 'normalized':
+            from models.workout_structure import mark_workout
+            return mark_workout(self, week_index, workout_index, completed)
+        
+        plan_data = self.get_plan_data()
+        try:
+            workout = plan_data['weeks'][week_index]['workouts'][workout_index]
+        except (KeyError, IndexError, TypeError):
+            return False
+        if not isinstance(workout, dict):
+            return False
+        workout['completed'] = completed
+        self.set_plan_data(plan_data)
+        return True
+    
+    @classmethod
+    def contains_exercise(cls, name):
+        """Condición SQL: el plan incluye un ejercicio con ese nombre exacto"""
+        from models.workout_structure import MAIN_SECTIONS, PlanExercise
+        normalized = db.exists().where(PlanExercise.plan_id == cls.id, PlanExercise.section.in_(MAIN_SECTIONS),
+                                       PlanExercise.name == name)
+        return db.or_(plan_contains(cls.plan_data, 'weeks', MAIN_SECTIONS, name), normalized)
 
 
-class NutritionPlan(db.Model):
+class NutritionPlan(PlanFieldsMixin, db.Model):
     __tablename__ = 'nutrition_plans'
+    __table_args__ = (
+        db.Index('ix_nutrition_plans_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_nutrition_plans_user_status_created', 'user_id', 'status', 'created_at'),
+        plan_data_index('nutrition_plans')
+    )
+    
+    FIELD_COLUMNS = {
+        **{field: (field,) for field in ('id', 'name', 'description', 'daily_calories', 'duration_weeks')},
+        'macros': ('protein_percentage', 'carbs_percentage', 'fats_percentage'),
+        **{field: (field,) for field in ('status', 'progress', 'plan_data', 'token_usage', 'created_at')}
+    }
+    SUMMARY_FIELDS = ('id', 'name', 'daily_calories', 'duration_weeks', 'macros', 'status', 'progress', 'created_at')
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -144,7 +311,8 @@ class NutritionPlan(db.Model):
     fats_percentage = db.Column(db.Float)
     
     # Plan generado por IA
-    plan_data = db.Column(db.Text)  # JSON con las comidas
+    plan_data = db.Column(PlanJSON)  # comidas (se decodifica una vez al cargar la fila)
+    token_usage = db.Column(db.Integer, default=0)  # tokens del LLM consumidos al generarlo
     
     # Estado
     status = db.Column(db.String(20), default='active')
@@ -154,34 +322,35 @@ class NutritionPlan(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def get_plan_data(self):
-        if self.plan_data:
-            return json.loads(self.plan_data)
-        return {}
+        return self.plan_data or {}
     
     def set_plan_data(self, data):
-        self.plan_data = json.dumps(data)
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'daily_calories': self.daily_calories,
-            'duration_weeks': self.duration_weeks,
-            'macros': {
+        if data is self.__dict__.get('plan_data'):
+            flag_modified(self, 'plan_data')
+        else:
+            self.plan_data = data
+    
+    @classmethod
+    def contains_food(cls, name):
+        """Condición SQL: alguna comida del plan incluye un alimento con ese nombre exacto"""
+        return plan_contains(cls.plan_data, 'daily_meals', ('foods',), name)
+    
+    def _field_value(self, field):
+        if field == 'macros':
+            return {
                 'protein': self.protein_percentage,
                 'carbs': self.carbs_percentage,
                 'fats': self.fats_percentage
-            },
-            'status': self.status,
-            'progress': self.progress,
-            'plan_data': self.get_plan_data(),
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+            }
+        return super()._field_value(field)
 
 
 class ProgressEntry(db.Model):
     __tablename__ = 'progress_entries'
+    __table_args__ = (
+        # Un registro por usuario y día; también sirve a la paginación por (date, id)
+        db.UniqueConstraint('user_id', 'date', name='uq_progress_entries_user_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -202,6 +371,40 @@ class ProgressEntry(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    MEASUREMENT_FIELDS = ('weight', 'body_fat', 'muscle_mass', 'chest', 'waist', 'hips', 'arms', 'thighs')
+    
+    @classmethod
+    def upsert(cls, user_id, entry_date, values):
+        """Crea o completa el registro del día con un único INSERT ... ON CONFLICT.
+        
+        La restricción única (user_id, date) resuelve la carrera entre dos
+        peticiones del mismo día. Los campos que no llegan (o las notas
+        vacías) conservan el valor guardado. Devuelve (id, creado).
+        """
+        if db.session.get_bind().dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        
+        now = datetime.utcnow()
+        stmt = insert(cls).values(user_id=user_id, date=entry_date, created_at=now, **values)
+        table = cls.__table__.c
+        update = {field: db.func.coalesce(stmt.excluded[field], table[field]) for field in cls.MEASUREMENT_FIELDS}
+        update['notes'] = db.func.coalesce(db.func.nullif(stmt.excluded.notes, ''), table.notes)
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'date'], set_=update)\
+            .returning(cls.id, cls.created_at)
+        
+        row = db.session.execute(stmt).one()
+        # El upsert no pasa por el ORM: los agregados, resúmenes y la versión de datos se actualizan aquí
+        from models.data_version import bump_data_version
+        from models.progress_rollups import refresh_rollups
+        from models.user_stats import refresh_progress_stats
+        refresh_progress_stats(db.session.connection(), int(user_id))
+        refresh_rollups(db.session.connection(), int(user_id), [entry_date])
+        bump_data_version(db.session.connection(), user_id)
+        # Si hubo conflicto, created_at es el del registro existente
+        return row.id, row.created_at == now
+    
     def to_dict(self):
         return {
             'id': self.id,
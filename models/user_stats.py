@@ -0,0 +1,332 @@
+"""Agregados por usuario para los endpoints de estadísticas.
+
+La fila de user_stats de cada usuario se mantiene en la misma transacción
+que las escrituras de planes y registros de progreso (eventos del mapper
+durante el flush), de modo que las estadísticas se leen con una consulta
+por clave primaria en lugar de cargar y recorrer todos los planes.
+
+- Planes: se aplican deltas atómicos (``col = col + n``) a los recuentos
+  por estado, la suma de progreso y las calorías; los valores anteriores y
+  nuevos se leen de la fila en la base de datos, no del objeto en memoria.
+- Progreso: la parte de progreso se recalcula con consultas sobre el índice
+  (user_id, date), porque el upsert diario no pasa por el ORM.
+
+Si falta la fila, se construye desde las tablas de origen antes de aplicar
+el primer cambio. ``rebuild_user_stats`` repara cualquier desviación.
+"""
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+
+from app import db
+from models.user import NutritionPlan, ProgressEntry, User, WorkoutPlan
+
+logger = logging.getLogger(__name__)
+
+# Prefijo de las columnas de cada tipo de plan
+PLAN_PREFIXES = {WorkoutPlan: 'workout', NutritionPlan: 'nutrition'}
+# Columnas de los planes que afectan a los agregados
+PLAN_STAT_ATTRS = ('status', 'progress', 'daily_calories')
+
+
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+
+    workout_plans = db.Column(db.Integer, nullable=False, default=0)
+    workout_active = db.Column(db.Integer, nullable=False, default=0)
+    workout_completed = db.Column(db.Integer, nullable=False, default=0)
+    workout_progress_sum = db.Column(db.Float, nullable=False, default=0.0)
+    workout_latest_id = db.Column(db.Integer)
+
+    nutrition_plans = db.Column(db.Integer, nullable=False, default=0)
+    nutrition_active = db.Column(db.Integer, nullable=False, default=0)
+    nutrition_completed = db.Column(db.Integer, nullable=False, default=0)
+    nutrition_progress_sum = db.Column(db.Float, nullable=False, default=0.0)
+    nutrition_calories_sum = db.Column(db.Float, nullable=False, default=0.0)
+    nutrition_calories_count = db.Column(db.Integer, nullable=False, default=0)
+    nutrition_latest_id = db.Column(db.Integer)
+
+    progress_entries = db.Column(db.Integer, nullable=False, default=0)
+    first_entry_date = db.Column(db.Date)
+    last_entry_date = db.Column(db.Date)
+    first_weight = db.Column(db.Float)  # primer y último registro con peso
+    last_weight = db.Column(db.Float)
+    streak_days = db.Column(db.Integer, nullable=False, default=0)  # días seguidos que terminan en last_entry_date
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def plan_summary(self, prefix):
+        """Recuentos y progreso medio de los planes de un tipo (workout o nutrition)"""
+        total = getattr(self, f'{prefix}_plans')
+        return {
+            'total_plans': total,
+            'active_plans': getattr(self, f'{prefix}_active'),
+            'completed_plans': getattr(self, f'{prefix}_completed'),
+            'average_progress': round(getattr(self, f'{prefix}_progress_sum') / total, 1) if total else 0
+        }
+
+    @property
+    def average_calories(self):
+        if not self.nutrition_calories_count:
+            return 0
+        return round(self.nutrition_calories_sum / self.nutrition_calories_count, 0)
+
+    @property
+    def current_streak(self):
+        """Racha vigente: solo cuenta si el último registro es de hoy"""
+        return self.streak_days if self.last_entry_date == date.today() else 0
+
+    @property
+    def weight_change(self):
+        if self.progress_entries < 2 or self.first_weight is None or self.last_weight is None:
+            return 0
+        return round(self.last_weight - self.first_weight, 1)
+
+
+def _insert(connection):
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(UserStats.__table__)
+
+
+def _plan_values(connection, model, user_id):
+    table = model.__table__
+    columns = [
+        db.func.count(),
+        db.func.coalesce(db.func.sum(db.case((table.c.status == 'active', 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((table.c.status == 'completed', 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(table.c.progress), 0.0)
+    ]
+    if model is NutritionPlan:
+        columns += [db.func.coalesce(db.func.sum(table.c.daily_calories), 0.0), db.func.count(table.c.daily_calories)]
+    row = connection.execute(db.select(*columns).where(table.c.user_id == user_id)).one()
+
+    prefix = PLAN_PREFIXES[model]
+    values = dict(zip((f'{prefix}_plans', f'{prefix}_active', f'{prefix}_completed', f'{prefix}_progress_sum',
+                       'nutrition_calories_sum', 'nutrition_calories_count'), row))
+    values[f'{prefix}_latest_id'] = connection.execute(_latest_plan_query(model, user_id)).scalar()
+    return values
+
+
+def _latest_plan_query(model, user_id, exclude_id=None):
+    table = model.__table__
+    query = db.select(table.c.id).where(table.c.user_id == user_id)
+    if exclude_id is not None:
+        query = query.where(table.c.id != exclude_id)
+    return query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(1)
+
+
+def _progress_values(connection, user_id):
+    table = ProgressEntry.__table__
+    count, first_date, last_date = connection.execute(
+        db.select(db.func.count(), db.func.min(table.c.date), db.func.max(table.c.date))
+        .where(table.c.user_id == user_id)
+    ).one()
+
+    weighted = db.select(table.c.weight).where(table.c.user_id == user_id, table.c.weight.isnot(None)).limit(1)
+    first_weight = connection.execute(weighted.order_by(table.c.date)).scalar()
+    last_weight = connection.execute(weighted.order_by(table.c.date.desc())).scalar()
+
+    # Racha: días consecutivos hacia atrás desde el último registro (se deja de leer en el primer hueco)
+    streak, expected = 0, None
+    dates = connection.execute(db.select(table.c.date).where(table.c.user_id == user_id).order_by(table.c.date.desc()))
+    for (entry_date,) in dates:
+        if expected is not None and entry_date != expected:
+            break
+        streak += 1
+        expected = entry_date - timedelta(days=1)
+    dates.close()
+
+    return {
+        'progress_entries': count,
+        'first_entry_date': first_date,
+        'last_entry_date': last_date,
+        'first_weight': first_weight,
+        'last_weight': last_weight,
+        'streak_days': streak
+    }
+
+
+def compute_user_stats(connection, user_id):
+    """Valores de user_stats de un usuario calculados desde las tablas de origen"""
+    values = {}
+    for model in PLAN_PREFIXES:
+        values.update(_plan_values(connection, model, user_id))
+    values.update(_progress_values(connection, user_id))
+    return values
+
+
+def _exists(connection, user_id):
+    table = UserStats.__table__
+    return connection.execute(db.select(table.c.user_id).where(table.c.user_id == user_id)).first() is not None
+
+
+def ensure_user_stats(connection, user_id):
+    """Crea la fila del usuario (calculada desde el origen) si todavía no existe"""
+    if _exists(connection, user_id):
+        return
+    values = compute_user_stats(connection, user_id)
+    connection.execute(_insert(connection).values(user_id=user_id, updated_at=datetime.utcnow(), **values)
+                       .on_conflict_do_nothing(index_elements=['user_id']))
+
+
+def _apply(connection, user_id, deltas=None, values=None):
+    table = UserStats.__table__
+    changes = {column: table.c[column] + delta for column, delta in (deltas or {}).items() if delta}
+    changes.update(values or {})
+    if changes:
+        connection.execute(table.update().where(table.c.user_id == user_id)
+                           .values(updated_at=datetime.utcnow(), **changes))
+
+
+def _row_stats(connection, model, plan_id):
+    """Aportación de un plan a los agregados, leída de su fila en la base de datos"""
+    table = model.__table__
+    calories = table.c.daily_calories if model is NutritionPlan else db.null()
+    row = connection.execute(db.select(table.c.status, table.c.progress, calories).where(table.c.id == plan_id)).one()
+    prefix = PLAN_PREFIXES[model]
+    status, progress, daily_calories = row
+    contribution = {
+        f'{prefix}_plans': 1,
+        f'{prefix}_active': int(status == 'active'),
+        f'{prefix}_completed': int(status == 'completed'),
+        f'{prefix}_progress_sum': progress or 0.0
+    }
+    if model is NutritionPlan:
+        contribution['nutrition_calories_sum'] = daily_calories or 0
+        contribution['nutrition_calories_count'] = int(daily_calories is not None)
+    return contribution
+
+
+def _plan_changed(plan):
+    state = db.inspect(plan)
+    return any(attr in state.mapper.column_attrs and state.attrs[attr].history.has_changes()
+               for attr in PLAN_STAT_ATTRS)
+
+
+# El user_id puede llegar como texto (identidad del JWT) hasta que se recarga el objeto
+def _before_plan_insert(mapper, connection, plan):
+    ensure_user_stats(connection, int(plan.user_id))
+
+
+def _after_plan_insert(mapper, connection, plan):
+    model = mapper.class_
+    _apply(connection, int(plan.user_id), deltas=_row_stats(connection, model, plan.id),
+           values={f'{PLAN_PREFIXES[model]}_latest_id': plan.id})
+
+
+def _before_plan_update(mapper, connection, plan):
+    ensure_user_stats(connection, int(plan.user_id))
+    if _plan_changed(plan):
+        plan.__dict__['_stats_before'] = _row_stats(connection, mapper.class_, plan.id)
+
+
+def _after_plan_update(mapper, connection, plan):
+    before = plan.__dict__.pop('_stats_before', None)
+    if before is not None:
+        after = _row_stats(connection, mapper.class_, plan.id)
+        _apply(connection, int(plan.user_id), deltas={column: after[column] - before[column] for column in after})
+
+
+def _before_plan_delete(mapper, connection, plan):
+    model = mapper.class_
+    prefix = PLAN_PREFIXES[model]
+    user_id = int(plan.user_id)
+    ensure_user_stats(connection, user_id)
+    before = _row_stats(connection, model, plan.id)
+
+    table = UserStats.__table__
+    latest = db.case(
+        (table.c[f'{prefix}_latest_id'] == plan.id, _latest_plan_query(model, user_id, plan.id).scalar_subquery()),
+        else_=table.c[f'{prefix}_latest_id']
+    )
+    _apply(connection, user_id, deltas={column: -value for column, value in before.items()},
+           values={f'{prefix}_latest_id': latest})
+
+
+for _model in PLAN_PREFIXES:
+    event.listen(_model, 'before_insert', _before_plan_insert)
+    event.listen(_model, 'after_insert', _after_plan_insert)
+    event.listen(_model, 'before_update', _before_plan_update)
+    event.listen(_model, 'after_update', _after_plan_update)
+    event.listen(_model, 'before_delete', _before_plan_delete)
+
+
+def refresh_progress_stats(connection, user_id):
+    """Recalcula la parte de progreso de la fila del usuario (tras crear, cambiar o borrar registros)"""
+    if not _exists(connection, user_id):
+        ensure_user_stats(connection, user_id)
+        return
+    _apply(connection, user_id, values=_progress_values(connection, user_id))
+
+
+@event.listens_for(ProgressEntry, 'after_insert')
+@event.listens_for(ProgressEntry, 'after_update')
+@event.listens_for(ProgressEntry, 'after_delete')
+def _after_progress_change(mapper, connection, entry):
+    refresh_progress_stats(connection, int(entry.user_id))
+
+
+@event.listens_for(User, 'before_delete')
+def _delete_user_stats(mapper, connection, user):
+    table = UserStats.__table__
+    connection.execute(table.delete().where(table.c.user_id == user.id))
+
+
+def load_user_stats(user_id, *entities, join=None, options=()):
+    """Fila de estadísticas del usuario (creándola la primera vez) y, opcionalmente, entidades unidas.
+
+    Con ``entities`` devuelve una tupla (stats, *entidades) de una sola consulta.
+    Devuelve None si el usuario no existe.
+    """
+    user_id = int(user_id)
+    query = db.session.query(UserStats, *entities)
+    for target, onclause in join or ():
+        query = query.outerjoin(target, onclause)
+    query = query.filter(UserStats.user_id == user_id).options(*options)
+
+    row = query.first()
+    if row is None:
+        if db.session.get(User, user_id) is None:
+            return None
+        ensure_user_stats(db.session.connection(), user_id)
+        db.session.commit()
+        row = query.first()
+    return row
+
+
+def rebuild_user_stats(user_id=None, batch_size=500):
+    """Recalcula user_stats desde las tablas de origen y corrige las filas desviadas"""
+    connection = db.session.connection()
+    table = UserStats.__table__
+    user_ids = [int(user_id)] if user_id is not None else \
+        [row[0] for row in db.session.execute(db.select(User.id).order_by(User.id))]
+    summary = {'users': 0, 'created': 0, 'repaired': 0}
+
+    for start in range(0, len(user_ids), batch_size):
+        for uid in user_ids[start:start + batch_size]:
+            expected = compute_user_stats(connection, uid)
+            current = connection.execute(db.select(table).where(table.c.user_id == uid)).mappings().first()
+            summary['users'] += 1
+            if current is None:
+                connection.execute(_insert(connection).values(user_id=uid, updated_at=datetime.utcnow(), **expected))
+                summary['created'] += 1
+            elif any(not _same(current[column], value) for column, value in expected.items()):
+                _apply(connection, uid, values=expected)
+                summary['repaired'] += 1
+        db.session.commit()
+        connection = db.session.connection()
+
+    logger.info(f"user_stats reconstruida: {summary}")
+    return summary
+
+
+def _same(current, expected):
+    if isinstance(current, float) or isinstance(expected, float):
+        return current is not None and expected is not None and abs(current - expected) < 1e-6
+    return current == expected
@@ -0,0 +1,278 @@
+"""Estructura normalizada de los planes de entrenamiento.
+
+Un plan con ``storage='normalized'`` guarda sus semanas, sesiones y
+ejercicios en plan_weeks, plan_workouts y plan_exercises; en plan_data solo
+queda el resto del JSON (nombre, consejos, notas de seguridad...). Así se
+puede marcar una sesión con un UPDATE de una fila o contar los ejercicios
+de un usuario con SQL, sin cargar ni reescribir el plan entero.
+
+Las claves conocidas de cada nivel van a sus columnas y las demás a
+``extra``, de modo que el JSON se reconstruye sin perder nada. Una lista
+solo se normaliza si es una lista no vacía de objetos; si no, también se
+conserva tal cual en ``extra`` (o en plan_data).
+"""
+from collections import defaultdict
+
+from sqlalchemy import event
+
+from app import db
+from models.data_version import bump_data_version
+from models.user import PlanJSON, WorkoutPlan
+
+# Secciones de una sesión que contienen ejercicios, en el orden en que se reconstruyen
+EXERCISE_SECTIONS = ('exercises', 'warm_up', 'main_exercises', 'cool_down')
+# Secciones con los ejercicios principales (las que cuentan en las estadísticas)
+MAIN_SECTIONS = ('exercises', 'main_exercises')
+
+WEEK_COLUMNS = {'week': int, 'focus': str}
+WORKOUT_COLUMNS = {'day': str, 'name': str, 'duration_minutes': int, 'completed': bool}
+EXERCISE_COLUMNS = {'name': str, 'sets': int, 'reps': str, 'rest_seconds': int}
+
+
+def _plan_fk():
+    return db.ForeignKey('workout_plans.id', ondelete='CASCADE')
+
+
+class PlanWeek(db.Model):
+    __tablename__ = 'plan_weeks'
+
+    plan_id = db.Column(db.Integer, _plan_fk(), primary_key=True)
+    week_index = db.Column(db.Integer, primary_key=True)  # posición en plan_data['weeks'] (desde 0)
+
+    week = db.Column(db.Integer)
+    focus = db.Column(db.Text)
+    extra = db.Column(PlanJSON)  # resto de claves de la semana
+
+
+class PlanWorkout(db.Model):
+    __tablename__ = 'plan_workouts'
+
+    plan_id = db.Column(db.Integer, _plan_fk(), primary_key=True)
+    week_index = db.Column(db.Integer, primary_key=True)
+    workout_index = db.Column(db.Integer, primary_key=True)
+
+    day = db.Column(db.Text)
+    name = db.Column(db.Text)
+    duration_minutes = db.Column(db.Integer)
+    completed = db.Column(db.Boolean)  # None si la sesión nunca se marcó
+    extra = db.Column(PlanJSON)
+
+
+class PlanExercise(db.Model):
+    __tablename__ = 'plan_exercises'
+
+    plan_id = db.Column(db.Integer, _plan_fk(), primary_key=True)
+    week_index = db.Column(db.Integer, primary_key=True)
+    workout_index = db.Column(db.Integer, primary_key=True)
+    section = db.Column(db.String(20), primary_key=True)  # exercises, warm_up, main_exercises, cool_down
+    position = db.Column(db.Integer, primary_key=True)
+
+    name = db.Column(db.Text)
+    sets = db.Column(db.Integer)
+    reps = db.Column(db.Text)
+    rest_seconds = db.Column(db.Integer)
+    extra = db.Column(PlanJSON)
+
+
+def _is_rows(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+
+def _split(item, columns, nested=()):
+    """Separa las claves de ``item`` en columnas (si el tipo encaja) y ``extra``"""
+    row, extra = {}, {}
+    for key, value in item.items():
+        expected = columns.get(key)
+        if key in nested and _is_rows(value):
+            continue
+        # bool es subclase de int: no se acepta donde se espera un número
+        if expected and isinstance(value, expected) and not (expected is int and isinstance(value, bool)):
+            row[key] = value
+        else:
+            extra[key] = value
+    for key in columns:
+        row.setdefault(key, None)
+    row['extra'] = extra or None
+    return row
+
+
+def split_plan_data(plan_id, data):
+    """Descompone plan_data en (resto del JSON, filas de semanas, sesiones y ejercicios)"""
+    data = data or {}
+    meta = {key: value for key, value in data.items() if not (key == 'weeks' and _is_rows(value))}
+    weeks, workouts, exercises = [], [], []
+
+    for week_index, week in enumerate(data['weeks'] if 'weeks' in data and 'weeks' not in meta else []):
+        weeks.append(dict(_split(week, WEEK_COLUMNS, ('workouts',)), plan_id=plan_id, week_index=week_index))
+        for workout_index, workout in enumerate(week['workouts'] if _is_rows(week.get('workouts')) else []):
+            keys = {'plan_id': plan_id, 'week_index': week_index, 'workout_index': workout_index}
+            workouts.append(dict(_split(workout, WORKOUT_COLUMNS, EXERCISE_SECTIONS), **keys))
+            for section in EXERCISE_SECTIONS:
+                items = workout.get(section)
+                for position, exercise in enumerate(items if _is_rows(items) else []):
+                    exercises.append(dict(_split(exercise, EXERCISE_COLUMNS), section=section, position=position,
+                                          **keys))
+    return meta, weeks, workouts, exercises
+
+
+def _merge(columns, row, extra):
+    item = {key: row[key] for key in columns if row[key] is not None}
+    item.update(extra or {})
+    return item
+
+
+def load_weeks(plan_ids):
+    """Semanas de cada plan reconstruidas con una única consulta con joins"""
+    week, workout, exercise = PlanWeek.__table__, PlanWorkout.__table__, PlanExercise.__table__
+    columns = [week.c.plan_id, week.c.week_index, week.c.week, week.c.focus, week.c.extra.label('week_extra'),
+               workout.c.workout_index, workout.c.day, workout.c.name.label('workout_name'),
+               workout.c.duration_minutes, workout.c.completed, workout.c.extra.label('workout_extra'),
+               exercise.c.section, exercise.c.position, exercise.c.name, exercise.c.sets, exercise.c.reps,
+               exercise.c.rest_seconds, exercise.c.extra]
+    query = db.select(*columns)\
+        .select_from(week)\
+        .outerjoin(workout, db.and_(workout.c.plan_id == week.c.plan_id, workout.c.week_index == week.c.week_index))\
+        .outerjoin(exercise, db.and_(exercise.c.plan_id == workout.c.plan_id,
+                                     exercise.c.week_index == workout.c.week_index,
+                                     exercise.c.workout_index == workout.c.workout_index))\
+        .where(week.c.plan_id.in_(plan_ids))\
+        .order_by(week.c.plan_id, week.c.week_index, workout.c.workout_index, exercise.c.section, exercise.c.position)
+
+    weeks = defaultdict(list)
+    workouts = []
+    week_key = workout_key = None
+    for row in db.session.execute(query).mappings():
+        if (row['plan_id'], row['week_index']) != week_key:
+            week_key, workout_key = (row['plan_id'], row['week_index']), None
+            week_item = _merge(WEEK_COLUMNS, row, row['week_extra'])
+            weeks[row['plan_id']].append(week_item)
+        if row['workout_index'] is None:
+            continue
+
+        if row['workout_index'] != workout_key:
+            workout_key = row['workout_index']
+            workout_item = _merge(WORKOUT_COLUMNS, dict(row, name=row['workout_name']), row['workout_extra'])
+            week_item.setdefault('workouts', []).append(workout_item)
+            sections = {}
+            workouts.append((workout_item, sections))
+        if row['section'] is not None:
+            sections.setdefault(row['section'], []).append(_merge(EXERCISE_COLUMNS, row, row['extra']))
+
+    # Las secciones se añaden en el orden habitual del JSON
+    for workout_item, sections in workouts:
+        workout_item.update((section, sections[section]) for section in EXERCISE_SECTIONS if section in sections)
+    return weeks
+
+
+def assemble_plans(plans):
+    """Precarga con una sola consulta el JSON de los planes normalizados de ``plans``"""
+    pending = {plan.id: plan for plan in plans
+               if plan.storage == 'normalized' and plan.__dict__.get('_assembled') is None}
+    if not pending:
+        return
+    weeks = load_weeks(list(pending))
+    for plan_id, plan in pending.items():
+        data = dict(plan.plan_data or {})
+        if plan_id in weeks:
+            data['weeks'] = weeks[plan_id]
+        plan._assembled = data
+
+
+def _delete_structure(connection, plan_id):
+    for model in (PlanExercise, PlanWorkout, PlanWeek):
+        connection.execute(model.__table__.delete().where(model.__table__.c.plan_id == plan_id))
+
+
+def write_structure(connection, plan_id, weeks, workouts, exercises):
+    """Sustituye la estructura de un plan: un DELETE y un INSERT masivo por tabla"""
+    _delete_structure(connection, plan_id)
+    for model, rows in ((PlanWeek, weeks), (PlanWorkout, workouts), (PlanExercise, exercises)):
+        if rows:
+            connection.execute(model.__table__.insert(), rows)
+
+
+@event.listens_for(WorkoutPlan, 'after_insert')
+@event.listens_for(WorkoutPlan, 'after_update')
+def _flush_pending_structure(mapper, connection, plan):
+    """Escribe en el mismo flush la estructura pendiente de set_plan_data (ya se conoce el id)"""
+    data = plan.__dict__.pop('_pending_structure', None)
+    if data is None:
+        return
+    _, weeks, workouts, exercises = split_plan_data(plan.id, data)
+    write_structure(connection, plan.id, weeks, workouts, exercises)
+
+
+@event.listens_for(WorkoutPlan, 'after_delete')
+def _delete_plan_structure(mapper, connection, plan):
+    # SQLite no aplica ON DELETE CASCADE salvo con PRAGMA foreign_keys
+    _delete_structure(connection, plan.id)
+
+
+def forget_assembled(plan):
+    """Descarta el JSON ensamblado en memoria: la próxima lectura lo reconstruye desde las tablas"""
+    plan.__dict__.pop('_assembled', None)
+
+
+@event.listens_for(WorkoutPlan, 'expire')
+@event.listens_for(WorkoutPlan, 'refresh')
+def _forget_assembled(plan, *args):
+    forget_assembled(plan)
+
+
+def convert_plan_storage(plan, storage):
+    """Pasa un plan existente a otro almacenamiento (blob o normalized). No hace commit"""
+    if plan.storage == storage:
+        return False
+    data = plan.get_plan_data()
+    if storage == 'normalized':
+        plan.storage = storage
+        plan.set_plan_data(data)
+    else:
+        _delete_structure(db.session.connection(), plan.id)
+        plan.storage = storage
+        forget_assembled(plan)
+        plan.plan_data = data
+    return True
+
+
+def mark_workout(plan, week_index, workout_index, completed):
+    """Marca una sesión como hecha (o no) con un UPDATE de una sola fila.
+
+    Devuelve False si la sesión no existe. No hace commit.
+    """
+    # La fila del plan se bloquea igual que al regenerar una parte: así la marca no
+    # se cuela entre la relectura y la reescritura de la estructura y se pierde
+    db.session.execute(db.select(WorkoutPlan.id).where(WorkoutPlan.id == plan.id).with_for_update())
+    result = db.session.execute(
+        db.update(PlanWorkout)
+        .where(PlanWorkout.plan_id == plan.id, PlanWorkout.week_index == week_index,
+               PlanWorkout.workout_index == workout_index)
+        .values(completed=completed)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    bump_data_version(db.session.connection(), plan.user_id)
+
+    assembled = plan.__dict__.get('_assembled')
+    if assembled is not None:
+        assembled['weeks'][week_index]['workouts'][workout_index]['completed'] = completed
+    return True
+
+
+def top_exercises(user_id, limit):
+    """Ejercicios principales más frecuentes en los planes normalizados de un usuario"""
+    completed = db.func.sum(db.case((PlanWorkout.completed.is_(True), 1), else_=0))
+    planned = db.func.count()
+    rows = db.session.query(PlanExercise.name, planned, completed)\
+        .join(PlanWorkout, db.and_(PlanWorkout.plan_id == PlanExercise.plan_id,
+                                   PlanWorkout.week_index == PlanExercise.week_index,
+                                   PlanWorkout.workout_index == PlanExercise.workout_index))\
+        .join(WorkoutPlan, WorkoutPlan.id == PlanExercise.plan_id)\
+        .filter(WorkoutPlan.user_id == user_id, PlanExercise.section.in_(MAIN_SECTIONS),
+                PlanExercise.name.isnot(None))\
+        .group_by(PlanExercise.name)\
+        .order_by(completed.desc(), planned.desc(), PlanExercise.name)\
+        .limit(limit)\
+        .all()
+    return [{'name': name, 'planned': planned, 'completed': completed} for name, planned, completed in rows]
@@ -1,20 +1,113 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import openai
 import json
+import logging
+import math
+import re
 from app import db
 from models.user import User, WorkoutPlan, NutritionPlan
+from models.ai import AIJob
+from models.workout_structure import forget_assembled
+from utils.ai_jobs import job_handler, enqueue_job, expire_stale_job, make_dedupe_key, job_queue_stats, JobQueueFull
+from utils.plan_cache import make_workout_cache_key, get_cached_plan, store_plan, cache_stats
+from utils.plan_pool import pool_generator, take_pooled_plan, pool_stats
+from utils.llm_client import llm
+from utils.json_stream import IncrementalArrayParser
+from utils.plan_engine import MAX_DURATION_WEEKS, MAX_WORKOUTS_PER_WEEK, build_workout_plan
+from utils.prompts import PROMPTS, get_prompt, render_prompt, profile_values, estimate_tokens, PromptBudgetExceeded, \
+    nutrition_sections_schema, slice_schema, WEEK_EXAMPLE, NUTRITION_EXAMPLE
+from utils.ai_helpers import AINutritionGenerator, calculate_macro_distribution
+from utils.resilience import LLMUnavailable
+from utils.rate_limit import check_ai_rate_limit, rate_limit_stats
+from utils.response_cache import response_cache
+from utils.scheduler import BACKGROUND_TIER, tier_priority
+from utils.semantic_cache import chat_cache
+from utils.bulk import ProviderBackoff, complete_with_backoff, fan_out
+from utils.plan_repair import WORKOUT_PLAN_SCHEMA, WEEK_SCHEMA, NUTRITION_PLAN_SCHEMA, parse_plan, record_fallback, repair_stats
+from utils.metrics import metrics
 
 ai_bp = Blueprint('ai', __name__)
 
-def get_openai_client():
-    """Obtiene el cliente de OpenAI configurado"""
-    api_key = current_app.config.get('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OpenAI API key not configured")
+logger = logging.getLogger(__name__)
+
+# Tokens que consume cada operación de los cubos de límite por usuario y nivel
+RATE_LIMIT_COSTS = {'chat': 1, 'workout': 2, 'nutrition': 2, 'workout_bulk': 10, 'regenerate': 1}
+
+# Salida reservada al regenerar un fragmento: proporcional al fragmento actual, más un margen
+SLICE_OUTPUT_FACTOR = 2
+SLICE_OUTPUT_MARGIN = 200
+MAX_INSTRUCTIONS_CHARS = 500
+
+def _log_error(operation, message):
+    """Registra el error y lo cuenta en ai_errors_total"""
+    logger.error(message)
+    metrics.inc('ai_errors_total', {'operation': operation})
+
+def _rate_limit(user, operation):
+    """Devuelve la respuesta 429 si el usuario o su nivel superan el límite, o None"""
+    retry_after = check_ai_rate_limit(current_app, user.id, user.tier, RATE_LIMIT_COSTS[operation])
+    if retry_after is None:
+        return None
+    
+    response = jsonify({'error': 'Demasiadas peticiones de IA, intenta más tarde'})
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, 429
+
+def _enqueue_generation(user, job_type, params, rate_limited=True):
+    """Encola una generación y construye la respuesta 202.
+    
+    Las peticiones idénticas del mismo usuario mientras hay una en curso se
+    adjuntan al trabajo existente en lugar de lanzar otra llamada al LLM.
+    El pool ejecuta antes los trabajos de los niveles de mayor prioridad.
+    """
+    if rate_limited:
+        limited = _rate_limit(user, job_type)
+        if limited:
+            return limited
     
-    openai.api_key = api_key
-    return openai
+    dedupe_key = make_dedupe_key(user.id, job_type, params)
+    try:
+        job, created = enqueue_job(current_app._get_current_object(), user.id, job_type, params,
+                                   dedupe_key=dedupe_key, priority=tier_priority(user.tier))
+    except JobQueueFull:
+        return jsonify({'error': 'Demasiadas generaciones en curso, intenta más tarde'}), 503
+    
+    status_url = url_for('ai.get_job_status', job_id=job.id)
+    response = jsonify({
+        'message': 'Generación en curso',
+        'job': job.to_dict(),
+        'status_url': status_url,
+        'deduplicated': not created
+    })
+    response.headers['Location'] = status_url
+    return response, 202
+
+def _bounded_int(data, field, default, maximum):
+    """Entero de la petición limitado a 1..maximum; ValueError si no es un entero"""
+    value = data.get(field, default)
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f'{field} debe ser un número entero')
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} debe ser un número entero')
+    return max(1, min(number, maximum))
+
+def _workout_params(data, user):
+    """Parámetros del plan de entrenamiento, con el perfil del usuario por defecto.
+    
+    Semanas y sesiones se limitan a los rangos del motor local, para que el plan
+    guardado, el prompt y las semanas generadas coincidan. Lanza ValueError si
+    alguno no es un número entero.
+    """
+    return {
+        'fitness_goal': data.get('fitness_goal', user.fitness_goal or 'general_fitness'),
+        'activity_level': data.get('activity_level', user.activity_level or 'beginner'),
+        'duration_weeks': _bounded_int(data, 'duration_weeks', 4, MAX_DURATION_WEEKS),
+        'workouts_per_week': _bounded_int(data, 'workouts_per_week', 3, MAX_WORKOUTS_PER_WEEK),
+        'equipment_available': data.get('equipment_available', ['bodyweight']),
+        'focus_areas': data.get('focus_areas', [])
+    }
 
 @ai_bp.route('/generate-workout', methods=['POST'])
 @jwt_required()
@@ -29,111 +122,384 @@ def generate_workout_plan():
         data = request.get_json()
         
         # Parámetros del plan
-        fitness_goal = data.get('fitness_goal', user.fitness_goal or 'general_fitness')
-        activity_level = data.get('activity_level', user.activity_level or 'beginner')
-        duration_weeks = data.get('duration_weeks', 4)
-        workouts_per_week = data.get('workouts_per_week', 3)
-        equipment_available = data.get('equipment_available', ['bodyweight'])
-        focus_areas = data.get('focus_areas', [])
-        
-        # Crear prompt para OpenAI
-        prompt = f"""
-        Crea un plan de entrenamiento personalizado con las siguientes especificaciones:
-        
-        Usuario:
-        - Objetivo: {fitness_goal}
-        - Nivel: {activity_level}
-        - Edad: {user.age or 'No especificada'}
-        - Género: {user.gender or 'No especificado'}
-        
-        Plan:
-        - Duración: {duration_weeks} semanas
-        - Entrenamientos por semana: {workouts_per_week}
-        - Equipo disponible: {', '.join(equipment_available)}
-        - Áreas de enfoque: {', '.join(focus_areas) if focus_areas else 'General'}
-        
-        Genera un plan estructurado en formato JSON con la siguiente estructura:
-        {{
-            "name": "Nombre del plan",
-            "description": "Descripción del plan",
-            "difficulty": "beginner/intermediate/advanced",
-            "weeks": [
-                {{
-                    "week": 1,
-                    "workouts": [
-                        {{
-                            "day": "Lunes",
-                            "name": "Nombre del entrenamiento",
-                            "duration_minutes": 45,
-                            "exercises": [
-                                {{
-                                    "name": "Nombre del ejercicio",
-                                    "sets": 3,
-                                    "reps": "8-10",
-                                    "rest_seconds": 90,
-                                    "instructions": "Instrucciones del ejercicio"
-                                }}
-                            ]
-                        }}
-                    ]
-                }}
-            ]
-        }}
-        
-        Asegúrate de que el plan sea progresivo, seguro y apropiado para el nivel del usuario.
-        """
-        
-        # Llamar a OpenAI
-        client = get_openai_client()
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un entrenador personal experto que crea planes de entrenamiento personalizados. Responde solo con JSON válido."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=2000,
-            temperature=0.7
-        )
+        try:
+            params = _workout_params(data, user)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Motor local basado en reglas: respuesta inmediata sin LLM
+        if data.get('engine') == 'local':
+            workout_plan = _save_workout_plan(user.id, params, build_workout_plan(params))
+            return jsonify({
+                'message': 'Plan de entrenamiento generado exitosamente',
+                'plan': workout_plan.to_dict(),
+                'engine': 'local'
+            }), 201
+        
+        # Reutilizar un plan generado con parámetros equivalentes
+        if data.get('use_cache', True):
+            cache_key = make_workout_cache_key(params, user.age, user.gender, get_prompt('workout_plan').key)
+            
+            # Variante pregenerada fuera de hora punta para este arquetipo
+            pooled_plan = take_pooled_plan(cache_key)
+            if pooled_plan is not None:
+                workout_plan = _save_workout_plan(user.id, params, pooled_plan)
+                return jsonify({
+                    'message': 'Plan de entrenamiento generado exitosamente',
+                    'plan': workout_plan.to_dict(),
+                    'pooled': True
+                }), 201
+            
+            cached_plan = get_cached_plan(cache_key)
+            
+            if cached_plan is not None:
+                workout_plan = _save_workout_plan(user.id, params, cached_plan)
+                return jsonify({
+                    'message': 'Plan de entrenamiento generado exitosamente',
+                    'plan': workout_plan.to_dict(),
+                    'cached': True
+                }), 201
+            
+            params['cache_key'] = cache_key
+        
+        return _enqueue_generation(user, 'workout', params)
+        
+    except Exception as e:
+        db.session.rollback()
+        _log_error('enqueue_workout', f"Error enqueuing workout plan: {str(e)}")
+        return jsonify({'error': 'Error generando el plan de entrenamiento'}), 500
+
+@job_handler('workout')
+def run_workout_generation(job):
+    """Genera y guarda un plan de entrenamiento (se ejecuta en el pool de trabajos)"""
+    user_id = job.user_id
+    user = db.session.get(User, user_id)
+    params = job.get_params()
+    
+    fitness_goal = params['fitness_goal']
+    activity_level = params['activity_level']
+    duration_weeks = params['duration_weeks']
+    
+    # Crear prompt para OpenAI
+    prompt = _workout_prompt(user, params)
+    
+    # Plan básico si la respuesta no trae un JSON completo
+    fallback_plan = {
+        "name": f"Plan de {fitness_goal.replace('_', ' ').title()}",
+        "description": f"Plan personalizado de {duration_weeks} semanas para {fitness_goal}",
+        "difficulty": activity_level,
+        "weeks": []
+    }
+    
+    # Crear el plan antes de generar para ir guardando cada semana según llega
+    workout_plan = _save_workout_plan(user_id, params, fallback_plan, status='generating')
+    job.result_plan_id = workout_plan.id
+    db.session.commit()
+    
+    # Llamar a OpenAI en streaming
+    parser = IncrementalArrayParser('weeks')
+    stream = None
+    
+    try:
+        stream = llm.stream('workout_plan', prompt.messages, tier=user.tier, max_tokens=prompt.max_tokens)
+        for token in stream:
+            if parser.feed(token):
+                workout_plan.set_plan_data(dict(fallback_plan, weeks=list(parser.items)))
+                db.session.commit()
+    except Exception as e:
+        if stream is not None:
+            stream.close()
+        _log_error('workout_stream', f"Workout plan stream interrupted after {len(parser.items)} weeks: {str(e)}")
+    
+    token_usage = stream.total_tokens if stream is not None else 0
+    
+    # Reparar y validar la respuesta; si está truncada, pedir solo las semanas que faltan
+    result = parse_plan(parser.text, WORKOUT_PLAN_SCHEMA, 'workout')
+    if result.data is None:
+        # Sin nada aprovechable del LLM: plan completo del motor local
+        plan_data = build_workout_plan(params)
+        record_fallback('workout', 'local_engine')
+    else:
+        plan_data = {**fallback_plan, 'weeks': [], **result.data}
         
-        # Parsear respuesta
-        plan_content = response.choices[0].message.content.strip()
+        def complete(weeks_prompt):
+            nonlocal token_usage
+            response = llm.complete('workout_plan', weeks_prompt.messages, tier=user.tier,
+                                    max_tokens=weeks_prompt.max_tokens)
+            token_usage += response.total_tokens
+            return response
+        
+        complete_plan = _complete_workout_weeks(plan_data, params, _workout_values(user.to_dict(), params), complete)
+        if complete_plan and params.get('cache_key'):
+            store_plan(current_app, params['cache_key'], 'workout', plan_data)
+    
+    _fill_workout_plan(workout_plan, params, plan_data)
+    workout_plan.token_usage = token_usage
+    workout_plan.status = 'active'
+    db.session.commit()
+    
+    return workout_plan
+
+def _workout_values(profile, params):
+    """Valores del prompt de entrenamiento para el perfil y los parámetros"""
+    values = profile_values(profile)
+    values.update(
+        fitness_goal=params['fitness_goal'],
+        activity_level=params['activity_level'],
+        duration_weeks=params['duration_weeks'],
+        workouts_per_week=params['workouts_per_week'],
+        equipment=', '.join(params['equipment_available']),
+        focus_areas=', '.join(params['focus_areas']) if params['focus_areas'] else 'General'
+    )
+    return values
+
+def _workout_prompt(user, params):
+    """Renderiza el prompt de entrenamiento para el usuario y los parámetros"""
+    return render_prompt('workout_plan', **_workout_values(user.to_dict(), params))
+
+def _complete_workout_weeks(plan_data, params, values, complete):
+    """Completa las semanas que faltan en un plan reparado.
+    
+    Solo se piden al LLM las semanas ausentes (``complete`` recibe el prompt
+    renderizado); las que sigan faltando salen del motor local. Devuelve
+    True si el plan quedó completo sin recurrir al motor local.
+    """
+    weeks = plan_data['weeks']
+    for index, week in enumerate(weeks):
+        week.setdefault('week', index + 1)
+    
+    duration_weeks = int(params['duration_weeks'])
+    missing = [n for n in range(1, duration_weeks + 1) if n not in {w['week'] for w in weeks}]
+    if not missing:
+        return True
+    
+    try:
+        prompt = render_prompt('workout_plan_weeks', weeks=', '.join(map(str, missing)), **values)
+        result = parse_plan(complete(prompt).content, WORKOUT_PLAN_SCHEMA, 'workout')
+        received = [w for w in (result.data or {}).get('weeks', []) if w.get('week') in missing]
+        record_fallback('workout', 'section_reprompt' if received else 'section_reprompt_failed')
+    except Exception as e:
+        _log_error('workout_weeks', f"Workout weeks regeneration failed: {str(e)}")
+        record_fallback('workout', 'section_reprompt_failed')
+        received = []
+    
+    weeks.extend(received)
+    missing = [n for n in missing if n not in {w['week'] for w in received}]
+    if missing:
+        local_weeks = build_workout_plan(params)['weeks']
+        weeks.extend(w for w in local_weeks if w['week'] in missing)
+        record_fallback('workout', 'local_fill')
+    
+    weeks.sort(key=lambda w: w['week'])
+    return not missing
+
+def _fill_workout_plan(workout_plan, params, plan_data):
+    """Copia los datos generados en el plan de entrenamiento"""
+    fitness_goal = params['fitness_goal']
+    
+    workout_plan.name = plan_data.get('name', f'Plan de Entrenamiento - {fitness_goal}')
+    workout_plan.description = plan_data.get('description', 'Plan generado con IA')
+    workout_plan.duration_weeks = params['duration_weeks']
+    workout_plan.workouts_per_week = params['workouts_per_week']
+    workout_plan.difficulty = plan_data.get('difficulty', params['activity_level'])
+    workout_plan.set_plan_data(plan_data)
+
+def _save_workout_plan(user_id, params, plan_data, status='active'):
+    """Crea el plan de entrenamiento en la base de datos"""
+    workout_plan = WorkoutPlan(user_id=user_id, status=status)
+    _fill_workout_plan(workout_plan, params, plan_data)
+    
+    db.session.add(workout_plan)
+    db.session.commit()
+    
+    return workout_plan
+
+@pool_generator('workout')
+def generate_pooled_workout(archetype):
+    """Genera una variante de un arquetipo para el pool (sin usuario concreto)"""
+    params = archetype['params']
+    values = _workout_values({'age': archetype['age'], 'gender': archetype['gender']}, params)
+    
+    def complete(prompt):
+        # Prioridad más baja del planificador, detrás de cualquier usuario
+        return llm.complete('workout_plan', prompt.messages, tier=BACKGROUND_TIER, max_tokens=prompt.max_tokens)
+    
+    result = parse_plan(complete(render_prompt('workout_plan', **values)).content, WORKOUT_PLAN_SCHEMA, 'workout')
+    if result.data is None:
+        return None
+    
+    plan_data = {'weeks': [], **result.data}
+    # Solo se guardan planes completos del LLM, no completados con el motor local
+    return plan_data if _complete_workout_weeks(plan_data, params, values, complete) else None
+
+@ai_bp.route('/generate-workout/bulk', methods=['POST'])
+@jwt_required()
+def generate_workout_plans_bulk():
+    """Genera planes para un grupo de clientes del entrenador (asíncrono)"""
+    try:
+        coach_id = get_jwt_identity()
+        coach = User.query.get(coach_id)
+        
+        if not coach:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        
+        # Nivel vigente: una suscripción pro caducada no da acceso
+        if coach.tier != 'pro':
+            return jsonify({'error': 'La generación masiva requiere una suscripción pro'}), 403
+        
+        data = request.get_json()
+        user_ids = data.get('user_ids')
+        
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({'error': 'Lista de usuarios requerida'}), 400
         
-        # Intentar parsear JSON
         try:
-            plan_data = json.loads(plan_content)
-        except json.JSONDecodeError:
-            # Si no es JSON válido, crear un plan básico
-            plan_data = {
-                "name": f"Plan de {fitness_goal.replace('_', ' ').title()}",
-                "description": f"Plan personalizado de {duration_weeks} semanas para {fitness_goal}",
-                "difficulty": activity_level,
-                "weeks": []
-            }
-        
-        # Crear el plan en la base de datos
-        workout_plan = WorkoutPlan(
-            user_id=user_id,
-            name=plan_data.get('name', f'Plan de Entrenamiento - {fitness_goal}'),
-            description=plan_data.get('description', 'Plan generado con IA'),
-            duration_weeks=duration_weeks,
-            workouts_per_week=workouts_per_week,
-            difficulty=plan_data.get('difficulty', activity_level)
-        )
+            user_ids = sorted({int(uid) for uid in user_ids})
+        except (TypeError, ValueError):
+            return jsonify({'error': 'IDs de usuario inválidos'}), 400
         
-        workout_plan.set_plan_data(plan_data)
+        max_users = current_app.config['AI_BULK_MAX_USERS']
+        if len(user_ids) > max_users:
+            return jsonify({'error': f'Máximo {max_users} usuarios por petición'}), 400
         
-        db.session.add(workout_plan)
-        db.session.commit()
+        # Solo se guardan los campos enviados: el resto sale del perfil de cada cliente
+        plan_fields = ('fitness_goal', 'activity_level', 'duration_weeks', 'workouts_per_week',
+                       'equipment_available', 'focus_areas')
+        plan = {field: data[field] for field in plan_fields if field in data}
+        try:
+            validated = _workout_params(plan, coach)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        plan.update((field, validated[field]) for field in ('duration_weeks', 'workouts_per_week') if field in plan)
+        params = {
+            'user_ids': user_ids,
+            'plan': plan,
+            'engine': data.get('engine', 'ai'),
+            'use_cache': data.get('use_cache', True)
+        }
         
-        return jsonify({
-            'message': 'Plan de entrenamiento generado exitosamente',
-            'plan': workout_plan.to_dict()
-        }), 201
+        # El motor local no llama al LLM: no consume cupo
+        return _enqueue_generation(coach, 'workout_bulk', params, rate_limited=params['engine'] != 'local')
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error generating workout plan: {str(e)}")
-        return jsonify({'error': 'Error generando el plan de entrenamiento'}), 500
+        _log_error('enqueue_bulk', f"Error enqueuing bulk workout plans: {str(e)}")
+        return jsonify({'error': 'Error generando los planes de entrenamiento'}), 500
+
+@job_handler('workout_bulk', timeout_setting='AI_BULK_TIMEOUT_SECONDS')
+def run_bulk_workout_generation(job):
+    """Genera los planes de un grupo de clientes con concurrencia acotada.
+    
+    Los clientes con parámetros equivalentes comparten una sola llamada al
+    LLM (misma clave de caché). Las llamadas se reparten en un pool de
+    AI_BULK_CONCURRENCY hilos que no tocan la base de datos; los planes se
+    guardan desde este hilo en commits de AI_BULK_COMMIT_BATCH filas.
+    """
+    app = current_app._get_current_object()
+    params = job.get_params()
+    tier = db.session.get(User, job.user_id).tier
+    use_cache = params.get('use_cache', True)
+    batch_size = app.config.get('AI_BULK_COMMIT_BATCH', 25)
+    
+    clients = User.query.filter(User.id.in_(params['user_ids']), User.coach_id == job.user_id).all()
+    results = {str(uid): {'status': 'failed', 'error': 'Usuario no encontrado o no asignado'}
+               for uid in params['user_ids']}
+    results.update({str(user.id): {'status': 'pending'} for user in clients})
+    
+    # Agrupar clientes por clave de generación
+    groups = {}
+    ready = {}
+    prompts = {}
+    for user in clients:
+        user_params = _workout_params(params['plan'], user)
+        
+        if params.get('engine') == 'local':
+            key = f'user:{user.id}'
+            ready[key] = (build_workout_plan(user_params), 'local')
+        elif use_cache:
+            key = make_workout_cache_key(user_params, user.age, user.gender, get_prompt('workout_plan').key)
+            if key not in groups:
+                cached_plan = get_cached_plan(key)
+                if cached_plan is not None:
+                    ready[key] = (cached_plan, 'cache')
+                else:
+                    prompts[key] = (user_params, _workout_values(user.to_dict(), user_params))
+        else:
+            key = f'user:{user.id}'
+            prompts[key] = (user_params, _workout_values(user.to_dict(), user_params))
+        
+        groups.setdefault(key, []).append((user.id, user_params))
+    
+    backoff = ProviderBackoff()
+    max_attempts = app.config.get('AI_BULK_MAX_RATE_LIMIT_RETRIES', 5) + 1
+    pending = []
+    
+    def generate(item):
+        user_params, values = item
+        usage = []
+        
+        def complete(prompt):
+            response = complete_with_backoff('workout_plan', prompt.messages, backoff, max_attempts=max_attempts,
+                                             tier=tier, max_tokens=prompt.max_tokens)
+            usage.append(response.total_tokens)
+            return response
+        
+        result = parse_plan(complete(render_prompt('workout_plan', **values)).content, WORKOUT_PLAN_SCHEMA, 'workout')
+        if result.data is None:
+            raise ValueError('Respuesta del LLM sin JSON aprovechable')
+        plan_data = dict(result.data, weeks=result.data.get('weeks', []))
+        complete_plan = _complete_workout_weeks(plan_data, user_params, values, complete)
+        return plan_data, complete_plan, sum(usage)
+    
+    def save_batch():
+        db.session.add_all(plan for _, plan, _ in pending)
+        db.session.commit()
+        for user_id, plan, source in pending:
+            results[str(user_id)] = {'status': 'completed', 'plan_id': plan.id, 'source': source}
+        pending.clear()
+        job.set_result(_bulk_summary(results, backoff))
+        db.session.commit()
+    
+    def add_plans(key, plan_data, source, token_usage=0):
+        # Los planes de un grupo comparten la llamada: se reparte su consumo
+        share = token_usage // len(groups[key])
+        for user_id, user_params in groups[key]:
+            if plan_data is not None:
+                user_plan, user_source = plan_data, source
+            else:
+                # Sin respuesta válida del LLM: plan del motor local
+                user_plan, user_source = build_workout_plan(user_params), 'local'
+                record_fallback('workout', 'local_engine')
+            workout_plan = WorkoutPlan(user_id=user_id, status='active', token_usage=share)
+            _fill_workout_plan(workout_plan, user_params, user_plan)
+            pending.append((user_id, workout_plan, user_source))
+        if len(pending) >= batch_size:
+            save_batch()
+    
+    for key, (plan_data, source) in ready.items():
+        add_plans(key, plan_data, source)
+    
+    for key, generated, error in fan_out(generate, prompts, app.config.get('AI_BULK_CONCURRENCY', 8)):
+        plan_data, complete_plan, token_usage = generated or (None, False, 0)
+        if error is not None:
+            _log_error('bulk_generation', f"Bulk workout generation failed for group {key[:12]}: {str(error)}")
+        elif use_cache and complete_plan:
+            store_plan(app, key, 'workout', plan_data)
+        add_plans(key, plan_data, 'ai', token_usage)
+    
+    save_batch()
+    return None
+
+def _bulk_summary(results, backoff):
+    statuses = [r['status'] for r in results.values()]
+    return {
+        'total': len(statuses),
+        'completed': statuses.count('completed'),
+        'pending': statuses.count('pending'),
+        'failed': statuses.count('failed'),
+        'rate_limited': backoff.rate_limited,
+        'users': results
+    }
 
 @ai_bp.route('/generate-nutrition', methods=['POST'])
 @jwt_required()
@@ -148,127 +514,454 @@ def generate_nutrition_plan():
         data = request.get_json()
         
         # Parámetros del plan
-        goal = data.get('goal', 'maintenance')
-        daily_calories = data.get('daily_calories', 2000)
-        dietary_restrictions = data.get('dietary_restrictions', user.dietary_restrictions or '')
-        meals_per_day = data.get('meals_per_day', 3)
-        duration_weeks = data.get('duration_weeks', 4)
-        allergies = data.get('allergies', '')
-        
-        # Calcular macronutrientes según el objetivo
-        if goal == 'weight_loss':
-            protein_pct, carbs_pct, fats_pct = 35, 35, 30
-        elif goal == 'muscle_gain':
-            protein_pct, carbs_pct, fats_pct = 30, 45, 25
-        elif goal == 'performance':
-            protein_pct, carbs_pct, fats_pct = 25, 50, 25
-        else:  # maintenance
-            protein_pct, carbs_pct, fats_pct = 25, 45, 30
-        
-        # Crear prompt para OpenAI
-        prompt = f"""
-        Crea un plan nutricional personalizado con las siguientes especificaciones:
-        
-        Usuario:
-        - Objetivo: {goal}
-        - Calorías diarias: {daily_calories}
-        - Restricciones dietéticas: {dietary_restrictions or 'Ninguna'}
-        - Alergias: {allergies or 'Ninguna'}
-        - Edad: {user.age or 'No especificada'}
-        - Peso: {user.weight or 'No especificado'} kg
-        - Altura: {user.height or 'No especificada'} cm
-        
-        Plan:
-        - Comidas por día: {meals_per_day}
-        - Duración: {duration_weeks} semanas
-        - Distribución de macronutrientes: {protein_pct}% proteína, {carbs_pct}% carbohidratos, {fats_pct}% grasas
-        
-        Genera un plan estructurado en formato JSON con la siguiente estructura:
-        {{
-            "name": "Nombre del plan",
-            "description": "Descripción del plan",
-            "daily_meals": [
-                {{
-                    "name": "Desayuno",
-                    "time": "08:00",
-                    "calories": 400,
-                    "foods": [
-                        {{
-                            "name": "Avena con frutas",
-                            "quantity": "1 taza",
-                            "calories": 250,
-                            "protein": 8,
-                            "carbs": 45,
-                            "fats": 5
-                        }}
-                    ]
-                }}
-            ],
-            "weekly_variations": [
-                {{
-                    "week": 1,
-                    "notes": "Semana de adaptación",
-                    "meal_suggestions": ["Sugerencias específicas para esta semana"]
-                }}
-            ]
-        }}
-        
-        Asegúrate de que el plan sea balanceado, variado y apropiado para el objetivo del usuario.
-        """
-        
-        # Llamar a OpenAI
-        client = get_openai_client()
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un nutricionista experto que crea planes alimentarios personalizados. Responde solo con JSON válido."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=2000,
-            temperature=0.7
+        params = {
+            'goal': data.get('goal', 'maintenance'),
+            'daily_calories': data.get('daily_calories', 2000),
+            'dietary_restrictions': data.get('dietary_restrictions', user.dietary_restrictions or ''),
+            'meals_per_day': data.get('meals_per_day', 3),
+            'duration_weeks': data.get('duration_weeks', 4),
+            'allergies': data.get('allergies', '')
+        }
+        
+        return _enqueue_generation(user, 'nutrition', params)
+        
+    except Exception as e:
+        db.session.rollback()
+        _log_error('enqueue_nutrition', f"Error enqueuing nutrition plan: {str(e)}")
+        return jsonify({'error': 'Error generando el plan nutricional'}), 500
+
+@job_handler('nutrition')
+def run_nutrition_generation(job):
+    """Genera y guarda un plan nutricional (se ejecuta en el pool de trabajos)"""
+    user_id = job.user_id
+    user = db.session.get(User, user_id)
+    params = job.get_params()
+    
+    goal = params['goal']
+    daily_calories = params['daily_calories']
+    dietary_restrictions = params['dietary_restrictions']
+    meals_per_day = params['meals_per_day']
+    duration_weeks = params['duration_weeks']
+    allergies = params['allergies']
+    
+    # Calcular macronutrientes según el objetivo
+    macros = calculate_macro_distribution(daily_calories, goal)
+    protein_pct = macros['protein']['percentage']
+    carbs_pct = macros['carbs']['percentage']
+    fats_pct = macros['fats']['percentage']
+    
+    # Crear prompt para OpenAI
+    values = profile_values(user.to_dict())
+    values.update(
+        goal=goal,
+        daily_calories=daily_calories,
+        dietary_restrictions=dietary_restrictions or 'Ninguna',
+        allergies=allergies or 'Ninguna',
+        meals_per_day=meals_per_day,
+        duration_weeks=duration_weeks,
+        protein_pct=protein_pct,
+        carbs_pct=carbs_pct,
+        fats_pct=fats_pct
+    )
+    prompt = render_prompt('nutrition_plan', **values)
+    
+    # Llamar a OpenAI (si el circuito está abierto, se usa el plan de respaldo)
+    try:
+        response = llm.complete('nutrition_plan', prompt.messages, tier=user.tier, max_tokens=prompt.max_tokens)
+        plan_content = response.content
+        token_usage = response.total_tokens
+    except LLMUnavailable as e:
+        _log_error('nutrition_llm', f"Nutrition plan generation skipped: {str(e)}")
+        plan_content = ''
+        token_usage = 0
+    
+    # Reparar y validar la respuesta; si no hay nada aprovechable, crear un plan básico
+    fallback_plan = AINutritionGenerator.create_fallback_nutrition_plan(params)
+    result = parse_plan(plan_content, NUTRITION_PLAN_SCHEMA, 'nutrition')
+    if result.data is None:
+        plan_data = fallback_plan
+        record_fallback('nutrition', 'fallback_plan')
+    else:
+        plan_data = result.data
+        if result.missing:
+            sections, sections_tokens = _nutrition_sections(result.missing, values, fallback_plan, user.tier)
+            plan_data.update(sections)
+            token_usage += sections_tokens
+    
+    # Crear el plan en la base de datos
+    nutrition_plan = NutritionPlan(
+        user_id=user_id,
+        name=plan_data.get('name', f'Plan Nutricional - {goal}'),
+        description=plan_data.get('description', 'Plan generado con IA'),
+        daily_calories=daily_calories,
+        duration_weeks=duration_weeks,
+        protein_percentage=protein_pct,
+        carbs_percentage=carbs_pct,
+        fats_percentage=fats_pct,
+        token_usage=token_usage
+    )
+    
+    nutrition_plan.set_plan_data(plan_data)
+    
+    db.session.add(nutrition_plan)
+    db.session.commit()
+    
+    return nutrition_plan
+
+def _nutrition_sections(sections, values, fallback_plan, tier):
+    """Pide al LLM solo las secciones que faltan; las que no lleguen salen del plan básico.
+    
+    Devuelve las secciones y los tokens consumidos en la petición.
+    """
+    received = {}
+    token_usage = 0
+    try:
+        prompt = render_prompt('nutrition_plan_sections', sections=', '.join(sections),
+                               sections_schema=nutrition_sections_schema(sections), **values)
+        response = llm.complete('nutrition_plan', prompt.messages, tier=tier, max_tokens=prompt.max_tokens)
+        token_usage = response.total_tokens
+        result = parse_plan(response.content, NUTRITION_PLAN_SCHEMA, 'nutrition')
+        received = {key: (result.data or {})[key] for key in sections
+                    if key in (result.data or {}) and key not in result.missing}
+        record_fallback('nutrition', 'section_reprompt' if received else 'section_reprompt_failed')
+    except Exception as e:
+        _log_error('nutrition_sections', f"Nutrition sections regeneration failed: {str(e)}")
+        record_fallback('nutrition', 'section_reprompt_failed')
+    
+    remaining = [key for key in sections if key not in received]
+    if remaining:
+        received.update({key: fallback_plan[key] for key in remaining if key in fallback_plan})
+        record_fallback('nutrition', 'local_fill')
+    return received, token_usage
+
+def _index_arg(data, name):
+    """Índice opcional (entero desde 0) del cuerpo de la petición"""
+    value = data.get(name)
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+        raise ValueError(f'{name} debe ser un entero mayor o igual que 0')
+    return value
+
+def _get_path(data, path):
+    """Elemento de plan_data en ``path`` (claves e índices); None si no existe"""
+    try:
+        for step in path:
+            data = data[step]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return data
+
+def _path_text(path):
+    return ''.join(f'[{step}]' if isinstance(step, int) else f'.{step}' for step in path).lstrip('.')
+
+def _workout_outline(workout):
+    """Resumen de una sesión para el contexto: día, nombre y ejercicios"""
+    exercises = workout.get('exercises') or workout.get('main_exercises') or []
+    names = ', '.join(e.get('name', '') for e in exercises if isinstance(e, dict))
+    return f"{workout.get('day', '')} {workout.get('name', '')} ({names})"
+
+def _week_outline(week):
+    return f"semana {week.get('week')}: " + '; '.join(_workout_outline(w) for w in week.get('workouts', []))
+
+def _week_detail(week):
+    """Semana a rehacer en texto compacto: foco y, por sesión, duración y ejercicios con series y repeticiones.
+    
+    El JSON completo de una semana (calentamiento, instrucciones, músculos...)
+    no cabe en el presupuesto de entrada del prompt.
+    """
+    sessions = []
+    for workout in week.get('workouts', []):
+        exercises = workout.get('exercises') or workout.get('main_exercises') or []
+        names = ', '.join(f"{e.get('name', '')} {e.get('sets', '?')}x{e.get('reps', '?')}"
+                          for e in exercises if isinstance(e, dict))
+        sessions.append(f"{workout.get('day', '')} {workout.get('name', '')}, "
+                        f"{workout.get('duration_minutes', '?')} min ({names})")
+    return f"semana {week.get('week')}, foco {week.get('focus', 'sin indicar')}: " + '; '.join(sessions)
+
+def _meal_outline(meal):
+    foods = ', '.join(f.get('name', '') for f in meal.get('foods', []) if isinstance(f, dict))
+    return f"{meal.get('name', '')} {meal.get('calories', '')} kcal ({foods})"
+
+def _regenerate_slice(user, plan, path, prompt_name, values, schema, plan_type, keep=(), describe=None):
+    """Regenera el elemento de plan_data en ``path`` y lo sustituye en el plan.
+    
+    Al LLM solo se envían el contexto compacto de ``values`` y el elemento
+    actual (en JSON, o resumido con ``describe`` si es grande); la salida
+    reservada es proporcional a su tamaño en JSON. La respuesta
+    (``{clave: [elemento]}``) se valida con ``schema`` y se inserta en el plan
+    leído de nuevo al terminar, conservando los campos de ``keep``.
+    Devuelve la respuesta HTTP.
+    """
+    key = next(step for step in reversed(path) if isinstance(step, str))
+    current = _get_path(plan.get_plan_data(), path)
+    current_json = json.dumps(current, ensure_ascii=False, separators=(',', ':'))
+    use_case = get_prompt(prompt_name).use_case
+    max_tokens = min(llm.params_for(use_case)['max_tokens'],
+                     SLICE_OUTPUT_FACTOR * estimate_tokens(current_json) + SLICE_OUTPUT_MARGIN)
+    
+    try:
+        prompt = render_prompt(prompt_name, max_tokens=max_tokens,
+                               current=describe(current) if describe else current_json, **values)
+    except PromptBudgetExceeded:
+        return jsonify({'error': 'El fragmento o las instrucciones son demasiado largos'}), 400
+    
+    limited = _rate_limit(user, 'regenerate')
+    if limited:
+        return limited
+    
+    try:
+        response = llm.complete(use_case, prompt.messages, tier=user.tier, max_tokens=prompt.max_tokens)
+    except LLMUnavailable as e:
+        unavailable = jsonify({'error': 'El asistente no está disponible en este momento, intenta más tarde'})
+        unavailable.headers['Retry-After'] = str(max(1, round(e.retry_after or 1)))
+        return unavailable, 503
+    
+    result = parse_plan(response.content, schema, plan_type)
+    items = (result.data or {}).get(key) if key not in result.missing else None
+    if not items:
+        _log_error(f'regenerate_{plan_type}', f"Regeneration of {_path_text(path)} returned no usable JSON")
+        return jsonify({'error': 'No se pudo regenerar esta parte del plan, intenta de nuevo'}), 502
+    
+    # Un índice sustituye un elemento; una clave, la lista entera
+    replacement = items[0] if isinstance(path[-1], int) else items
+    if isinstance(replacement, dict):
+        replacement.update({field: current[field] for field in keep if field in current})
+    
+    # Releer el plan por si cambió durante la llamada al LLM; la estructura
+    # normalizada se vuelve a ensamblar desde las tablas, no desde la copia en memoria
+    db.session.refresh(plan, with_for_update=True)
+    forget_assembled(plan)
+    plan_data = plan.get_plan_data()
+    parent = _get_path(plan_data, path[:-1])
+    if _get_path(plan_data, path) is None:
+        db.session.rollback()
+        return jsonify({'error': 'El plan cambió durante la regeneración, intenta de nuevo'}), 409
+    
+    parent[path[-1]] = replacement
+    plan.set_plan_data(plan_data)
+    plan.token_usage = (plan.token_usage or 0) + response.total_tokens
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Plan actualizado exitosamente',
+        'plan': plan.to_dict(),
+        'regenerated': {'path': _path_text(path), 'tokens': response.total_tokens}
+    }), 200
+
+@ai_bp.route('/workouts/<int:plan_id>/regenerate', methods=['POST'])
+@jwt_required()
+def regenerate_workout_slice(plan_id):
+    """Regenera solo una semana (``week_index``) o una sesión (``workout_index``) de un plan"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        
+        plan = WorkoutPlan.query.filter_by(id=plan_id, user_id=user_id).first()
+        if not plan:
+            return jsonify({'error': 'Plan no encontrado'}), 404
+        if plan.status == 'generating':
+            return jsonify({'error': 'El plan todavía se está generando'}), 409
+        
+        data = request.get_json() or {}
+        try:
+            week_index = _index_arg(data, 'week_index')
+            workout_index = _index_arg(data, 'workout_index')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        weeks = plan.get_plan_data().get('weeks', [])
+        week = _get_path(weeks, [week_index]) if week_index is not None else None
+        if not isinstance(week, dict):
+            return jsonify({'error': 'Semana no encontrada en el plan'}), 400
+        
+        values = profile_values(user.to_dict())
+        values.update(
+            plan_name=plan.name,
+            duration_weeks=plan.duration_weeks,
+            workouts_per_week=plan.workouts_per_week,
+            difficulty=plan.difficulty or values['activity_level'],
+            instructions=(data.get('instructions') or 'ninguno, propón una alternativa equivalente')[:MAX_INSTRUCTIONS_CHARS]
         )
         
-        # Parsear respuesta
-        plan_content = response.choices[0].message.content.strip()
+        if workout_index is None:
+            # Semanas vecinas como referencia de la progresión
+            neighbours = [w for w in weeks[max(0, week_index - 1):week_index + 2] if w is not week]
+            values.update(
+                target=f"la semana {week.get('week', week_index + 1)}",
+                context=' | '.join(_week_outline(w) for w in neighbours) or 'ninguno',
+                slice_schema=slice_schema('weeks', WEEK_EXAMPLE)
+            )
+            return _regenerate_slice(user, plan, ['weeks', week_index], 'workout_plan_slice', values,
+                                     WORKOUT_PLAN_SCHEMA, 'workout', keep=('week',), describe=_week_detail)
         
-        # Intentar parsear JSON
+        workouts = week.get('workouts', [])
+        workout = _get_path(workouts, [workout_index])
+        if not isinstance(workout, dict):
+            return jsonify({'error': 'Sesión no encontrada en la semana'}), 400
+        
+        others = [w for index, w in enumerate(workouts) if index != workout_index]
+        values.update(
+            target=f"la sesión del {workout.get('day', workout_index + 1)} de la semana {week.get('week', week_index + 1)}",
+            context='resto de la semana: ' + ('; '.join(_workout_outline(w) for w in others) or 'ninguna'),
+            slice_schema=slice_schema('workouts', WEEK_EXAMPLE['workouts'][0])
+        )
+        return _regenerate_slice(user, plan, ['weeks', week_index, 'workouts', workout_index], 'workout_plan_slice',
+                                 values, WEEK_SCHEMA, 'workout', keep=('day',))
+        
+    except Exception as e:
+        db.session.rollback()
+        _log_error('regenerate_workout', f"Error regenerating workout plan slice: {str(e)}")
+        return jsonify({'error': 'Error regenerando el plan de entrenamiento'}), 500
+
+@ai_bp.route('/nutrition/<int:plan_id>/regenerate', methods=['POST'])
+@jwt_required()
+def regenerate_nutrition_slice(plan_id):
+    """Regenera el menú diario de un plan nutricional, o solo una comida (``meal_index``)"""
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        
+        plan = NutritionPlan.query.filter_by(id=plan_id, user_id=user_id).first()
+        if not plan:
+            return jsonify({'error': 'Plan no encontrado'}), 404
+        
+        data = request.get_json() or {}
         try:
-            plan_data = json.loads(plan_content)
-        except json.JSONDecodeError:
-            # Si no es JSON válido, crear un plan básico
-            plan_data = {
-                "name": f"Plan Nutricional - {goal.replace('_', ' ').title()}",
-                "description": f"Plan personalizado de {duration_weeks} semanas para {goal}",
-                "daily_meals": [],
-                "weekly_variations": []
-            }
-        
-        # Crear el plan en la base de datos
-        nutrition_plan = NutritionPlan(
-            user_id=user_id,
-            name=plan_data.get('name', f'Plan Nutricional - {goal}'),
-            description=plan_data.get('description', 'Plan generado con IA'),
-            daily_calories=daily_calories,
-            duration_weeks=duration_weeks,
-            protein_percentage=protein_pct,
-            carbs_percentage=carbs_pct,
-            fats_percentage=fats_pct
+            meal_index = _index_arg(data, 'meal_index')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        meals = plan.get_plan_data().get('daily_meals', [])
+        if not meals:
+            return jsonify({'error': 'El plan no tiene menú diario'}), 400
+        
+        values = profile_values(user.to_dict())
+        values.update(
+            plan_name=plan.name,
+            daily_calories=plan.daily_calories,
+            protein_pct=plan.protein_percentage,
+            carbs_pct=plan.carbs_percentage,
+            fats_pct=plan.fats_percentage,
+            instructions=(data.get('instructions') or 'ninguno, propón una alternativa equivalente')[:MAX_INSTRUCTIONS_CHARS]
         )
         
-        nutrition_plan.set_plan_data(plan_data)
+        if meal_index is None:
+            values.update(
+                target=f'el menú diario completo ({len(meals)} comidas)',
+                context='ninguno',
+                slice_schema=slice_schema('daily_meals', NUTRITION_EXAMPLE['daily_meals'][0])
+            )
+            return _regenerate_slice(user, plan, ['daily_meals'], 'nutrition_plan_slice', values,
+                                     NUTRITION_PLAN_SCHEMA, 'nutrition')
         
-        db.session.add(nutrition_plan)
-        db.session.commit()
+        meal = _get_path(meals, [meal_index])
+        if not isinstance(meal, dict):
+            return jsonify({'error': 'Comida no encontrada en el plan'}), 400
         
+        others = [m for index, m in enumerate(meals) if index != meal_index]
+        values.update(
+            target=f"la comida {meal.get('name', meal_index + 1)}",
+            context='resto del día: ' + ('; '.join(_meal_outline(m) for m in others) or 'ninguna'),
+            slice_schema=slice_schema('daily_meals', NUTRITION_EXAMPLE['daily_meals'][0])
+        )
+        return _regenerate_slice(user, plan, ['daily_meals', meal_index], 'nutrition_plan_slice', values,
+                                 NUTRITION_PLAN_SCHEMA, 'nutrition', keep=('name', 'time'))
+        
+    except Exception as e:
+        db.session.rollback()
+        _log_error('regenerate_nutrition', f"Error regenerating nutrition plan slice: {str(e)}")
+        return jsonify({'error': 'Error regenerando el plan nutricional'}), 500
+
+@ai_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job_status(job_id):
+    try:
+        user_id = get_jwt_identity()
+        job = AIJob.query.filter_by(id=job_id, user_id=user_id).first()
+        
+        if not job:
+            return jsonify({'error': 'Trabajo no encontrado'}), 404
+        
+        expire_stale_job(current_app, job)
+        
+        response = {'job': job.to_dict()}
+        
+        # Mientras se genera, el plan contiene las semanas recibidas hasta ahora
+        if job.result_plan_id:
+            plan_model = WorkoutPlan if job.job_type == 'workout' else NutritionPlan
+            plan = plan_model.query.filter_by(id=job.result_plan_id, user_id=user_id).first()
+            
+            # Trabajo abandonado a mitad: conservar las semanas ya guardadas
+            if plan and job.status == 'failed' and plan.status == 'generating':
+                plan.status = 'active'
+                db.session.commit()
+            
+            response['plan'] = plan.to_dict() if plan else None
+            response['partial'] = job.status != 'completed'
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@ai_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    try:
+        return jsonify({'cache': cache_stats(), 'plan_pool': pool_stats(), 'chat_cache': chat_cache.stats(),
+                        'response_cache': response_cache.stats()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@ai_bp.route('/status', methods=['GET'])
+@jwt_required()
+def get_llm_status():
+    try:
         return jsonify({
-            'message': 'Plan nutricional generado exitosamente',
-            'plan': nutrition_plan.to_dict()
-        }), 201
+            'llm': llm.status(),
+            'scheduler': llm.scheduler.to_dict(),
+            'jobs': job_queue_stats(),
+            'rate_limited': rate_limit_stats(),
+            'plan_repair': repair_stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@ai_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas de IA de todos los workers en formato de texto Prometheus"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error generating nutrition plan: {str(e)}")
-        return jsonify({'error': 'Error generando el plan nutricional'}), 500
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@ai_bp.route('/prompts', methods=['GET'])
+@jwt_required()
+def get_prompts():
+    try:
+        prompts = []
+        for template in PROMPTS.values():
+            prompt = template.to_dict()
+            prompt['max_output_tokens'] = llm.params_for(template.use_case)['max_tokens']
+            prompts.append(prompt)
+        
+        return jsonify({'prompts': prompts}), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Error interno del servidor'}), 500
 
 @ai_bp.route('/chat', methods=['POST'])
 @jwt_required()
@@ -286,35 +979,111 @@ def ai_chat():
         if not message:
             return jsonify({'error': 'Mensaje requerido'}), 400
         
-        # Crear contexto del usuario
-        user_context = f"""
-        Usuario: {user.name}
-        Objetivo: {user.fitness_goal or 'No especificado'}
-        Nivel: {user.activity_level or 'No especificado'}
-        Edad: {user.age or 'No especificada'}
-        Peso: {user.weight or 'No especificado'} kg
-        Altura: {user.height or 'No especificada'} cm
-        """
-        
-        # Llamar a OpenAI
-        client = get_openai_client()
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": f"Eres un asistente de fitness y nutrición experto. Ayuda al usuario con consejos personalizados basados en su información: {user_context}"},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
+        # Contexto del usuario y presupuesto de tokens
+        try:
+            prompt = render_prompt('chat', **profile_values(user.to_dict()), message=message)
+        except PromptBudgetExceeded:
+            return jsonify({'error': 'Mensaje demasiado largo'}), 400
+        
+        messages = prompt.messages
+        stream_mode = request.args.get('stream') in ('1', 'true') or 'text/event-stream' in request.headers.get('Accept', '')
+        
+        # Preguntas genéricas: respuesta de una pregunta equivalente del mismo objetivo y nivel
+        partition = chat_cache.partition_for(user.fitness_goal, user.activity_level)
+        use_cache = data.get('use_cache', True) and chat_cache.cacheable(message)
         
-        ai_response = response.choices[0].message.content.strip()
+        if use_cache:
+            cached_answer = chat_cache.lookup(partition, message)
+            if cached_answer is not None:
+                if stream_mode:
+                    return _stream_cached(cached_answer)
+                return jsonify({'response': cached_answer, 'cached': True}), 200
+        
+        limited = _rate_limit(user, 'chat')
+        if limited:
+            return limited
+        
+        def remember(answer, tokens=None):
+            if use_cache:
+                _store_chat_answer(partition, message, answer, user, tokens or prompt.input_tokens + estimate_tokens(answer))
+        
+        try:
+            # Modo streaming (Server-Sent Events) bajo demanda
+            if stream_mode:
+                return _stream_chat(messages, user.tier, prompt.max_tokens, on_complete=remember)
+            
+            # Llamar a OpenAI
+            response = llm.complete('chat', messages, tier=user.tier, max_tokens=prompt.max_tokens)
+        except LLMUnavailable as e:
+            # Proveedor degradado o sin plazas: responder ya en lugar de esperar al timeout
+            unavailable = jsonify({'error': 'El asistente no está disponible en este momento, intenta más tarde'})
+            unavailable.headers['Retry-After'] = str(max(1, round(e.retry_after or 1)))
+            return unavailable, 503
+        
+        ai_response = response.content
+        remember(ai_response, (response.prompt_tokens or 0) + (response.completion_tokens or 0))
         
         return jsonify({
             'response': ai_response
         }), 200
         
     except Exception as e:
-        print(f"Error in AI chat: {str(e)}")
+        _log_error('chat', f"Error in AI chat: {str(e)}")
         return jsonify({'error': 'Error procesando la consulta'}), 500
 
+def _sse(data, event=None):
+    """Formatea un mensaje Server-Sent Events"""
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
+
+def _store_chat_answer(partition, message, answer, user, tokens):
+    """Guarda la respuesta en la caché semántica si no menciona al usuario por su nombre"""
+    names = [part for part in (user.name or '').split() if len(part) >= 3]
+    if not answer or any(re.search(rf'\b{re.escape(name)}\b', answer, re.IGNORECASE) for name in names):
+        return
+    chat_cache.store(partition, message, answer, tokens)
+
+def _stream_cached(answer):
+    """Devuelve una respuesta de la caché con el mismo formato SSE que el streaming"""
+    body = _sse({'token': answer}) + _sse({'ttft_ms': 0, 'total_ms': 0, 'cached': True}, event='done')
+    response = Response(body, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _stream_chat(messages, tier, max_tokens, on_complete=None):
+    """Reenvía los tokens del proveedor al cliente a medida que llegan"""
+    stream = llm.stream('chat', messages, tier=tier, max_tokens=max_tokens)
+    
+    def generate():
+        completed = False
+        tokens = []
+        try:
+            for token in stream:
+                tokens.append(token)
+                yield _sse({'token': token})
+            
+            completed = True
+            yield _sse({'ttft_ms': stream.ttft_ms, 'total_ms': stream.total_ms}, event='done')
+            
+            if on_complete:
+                on_complete(''.join(tokens))
+        
+        except Exception as e:
+            _log_error('chat_stream', f"Error in AI chat stream: {str(e)}")
+            yield _sse({'error': 'Error procesando la consulta'}, event='error')
+        
+        finally:
+            # Si el cliente se desconectó, el servidor cierra este generador:
+            # cerramos también el stream del proveedor para no seguir consumiendo tokens
+            if not completed:
+                stream.close()
+            
+            logger.info(f"AI chat stream {'completed' if completed else 'cancelled'}: "
+                        f"ttft={stream.ttft_ms}ms total={stream.total_ms}ms")
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
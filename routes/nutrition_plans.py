@@ -3,11 +3,15 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 from app import db
 from models.user import User, NutritionPlan
+from models.user_stats import UserStats, load_user_stats
+from utils.pagination import InvalidCursor, page_size, paginate
+from utils.response_cache import conditional_get
 
 nutrition_bp = Blueprint('nutrition', __name__)
 
 @nutrition_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_nutrition_plans():
     try:
         user_id = get_jwt_identity()
@@ -18,17 +22,34 @@ def get_nutrition_plans():
         
         # Obtener parámetros de filtro
         status = request.args.get('status')
+        food = request.args.get('food')
+        
+        # Campos de la respuesta: las columnas no pedidas (p. ej. plan_data) no se leen
+        try:
+            fields = NutritionPlan.select_fields(request.args.get('fields'), request.args.get('view'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Construir query
-        query = NutritionPlan.query.filter_by(user_id=user_id)
+        # created_at también hace falta para el cursor de la página siguiente
+        query = NutritionPlan.query.filter_by(user_id=user_id).options(*NutritionPlan.load_options(fields and fields + ['created_at']))
         
         if status:
             query = query.filter_by(status=status)
+        if food:
+            # Se filtra sobre el JSON en la base de datos
+            query = query.filter(NutritionPlan.contains_food(food))
         
-        plans = query.order_by(NutritionPlan.created_at.desc()).all()
+        # Página por cursor sobre (created_at, id)
+        try:
+            plans, next_cursor = paginate(query, NutritionPlan.created_at, NutritionPlan.id, request.args.get('cursor'),
+                                          page_size(request.args.get('limit', type=int)))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'plans': [plan.to_dict() for plan in plans]
+            'plans': [plan.to_dict(fields) for plan in plans],
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -238,33 +259,28 @@ def update_nutrition_progress(plan_id):
 
 @nutrition_bp.route('/stats', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_nutrition_stats():
     try:
         user_id = get_jwt_identity()
         
-        # Obtener estadísticas de planes nutricionales
-        total_plans = NutritionPlan.query.filter_by(user_id=user_id).count()
-        active_plans = NutritionPlan.query.filter_by(user_id=user_id, status='active').count()
-        completed_plans = NutritionPlan.query.filter_by(user_id=user_id, status='completed').count()
-        
-        # Calcular progreso promedio
-        plans = NutritionPlan.query.filter_by(user_id=user_id).all()
-        avg_progress = sum(plan.progress for plan in plans) / len(plans) if plans else 0
-        
-        # Calcular calorías promedio
-        avg_calories = sum(plan.daily_calories for plan in plans if plan.daily_calories) / len([p for p in plans if p.daily_calories]) if plans else 0
+        try:
+            fields = NutritionPlan.select_fields(request.args.get('fields'), request.args.get('view'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Obtener plan más reciente
-        latest_plan = NutritionPlan.query.filter_by(user_id=user_id).order_by(NutritionPlan.created_at.desc()).first()
+        # Una sola lectura: agregados del usuario y su plan más reciente
+        row = load_user_stats(user_id, NutritionPlan, join=[(NutritionPlan, NutritionPlan.id == UserStats.nutrition_latest_id)],
+                              options=NutritionPlan.load_options(fields))
+        if row is None:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        user_stats, latest_plan = row
         
-        stats = {
-            'total_plans': total_plans,
-            'active_plans': active_plans,
-            'completed_plans': completed_plans,
-            'average_progress': round(avg_progress, 1),
-            'average_calories': round(avg_calories, 0),
-            'latest_plan': latest_plan.to_dict() if latest_plan else None
-        }
+        stats = dict(
+            user_stats.plan_summary('nutrition'),
+            average_calories=user_stats.average_calories,
+            latest_plan=latest_plan.to_dict(fields) if latest_plan else None
+        )
         
         return jsonify({'stats': stats}), 200
         
@@ -2,14 +2,20 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, date, timedelta
 from sqlalchemy import func, desc
+from sqlalchemy.exc import IntegrityError
 from app import db
 from models.user import User, ProgressEntry
-import statistics
+from models.progress_rollups import ENTRIES_METRIC, combine_rollups, load_rollups, period_bounds
+from models.user_stats import UserStats, load_user_stats
+from utils.progress_analytics import ProgressSeries
+from utils.pagination import InvalidCursor, page_size, paginate
+from utils.response_cache import conditional_get
 
 progress_bp = Blueprint('progress', __name__)
 
 @progress_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_progress_entries():
     try:
         user_id = get_jwt_identity()
@@ -21,7 +27,7 @@ def get_progress_entries():
         # Obtener parámetros de filtro
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
-        limit = request.args.get('limit', type=int)
+        limit = page_size(request.args.get('limit', type=int))
         
         # Construir query
         query = ProgressEntry.query.filter_by(user_id=user_id)
@@ -31,16 +37,16 @@ def get_progress_entries():
         if end_date:
             query = query.filter(ProgressEntry.date <= datetime.strptime(end_date, '%Y-%m-%d').date())
         
-        query = query.order_by(desc(ProgressEntry.date))
-        
-        if limit:
-            query = query.limit(limit)
-        
-        entries = query.all()
+        # Página por cursor sobre (date, id)
+        try:
+            entries, next_cursor = paginate(query, ProgressEntry.date, ProgressEntry.id, request.args.get('cursor'), limit)
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
             'entries': [entry.to_dict() for entry in entries],
-            'total': len(entries)
+            'total': len(entries),
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -74,43 +80,31 @@ def create_progress_entry():
         data = request.get_json()
         
         # Validar que al menos un campo de medición esté presente
-        measurement_fields = ['weight', 'body_fat', 'muscle_mass', 'chest', 'waist', 'hips', 'arms', 'thighs']
-        if not any(data.get(field) for field in measurement_fields):
+        if not any(data.get(field) for field in ProgressEntry.MEASUREMENT_FIELDS):
             return jsonify({'error': 'Al menos una medición es requerida'}), 400
         
-        # Verificar si ya existe una entrada para esta fecha
+        # Un registro por día: si ya existe, se completa con los nuevos valores
         entry_date = datetime.strptime(data.get('date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
-        existing_entry = ProgressEntry.query.filter_by(user_id=user_id, date=entry_date).first()
-        
-        if existing_entry:
-            return jsonify({'error': 'Ya existe un registro para esta fecha'}), 400
-        
-        entry = ProgressEntry(
-            user_id=user_id,
-            date=entry_date,
-            weight=data.get('weight'),
-            body_fat=data.get('body_fat'),
-            muscle_mass=data.get('muscle_mass'),
-            chest=data.get('chest'),
-            waist=data.get('waist'),
-            hips=data.get('hips'),
-            arms=data.get('arms'),
-            thighs=data.get('thighs'),
-            notes=data.get('notes', '')
-        )
-        
-        db.session.add(entry)
-        db.session.commit()
+        values = {field: data.get(field) for field in ProgressEntry.MEASUREMENT_FIELDS}
+        entry_id, created = ProgressEntry.upsert(user_id, entry_date, dict(values, notes=data.get('notes', '')))
         
         # Actualizar el peso del usuario si se proporciona
         if data.get('weight'):
             user.weight = data['weight']
-            db.session.commit()
+        db.session.commit()
+        
+        entry = ProgressEntry.query.get(entry_id)
+        
+        if created:
+            return jsonify({
+                'message': 'Registro de progreso creado exitosamente',
+                'entry': entry.to_dict()
+            }), 201
         
         return jsonify({
-            'message': 'Registro de progreso creado exitosamente',
+            'message': 'Registro de progreso actualizado exitosamente',
             'entry': entry.to_dict()
-        }), 201
+        }), 200
         
     except Exception as e:
         db.session.rollback()
@@ -136,14 +130,14 @@ def update_progress_entry(entry_id):
         
         # Actualizar fecha si se proporciona
         if 'date' in data:
-            new_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
-            # Verificar que no haya conflicto con otra entrada
-            existing_entry = ProgressEntry.query.filter_by(user_id=user_id, date=new_date).filter(ProgressEntry.id != entry_id).first()
-            if existing_entry:
-                return jsonify({'error': 'Ya existe un registro para esta fecha'}), 400
-            entry.date = new_date
+            entry.date = datetime.strptime(data['date'], '%Y-%m-%d').date()
         
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # La restricción única (user_id, date) detecta el conflicto con otra entrada
+            db.session.rollback()
+            return jsonify({'error': 'Ya existe un registro para esta fecha'}), 400
         
         return jsonify({
             'message': 'Registro actualizado exitosamente',
@@ -175,14 +169,18 @@ def delete_progress_entry(entry_id):
 
 @progress_bp.route('/stats', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_progress_stats():
     try:
         user_id = get_jwt_identity()
         
-        # Obtener todas las entradas del usuario
-        entries = ProgressEntry.query.filter_by(user_id=user_id).order_by(ProgressEntry.date).all()
+        # Recuento y racha salen de los agregados; sin registros no se consulta nada más
+        row = load_user_stats(user_id, User, join=[(User, User.id == UserStats.user_id)])
+        if row is None:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        user_stats, user = row
         
-        if not entries:
+        if not user_stats.progress_entries:
             return jsonify({
                 'stats': {
                     'total_entries': 0,
@@ -195,43 +193,35 @@ def get_progress_stats():
                 }
             }), 200
         
-        # Calcular estadísticas básicas
-        total_entries = len(entries)
-        
-        # Calcular racha actual
-        current_streak = calculate_current_streak(entries)
+        # Las tendencias, promedios e IMC necesitan la serie completa (en columnas)
+        series = ProgressSeries.load(user_id)
         
         # Calcular cambios desde el primer registro
-        first_entry = entries[0]
-        latest_entry = entries[-1]
-        
-        weight_change = (latest_entry.weight - first_entry.weight) if (latest_entry.weight and first_entry.weight) else 0
-        body_fat_change = (latest_entry.body_fat - first_entry.body_fat) if (latest_entry.body_fat and first_entry.body_fat) else 0
-        muscle_mass_change = (latest_entry.muscle_mass - first_entry.muscle_mass) if (latest_entry.muscle_mass and first_entry.muscle_mass) else 0
+        weight_change = series.endpoint_change('weight') or 0
+        body_fat_change = series.endpoint_change('body_fat') or 0
+        muscle_mass_change = series.endpoint_change('muscle_mass') or 0
         
         # Calcular cambios en medidas corporales
         measurements_change = {}
         measurement_fields = ['chest', 'waist', 'hips', 'arms', 'thighs']
         for field in measurement_fields:
-            first_val = getattr(first_entry, field)
-            latest_val = getattr(latest_entry, field)
-            if first_val and latest_val:
-                measurements_change[field] = latest_val - first_val
+            change = series.endpoint_change(field)
+            if change is not None:
+                measurements_change[field] = change
         
         # Calcular tendencias (últimos 30 días)
         thirty_days_ago = date.today() - timedelta(days=30)
-        recent_entries = [e for e in entries if e.date >= thirty_days_ago]
-        trends = calculate_trends(recent_entries)
+        trends = calculate_trends(series.since(thirty_days_ago))
         
         # Calcular promedios y rangos
-        averages = calculate_averages(entries)
+        averages = calculate_averages(series.summary())
         
         # Calcular BMI si hay datos
-        bmi_data = calculate_bmi_progression(entries)
+        bmi_data = series.bmi(user.height)
         
         stats = {
-            'total_entries': total_entries,
-            'current_streak': current_streak,
+            'total_entries': user_stats.progress_entries,
+            'current_streak': user_stats.current_streak,
             'weight_change': round(weight_change, 1),
             'body_fat_change': round(body_fat_change, 1),
             'muscle_mass_change': round(muscle_mass_change, 1),
@@ -240,9 +230,9 @@ def get_progress_stats():
             'averages': averages,
             'bmi_data': bmi_data,
             'date_range': {
-                'first': first_entry.date.isoformat(),
-                'latest': latest_entry.date.isoformat(),
-                'days_tracked': (latest_entry.date - first_entry.date).days + 1
+                'first': series.first_date.isoformat(),
+                'latest': series.last_date.isoformat(),
+                'days_tracked': (series.last_date - series.first_date).days + 1
             }
         }
         
@@ -253,6 +243,7 @@ def get_progress_stats():
 
 @progress_bp.route('/analytics', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_progress_analytics():
     try:
         user_id = get_jwt_identity()
@@ -276,13 +267,15 @@ def get_progress_analytics():
         else:  # year
             start_date = end_date - timedelta(days=365)
         
+        # Trimestre y año se calculan con los resúmenes semanales o mensuales, sin leer los registros
+        if period not in ('week', 'month'):
+            analytics = rollup_analytics(user, period, metric, start_date, end_date)
+            return jsonify({'analytics': analytics}), 200
+        
         # Obtener entradas del período
-        entries = ProgressEntry.query.filter_by(user_id=user_id)\
-            .filter(ProgressEntry.date >= start_date)\
-            .filter(ProgressEntry.date <= end_date)\
-            .order_by(ProgressEntry.date).all()
+        series = ProgressSeries.load(user_id, start_date, end_date)
         
-        if not entries:
+        if not len(series):
             return jsonify({
                 'analytics': {
                     'period': period,
@@ -293,20 +286,14 @@ def get_progress_analytics():
             }), 200
         
         # Generar puntos de datos
-        data_points = []
-        for entry in entries:
-            point = {
-                'date': entry.date.isoformat(),
-                'value': getattr(entry, metric) if hasattr(entry, metric) else None
-            }
-            if point['value'] is not None:
-                data_points.append(point)
+        data_points = series.points(metric)
+        summary = series.summary()
         
         # Generar insights inteligentes
-        insights = generate_insights(entries, metric, user)
+        insights = generate_insights(summarize_series(series, summary), metric, user)
         
         # Calcular estadísticas del período
-        period_stats = calculate_period_stats(data_points, metric)
+        period_stats = calculate_period_stats(summary.get(metric))
         
         analytics = {
             'period': period,
@@ -314,7 +301,7 @@ def get_progress_analytics():
             'data_points': data_points,
             'insights': insights,
             'period_stats': period_stats,
-            'recommendations': generate_recommendations(entries, metric, user)
+            'recommendations': generate_recommendations(len(series), metric, user)
         }
         
         return jsonify({'analytics': analytics}), 200
@@ -346,103 +333,103 @@ def get_progress_goals():
 
 # Funciones auxiliares para cálculos avanzados
 
-def calculate_current_streak(entries):
-    """Calcula la racha actual de días consecutivos con registros"""
-    if not entries:
-        return 0
-    
-    # Ordenar por fecha descendente
-    sorted_entries = sorted(entries, key=lambda x: x.date, reverse=True)
-    current_date = date.today()
-    streak = 0
-    
-    for entry in sorted_entries:
-        days_diff = (current_date - entry.date).days
-        if days_diff == streak:
-            streak += 1
-            current_date = entry.date
-        else:
-            break
-    
-    return streak
-
-def calculate_trends(entries):
-    """Calcula tendencias en los datos recientes"""
-    if len(entries) < 2:
+def calculate_trends(series):
+    """Tendencia de peso, grasa y masa muscular: pendiente por mínimos cuadrados sobre las fechas"""
+    if len(series) < 2:
         return {}
     
     trends = {}
-    metrics = ['weight', 'body_fat', 'muscle_mass']
+    summary = series.summary()
     
-    for metric in metrics:
-        values = [getattr(e, metric) for e in entries if getattr(e, metric) is not None]
-        if len(values) >= 2:
-            # Calcular tendencia simple (pendiente)
-            x = list(range(len(values)))
-            if len(values) > 1:
-                slope = (values[-1] - values[0]) / (len(values) - 1)
-                trends[metric] = {
-                    'direction': 'increasing' if slope > 0 else 'decreasing' if slope < 0 else 'stable',
-                    'rate': round(slope, 2),
-                    'confidence': min(len(values) / 10, 1.0)  # Más datos = más confianza
-                }
+    for metric in ['weight', 'body_fat', 'muscle_mass']:
+        stats = summary.get(metric)
+        if stats and stats['count'] >= 2:
+            slope = stats['slope']  # unidades por día
+            trends[metric] = {
+                'direction': 'increasing' if slope > 0 else 'decreasing' if slope < 0 else 'stable',
+                'rate': round(slope, 3),
+                'smoothed': round(stats['smoothed'], 1),
+                'confidence': min(stats['count'] / 10, 1.0)  # Más datos = más confianza
+            }
     
     return trends
 
-def calculate_averages(entries):
-    """Calcula promedios de las métricas"""
-    averages = {}
-    metrics = ['weight', 'body_fat', 'muscle_mass', 'chest', 'waist', 'hips', 'arms', 'thighs']
+def calculate_averages(summary):
+    """Promedios y rangos de las métricas a partir de ProgressSeries.summary"""
+    return {
+        metric: {
+            'mean': round(stats['mean'], 1),
+            'median': round(stats['median'], 1),
+            'min': round(stats['min'], 1),
+            'max': round(stats['max'], 1)
+        }
+        for metric, stats in summary.items()
+    }
+
+def summarize_series(series, summary):
+    """Resumen de actividad de una serie de registros (ver generate_insights)"""
+    weight = summary.get('weight')
+    return {
+        'entries': len(series),
+        'first_date': series.first_date,
+        'last_date': series.last_date,
+        'weight_change': weight['last'] - weight['first'] if weight and weight['count'] >= 2 else None
+    }
+
+def rollup_analytics(user, period, metric, start_date, end_date):
+    """Analíticas de un periodo largo a partir de los resúmenes semanales (trimestre) o mensuales (año).
     
-    for metric in metrics:
-        values = [getattr(e, metric) for e in entries if getattr(e, metric) is not None]
-        if values:
-            averages[metric] = {
-                'mean': round(statistics.mean(values), 1),
-                'median': round(statistics.median(values), 1),
-                'min': round(min(values), 1),
-                'max': round(max(values), 1)
-            }
+    El periodo empieza en el inicio de la semana o mes que contiene start_date y cada punto
+    de datos es la media de un periodo del resumen.
+    """
+    granularity = 'week' if period == 'quarter' else 'month'
+    start_date = period_bounds(granularity, start_date)[0]
+    metrics = list(dict.fromkeys(['weight', metric] if metric in ProgressEntry.MEASUREMENT_FIELDS else ['weight']))
+    rollups = load_rollups(user.id, granularity, start_date, end_date, metrics + [ENTRIES_METRIC])
+    series = rollups.get(metric, [])
     
-    return averages
-
-def calculate_bmi_progression(entries):
-    """Calcula la progresión del BMI si hay datos de peso y altura"""
-    bmi_data = []
+    analytics = {
+        'period': period,
+        'metric': metric,
+        'granularity': granularity,
+        'start_date': start_date.isoformat(),
+        'data_points': [],
+        'insights': []
+    }
+    entries = rollups[ENTRIES_METRIC]
+    if not entries:
+        return analytics
     
-    for entry in entries:
-        if entry.weight and entry.user.height:
-            height_m = entry.user.height / 100  # convertir cm a metros
-            bmi = entry.weight / (height_m ** 2)
-            bmi_data.append({
-                'date': entry.date.isoformat(),
-                'bmi': round(bmi, 1),
-                'category': get_bmi_category(bmi)
-            })
+    analytics['data_points'] = [{
+        'date': rollup.period_start.isoformat(),
+        'value': round(rollup.mean, 2),
+        'count': rollup.count,
+        'min': rollup.min_value,
+        'max': rollup.max_value
+    } for rollup in series]
     
-    return bmi_data
-
-def get_bmi_category(bmi):
-    """Determina la categoría del BMI"""
-    if bmi < 18.5:
-        return 'Bajo peso'
-    elif bmi < 25:
-        return 'Normal'
-    elif bmi < 30:
-        return 'Sobrepeso'
-    else:
-        return 'Obesidad'
+    weight = combine_rollups(rollups['weight'])
+    activity = {
+        'entries': sum(rollup.count for rollup in entries),
+        'first_date': entries[0].first_date,
+        'last_date': entries[-1].last_date,
+        'weight_change': weight['last'] - weight['first'] if weight and weight['count'] >= 2 else None
+    }
+    analytics['insights'] = generate_insights(activity, metric, user)
+    analytics['period_stats'] = calculate_period_stats(combine_rollups(series))
+    analytics['recommendations'] = generate_recommendations(activity['entries'], metric, user)
+    return analytics
 
-def generate_insights(entries, metric, user):
-    """Genera insights inteligentes basados en los datos"""
+def generate_insights(activity, metric, user):
+    """Genera insights inteligentes basados en el resumen de actividad (summarize_series)"""
     insights = []
     
-    if len(entries) < 2:
+    if activity['entries'] < 2:
         return insights
     
     # Insight sobre consistencia
-    days_with_data = len(entries)
-    total_days = (entries[-1].date - entries[0].date).days + 1
+    days_with_data = activity['entries']
+    total_days = (activity['last_date'] - activity['first_date']).days + 1
     consistency = days_with_data / total_days
     
     if consistency > 0.8:
@@ -458,9 +445,8 @@ def generate_insights(entries, metric, user):
     
     # Insights específicos por métrica
     if metric == 'weight' and user.fitness_goal:
-        weight_values = [e.weight for e in entries if e.weight]
-        if len(weight_values) >= 2:
-            change = weight_values[-1] - weight_values[0]
+        change = activity['weight_change']
+        if change is not None:
             if user.fitness_goal == 'weight_loss' and change < -1:
                 insights.append({
                     'type': 'positive',
@@ -474,26 +460,24 @@ def generate_insights(entries, metric, user):
     
     return insights
 
-def calculate_period_stats(data_points, metric):
-    """Calcula estadísticas del período"""
-    if not data_points:
+def calculate_period_stats(stats):
+    """Estadísticas del período a partir de ProgressSeries.summary o combine_rollups de una métrica"""
+    if not stats:
         return {}
     
-    values = [point['value'] for point in data_points]
-    
     return {
-        'total_change': round(values[-1] - values[0], 1) if len(values) > 1 else 0,
-        'average': round(statistics.mean(values), 1),
-        'best_value': round(max(values), 1),
-        'worst_value': round(min(values), 1),
-        'volatility': round(statistics.stdev(values), 1) if len(values) > 1 else 0
+        'total_change': round(stats['last'] - stats['first'], 1) if stats['count'] > 1 else 0,
+        'average': round(stats['mean'], 1),
+        'best_value': round(stats['max'], 1),
+        'worst_value': round(stats['min'], 1),
+        'volatility': round(stats['stdev'], 1) if stats['count'] > 1 else 0
     }
 
-def generate_recommendations(entries, metric, user):
+def generate_recommendations(entry_count, metric, user):
     """Genera recomendaciones personalizadas"""
     recommendations = []
     
-    if not entries:
+    if not entry_count:
         recommendations.append("Comienza a registrar tu progreso regularmente para obtener recomendaciones personalizadas.")
         return recommendations
     
@@ -506,7 +490,7 @@ def generate_recommendations(entries, metric, user):
         recommendations.append("Registra tus medidas corporales además del peso para ver el progreso muscular.")
     
     # Recomendaciones basadas en la consistencia
-    if len(entries) < 5:
+    if entry_count < 5:
         recommendations.append("Intenta registrar tu progreso al menos 2-3 veces por semana para mejores insights.")
     
     return recommendations
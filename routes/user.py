@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime
+from datetime import datetime, timedelta
 from app import db
 from models.user import User
+from models.user_stats import UserStats, load_user_stats
+from utils.response_cache import conditional_get
 
 user_bp = Blueprint('user', __name__)
 
@@ -41,6 +43,15 @@ def update_profile():
                 return jsonify({'error': 'El email ya está en uso'}), 400
             user.email = new_email
         
+        # Asignar o quitar entrenador (solo cuentas pro vigentes pueden serlo)
+        if 'coach_id' in data:
+            coach_id = data['coach_id']
+            if coach_id is not None:
+                coach = User.query.get(coach_id)
+                if not coach or coach.id == user.id or coach.tier != 'pro':
+                    return jsonify({'error': 'Entrenador no válido'}), 400
+            user.coach_id = coach_id
+        
         # Actualizar otros campos
         user.update_from_dict(data)
         db.session.commit()
@@ -56,48 +67,23 @@ def update_profile():
 
 @user_bp.route('/stats', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_user_stats():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
         
-        if not user:
+        # Una sola lectura por clave primaria: agregados mantenidos en cada escritura
+        row = load_user_stats(user_id, User, join=[(User, User.id == UserStats.user_id)])
+        if not row or row[1] is None:
             return jsonify({'error': 'Usuario no encontrado'}), 404
-        
-        # Obtener estadísticas del usuario
-        workout_plans_count = len(user.workout_plans)
-        nutrition_plans_count = len(user.nutrition_plans)
-        progress_entries_count = len(user.progress_entries)
-        
-        # Calcular racha actual (días consecutivos con actividad)
-        current_streak = 0
-        if user.progress_entries:
-            # Ordenar entradas por fecha descendente
-            sorted_entries = sorted(user.progress_entries, key=lambda x: x.date, reverse=True)
-            current_date = datetime.now().date()
-            
-            for entry in sorted_entries:
-                if entry.date == current_date or (current_date - entry.date).days == current_streak:
-                    current_streak += 1
-                    current_date = entry.date
-                else:
-                    break
-        
-        # Calcular progreso de peso si hay entradas
-        weight_change = 0
-        if len(user.progress_entries) >= 2:
-            sorted_entries = sorted(user.progress_entries, key=lambda x: x.date)
-            first_weight = next((e.weight for e in sorted_entries if e.weight), None)
-            last_weight = next((e.weight for e in reversed(sorted_entries) if e.weight), None)
-            if first_weight and last_weight:
-                weight_change = last_weight - first_weight
+        user_stats, user = row
         
         stats = {
-            'workout_plans': workout_plans_count,
-            'nutrition_plans': nutrition_plans_count,
-            'progress_entries': progress_entries_count,
-            'current_streak': current_streak,
-            'weight_change': round(weight_change, 1) if weight_change else 0,
+            'workout_plans': user_stats.workout_plans,
+            'nutrition_plans': user_stats.nutrition_plans,
+            'progress_entries': user_stats.progress_entries,
+            'current_streak': user_stats.current_streak,
+            'weight_change': user_stats.weight_change,
             'member_since': user.created_at.isoformat() if user.created_at else None,
             'last_activity': user.last_login.isoformat() if user.last_login else None
         }
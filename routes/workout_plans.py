@@ -3,11 +3,16 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 from app import db
 from models.user import User, WorkoutPlan
+from models.user_stats import UserStats, load_user_stats
+from models.workout_structure import assemble_plans, top_exercises
+from utils.pagination import InvalidCursor, page_size, paginate
+from utils.response_cache import conditional_get
 
 workout_bp = Blueprint('workouts', __name__)
 
 @workout_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_workout_plans():
     try:
         user_id = get_jwt_identity()
@@ -19,19 +24,40 @@ def get_workout_plans():
         # Obtener parámetros de filtro
         status = request.args.get('status')
         difficulty = request.args.get('difficulty')
+        exercise = request.args.get('exercise')
+        
+        # Campos de la respuesta: las columnas no pedidas (p. ej. plan_data) no se leen
+        try:
+            fields = WorkoutPlan.select_fields(request.args.get('fields'), request.args.get('view'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Construir query
-        query = WorkoutPlan.query.filter_by(user_id=user_id)
+        # created_at también hace falta para el cursor de la página siguiente
+        query = WorkoutPlan.query.filter_by(user_id=user_id).options(*WorkoutPlan.load_options(fields and fields + ['created_at']))
         
         if status:
             query = query.filter_by(status=status)
         if difficulty:
             query = query.filter_by(difficulty=difficulty)
+        if exercise:
+            # Se filtra sobre el JSON en la base de datos
+            query = query.filter(WorkoutPlan.contains_exercise(exercise))
+        
+        # Página por cursor sobre (created_at, id)
+        try:
+            plans, next_cursor = paginate(query, WorkoutPlan.created_at, WorkoutPlan.id, request.args.get('cursor'),
+                                          page_size(request.args.get('limit', type=int)))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
         
-        plans = query.order_by(WorkoutPlan.created_at.desc()).all()
+        # Los planes normalizados de la página se reconstruyen con una sola consulta
+        if fields is None or 'plan_data' in fields:
+            assemble_plans(plans)
         
         return jsonify({
-            'plans': [plan.to_dict() for plan in plans]
+            'plans': [plan.to_dict(fields) for plan in plans],
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -193,6 +219,51 @@ def complete_workout_plan(plan_id):
         db.session.rollback()
         return jsonify({'error': 'Error interno del servidor'}), 500
 
+@workout_bp.route('/<int:plan_id>/weeks/<int:week_index>/workouts/<int:workout_index>', methods=['PATCH'])
+@jwt_required()
+def mark_workout_session(plan_id, week_index, workout_index):
+    """Marca una sesión del plan como hecha (``completed``); índices desde 0"""
+    try:
+        user_id = get_jwt_identity()
+        plan = WorkoutPlan.query.filter_by(id=plan_id, user_id=user_id).first()
+        
+        if not plan:
+            return jsonify({'error': 'Plan no encontrado'}), 404
+        
+        data = request.get_json() or {}
+        completed = data.get('completed', True)
+        if not isinstance(completed, bool):
+            return jsonify({'error': 'completed debe ser true o false'}), 400
+        
+        if not plan.mark_workout(week_index, workout_index, completed):
+            return jsonify({'error': 'Sesión no encontrada en el plan'}), 404
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Sesión actualizada exitosamente',
+            'week_index': week_index,
+            'workout_index': workout_index,
+            'completed': completed
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@workout_bp.route('/exercises/top', methods=['GET'])
+@jwt_required()
+@conditional_get
+def get_top_exercises():
+    """Ejercicios principales más hechos (y más planificados) en los planes normalizados"""
+    try:
+        user_id = get_jwt_identity()
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        
+        return jsonify({'exercises': top_exercises(user_id, limit)}), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
 @workout_bp.route('/<int:plan_id>/progress', methods=['POST'])
 @jwt_required()
 def update_workout_progress(plan_id):
@@ -231,29 +302,27 @@ def update_workout_progress(plan_id):
 
 @workout_bp.route('/stats', methods=['GET'])
 @jwt_required()
+@conditional_get
 def get_workout_stats():
     try:
         user_id = get_jwt_identity()
         
-        # Obtener estadísticas de planes de entrenamiento
-        total_plans = WorkoutPlan.query.filter_by(user_id=user_id).count()
-        active_plans = WorkoutPlan.query.filter_by(user_id=user_id, status='active').count()
-        completed_plans = WorkoutPlan.query.filter_by(user_id=user_id, status='completed').count()
-        
-        # Calcular progreso promedio
-        plans = WorkoutPlan.query.filter_by(user_id=user_id).all()
-        avg_progress = sum(plan.progress for plan in plans) / len(plans) if plans else 0
-        
-        # Obtener plan más reciente
-        latest_plan = WorkoutPlan.query.filter_by(user_id=user_id).order_by(WorkoutPlan.created_at.desc()).first()
-        
-        stats = {
-            'total_plans': total_plans,
-            'active_plans': active_plans,
-            'completed_plans': completed_plans,
-            'average_progress': round(avg_progress, 1),
-            'latest_plan': latest_plan.to_dict() if latest_plan else None
-        }
+        try:
+            fields = WorkoutPlan.select_fields(request.args.get('fields'), request.args.get('view'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Una sola lectura: agregados del usuario y su plan más reciente
+        row = load_user_stats(user_id, WorkoutPlan, join=[(WorkoutPlan, WorkoutPlan.id == UserStats.workout_latest_id)],
+                              options=WorkoutPlan.load_options(fields))
+        if row is None:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        user_stats, latest_plan = row
+        
+        stats = dict(
+            user_stats.plan_summary('workout'),
+            latest_plan=latest_plan.to_dict(fields) if latest_plan else None
+        )
         
         return jsonify({'stats': stats}), 200
         
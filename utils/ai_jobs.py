@@ -0,0 +1,252 @@
+import hashlib
+import itertools
+import json
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models.ai import AIJob, GenerationLease
+
+logger = logging.getLogger(__name__)
+
+# Manejadores registrados por tipo de trabajo y su límite de tiempo
+_job_handlers: Dict[str, Callable] = {}
+_job_timeouts: Dict[str, str] = {}
+
+_executor: Optional['PriorityExecutor'] = None
+_executor_lock = threading.Lock()
+_pending_jobs = 0
+
+
+class JobQueueFull(Exception):
+    """Se lanza cuando el pool de trabajos no admite más generaciones"""
+
+
+def job_handler(job_type: str, timeout_setting: str = 'AI_JOB_TIMEOUT_SECONDS'):
+    """Registra la función que ejecuta los trabajos de un tipo.
+
+    El manejador recibe el AIJob (dentro de un contexto de aplicación) y
+    devuelve el plan persistido o None. ``timeout_setting`` es la clave de
+    configuración con el tiempo máximo de ese tipo de trabajo.
+    """
+    def decorator(func):
+        _job_handlers[job_type] = func
+        _job_timeouts[job_type] = timeout_setting
+        return func
+    return decorator
+
+
+def _job_timeout(app, job_type: str) -> timedelta:
+    setting = _job_timeouts.get(job_type, 'AI_JOB_TIMEOUT_SECONDS')
+    return timedelta(seconds=app.config.get(setting, 300))
+
+
+class PriorityExecutor:
+    """Pool de hilos que atiende antes los trabajos de menor número de prioridad.
+
+    A igual prioridad se respeta el orden de llegada. Los hilos son daemon:
+    un trabajo interrumpido al parar el proceso queda en ai_jobs y caduca.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = 'ai-job'):
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        for i in range(max_workers):
+            threading.Thread(target=self._worker, name=f'{thread_name_prefix}_{i}', daemon=True).start()
+
+    def submit(self, priority: int, fn: Callable, *args):
+        self._queue.put((priority, next(self._seq), fn, args))
+
+    def _worker(self):
+        while True:
+            _, _, fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Error no controlado en el pool de trabajos: {e}")
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+
+def _get_executor(app) -> PriorityExecutor:
+    """Crea el pool de hilos la primera vez que se necesita"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = PriorityExecutor(
+                max_workers=app.config.get('AI_JOB_WORKERS', 4),
+                thread_name_prefix='ai-job'
+            )
+        return _executor
+
+
+def make_dedupe_key(user_id: int, job_type: str, params: Dict) -> str:
+    """Clave de deduplicación: usuario, tipo de trabajo y parámetros normalizados"""
+    def normalize(value):
+        if isinstance(value, str):
+            return value.strip().lower()
+        if isinstance(value, (list, tuple)):
+            return sorted({str(normalize(v)) for v in value})
+        return value
+
+    canonical = {k: normalize(v) for k, v in params.items() if k != 'cache_key'}
+    payload = json.dumps([int(user_id), job_type, canonical], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def find_inflight_job(dedupe_key: str) -> Optional[AIJob]:
+    """Devuelve el trabajo asociado a una reserva vigente, o None.
+
+    Las reservas caducadas o de trabajos fallidos se eliminan para que la
+    siguiente petición pueda generar de nuevo.
+    """
+    lease = db.session.get(GenerationLease, dedupe_key)
+    if lease is None:
+        return None
+
+    job = db.session.get(AIJob, lease.job_id)
+    if job is not None and job.status != 'failed' and lease.expires_at > datetime.utcnow():
+        return job
+
+    # Borrado condicional: no eliminar una reserva creada entretanto por otro worker
+    GenerationLease.query.filter_by(lease_key=dedupe_key, job_id=lease.job_id)\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return None
+
+
+def enqueue_job(app, user_id: int, job_type: str, params: Dict, dedupe_key: Optional[str] = None,
+                priority: int = 0) -> Tuple[AIJob, bool]:
+    """Guarda el trabajo en la base de datos y lo envía al pool de hilos.
+
+    Si se indica ``dedupe_key`` y ya hay una generación idéntica en curso (en
+    este o en otro worker), se devuelve ese trabajo en lugar de crear otro.
+    La exclusión se apoya en la clave primaria de ai_generation_leases.
+    ``priority`` ordena la cola del pool (menor se ejecuta antes).
+    Devuelve el trabajo y si se ha creado en esta llamada.
+    """
+    global _pending_jobs
+
+    if job_type not in _job_handlers:
+        raise ValueError(f"Tipo de trabajo desconocido: {job_type}")
+
+    if dedupe_key:
+        existing = find_inflight_job(dedupe_key)
+        if existing is not None:
+            return existing, False
+
+    with _executor_lock:
+        if _pending_jobs >= app.config.get('AI_JOB_QUEUE_SIZE', 32):
+            raise JobQueueFull()
+        _pending_jobs += 1
+
+    try:
+        job = AIJob(user_id=user_id, job_type=job_type)
+        job.set_params(params)
+        db.session.add(job)
+
+        if dedupe_key:
+            db.session.flush()
+            timeout = _job_timeout(app, job_type)
+            db.session.add(GenerationLease(
+                lease_key=dedupe_key,
+                job_id=job.id,
+                expires_at=datetime.utcnow() + timeout
+            ))
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otro worker reservó la misma generación entre la consulta y el insert
+            db.session.rollback()
+            existing = find_inflight_job(dedupe_key) if dedupe_key else None
+            if existing is None:
+                raise
+            with _executor_lock:
+                _pending_jobs -= 1
+            return existing, False
+
+        _get_executor(app).submit(priority, _run_job, app, job.id)
+    except Exception:
+        with _executor_lock:
+            _pending_jobs -= 1
+        raise
+
+    return job, True
+
+
+def _run_job(app, job_id: str):
+    """Ejecuta un trabajo en un hilo del pool"""
+    global _pending_jobs
+
+    with app.app_context():
+        try:
+            job = db.session.get(AIJob, job_id)
+            if not job or job.is_finished:
+                return
+
+            job.status = 'running'
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+
+            plan = _job_handlers[job.job_type](job)
+
+            job.status = 'completed'
+            job.result_plan_id = plan.id if plan is not None else None
+            job.finished_at = datetime.utcnow()
+
+            # Mantener la reserva un poco más para que los reintentos del
+            # cliente reciban este mismo plan
+            grace = timedelta(seconds=app.config.get('AI_JOB_DEDUPE_GRACE_SECONDS', 30))
+            GenerationLease.query.filter_by(job_id=job.id)\
+                .update({'expires_at': job.finished_at + grace}, synchronize_session=False)
+            db.session.commit()
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error ejecutando trabajo {job_id}: {e}")
+            _mark_failed(job_id, 'Error generando el plan')
+        finally:
+            db.session.remove()
+            with _executor_lock:
+                _pending_jobs -= 1
+
+
+def _mark_failed(job_id: str, error: str):
+    job = db.session.get(AIJob, job_id)
+    if job:
+        job.status = 'failed'
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        GenerationLease.query.filter_by(job_id=job_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def job_queue_stats() -> Dict[str, int]:
+    """Trabajos pendientes en este proceso (en cola o ejecutándose)"""
+    with _executor_lock:
+        return {
+            'pending': _pending_jobs,
+            'queued': _executor.queue_depth if _executor is not None else 0
+        }
+
+
+def expire_stale_job(app, job: AIJob) -> AIJob:
+    """Marca como fallido un trabajo abandonado (p. ej. si el worker se reinició)"""
+    if job.is_finished or not job.created_at:
+        return job
+
+    if datetime.utcnow() - job.created_at > _job_timeout(app, job.job_type):
+        job.status = 'failed'
+        job.error = 'Tiempo de generación agotado'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    return job
@@ -0,0 +1,176 @@
+"""Benchmarks de almacenamiento y de analíticas.
+
+Los de almacenamiento se ejecutan contra la base de datos configurada,
+dentro de una transacción que se deshace al terminar: los datos sintéticos
+nunca llegan a confirmarse. Los tiempos incluyen el flush (las sentencias
+SQL) pero no el commit. El de analíticas trabaja en memoria.
+"""
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Sequence
+
+from app import db
+from models.user import ProgressEntry, User, WorkoutPlan
+from utils.progress_analytics import METRICS, ProgressSeries
+
+
+def synthetic_workout_plan(weeks: int = 8, workouts_per_week: int = 4, exercises: int = 6) -> Dict:
+    """Plan con la forma del esquema detallado (calentamiento, principales y vuelta a la calma)"""
+    def exercise(name, i):
+        return {'name': f'{name} {i}', 'sets': 3, 'reps': '8-10', 'rest_seconds': 90,
+                'instructions': 'Controla la bajada y mantén la espalda neutra', 'muscle_groups': ['pecho', 'tríceps']}
+
+    return {
+        'name': 'Plan de benchmark',
+        'description': 'Plan sintético',
+        'difficulty': 'intermediate',
+        'weeks': [{
+            'week': week + 1,
+            'focus': 'Fuerza',
+            'workouts': [{
+                'day': day,
+                'name': f'Sesión {day}',
+                'duration_minutes': 45,
+                'warm_up': [{'exercise': 'Movilidad articular', 'duration': '5 minutos'}],
+                'main_exercises': [exercise('Press', i) for i in range(exercises)],
+                'cool_down': [{'exercise': 'Estiramientos', 'duration': '5 minutos'}]
+            } for day in ('Lunes', 'Martes', 'Jueves', 'Viernes', 'Sábado', 'Domingo', 'Miércoles')[:workouts_per_week]]
+        } for week in range(weeks)],
+        'safety_notes': ['Calienta antes de cada sesión']
+    }
+
+
+def _timed(func: Callable, repeat: int) -> Dict:
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(samples), 3)
+    }
+
+
+def benchmark_plan_storage(repeat: int = 50, weeks: int = 8, workouts_per_week: int = 4,
+                           exercises: int = 6) -> Dict:
+    """Compara blob y normalized en escritura, lectura y marcado de una sesión"""
+    plan_data = synthetic_workout_plan(weeks, workouts_per_week, exercises)
+    results = {'repeat': repeat, 'weeks': weeks, 'workouts_per_week': workouts_per_week,
+               'exercises_per_workout': exercises}
+
+    try:
+        user = User(email='benchmark@glowup.invalid', name='benchmark', password_hash='-')
+        db.session.add(user)
+        db.session.flush()
+
+        for storage in ('blob', 'normalized'):
+            plans: List[WorkoutPlan] = []
+
+            def write(i):
+                plan = WorkoutPlan(user_id=user.id, name='benchmark', storage=storage)
+                plan.set_plan_data(plan_data)
+                db.session.add(plan)
+                db.session.flush()
+                plans.append(plan)
+
+            def read(i):
+                plan = plans[i]
+                db.session.expire(plan)
+                plan.get_plan_data()
+
+            def mark(i):
+                plans[i].mark_workout(i % weeks, i % workouts_per_week, True)
+                db.session.flush()
+
+            results[storage] = {'write': _timed(write, repeat), 'read': _timed(read, repeat),
+                                'mark_workout': _timed(mark, repeat)}
+    finally:
+        db.session.rollback()
+
+    return results
+
+
+def synthetic_progress_rows(entries: int, seed: int = 0) -> List[tuple]:
+    """Filas (fecha, *métricas) de un historial diario con huecos y medidas que faltan"""
+    rng = random.Random(seed)
+    day, rows = date.today() - timedelta(days=int(entries * 1.3)), []
+    for i in range(entries):
+        day += timedelta(days=rng.choice((1, 1, 1, 2)))
+        weight = 90 - i * 0.01 + rng.gauss(0, 0.5)
+        values = [weight, 25 + rng.gauss(0, 1), 35 + rng.gauss(0, 1)] + [80 + rng.gauss(0, 2) for _ in METRICS[3:]]
+        rows.append((day, *(value if rng.random() < 0.8 else None for value in values)))
+    return rows
+
+
+def _loop_analytics(entries: Sequence, height: float, recent_since: date) -> Dict:
+    """Referencia: los cálculos de /progress/stats recorriendo registro a registro con getattr"""
+    recent = [e for e in entries if e.date >= recent_since]
+    trends = {}
+    for metric in ('weight', 'body_fat', 'muscle_mass'):
+        values = [getattr(e, metric) for e in recent if getattr(e, metric) is not None]
+        if len(values) >= 2:
+            trends[metric] = (values[-1] - values[0]) / (len(values) - 1)
+    summary = {}
+    for metric in METRICS:
+        values = [getattr(e, metric) for e in entries if getattr(e, metric) is not None]
+        if values:
+            summary[metric] = (statistics.mean(values), statistics.median(values), min(values), max(values),
+                               statistics.stdev(values) if len(values) > 1 else 0)
+    bmi = [(e.date.isoformat(), round(e.weight / (height / 100) ** 2, 1)) for e in entries if e.weight]
+    return {'trends': trends, 'summary': summary, 'bmi': bmi}
+
+
+def _engine_analytics(series: ProgressSeries, height: float, recent_since: date) -> Dict:
+    return {'trends': series.since(recent_since).summary(), 'summary': series.summary(), 'bmi': series.bmi(height)}
+
+
+def benchmark_progress_analytics(sizes: Sequence[int] = (1000, 10000), repeat: int = 20,
+                                 height: float = 175) -> Dict:
+    """Compara el cálculo registro a registro con ProgressSeries sobre historiales sintéticos.
+
+    ``compute`` mide solo el cálculo en memoria; ``end_to_end`` incluye la carga desde la base de
+    datos (objetos del ORM frente a una consulta de columnas).
+    """
+    results = {'repeat': repeat}
+    try:
+        for size in sizes:
+            rows = synthetic_progress_rows(size)
+            entries = [SimpleNamespace(date=row[0], **dict(zip(METRICS, row[1:]))) for row in rows]
+            recent_since = rows[-1][0] - timedelta(days=30)
+
+            user = User(email=f'benchmark-{size}@glowup.invalid', name='benchmark', password_hash='-')
+            db.session.add(user)
+            db.session.flush()
+            user_id = user.id
+            # INSERT masivo sin pasar por el ORM (ni por los agregados): todo se deshace al final
+            db.session.execute(ProgressEntry.__table__.insert(),
+                               [dict(zip(('date',) + METRICS, row), user_id=user_id) for row in rows])
+
+            def loop_end_to_end(i):
+                db.session.expunge_all()
+                loaded = ProgressEntry.query.filter_by(user_id=user_id).order_by(ProgressEntry.date).all()
+                _loop_analytics(loaded, height, recent_since)
+
+            compute = {
+                'loop': _timed(lambda i: _loop_analytics(entries, height, recent_since), repeat),
+                'numpy': _timed(lambda i: _engine_analytics(ProgressSeries.from_rows(rows), height, recent_since),
+                                repeat)
+            }
+            end_to_end = {
+                'loop': _timed(loop_end_to_end, repeat),
+                'numpy': _timed(lambda i: _engine_analytics(ProgressSeries.load(user_id), height, recent_since),
+                                repeat)
+            }
+            for timings in (compute, end_to_end):
+                timings['speedup_p50'] = round(timings['loop']['p50_ms'] / timings['numpy']['p50_ms'], 1)
+            results[str(size)] = {'compute': compute, 'end_to_end': end_to_end}
+    finally:
+        db.session.rollback()
+
+    return results
@@ -0,0 +1,97 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import openai
+
+from utils.llm_client import llm, LLMResult
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderBackoff:
+    """Pausa compartida por todos los hilos de una generación masiva.
+
+    Cuando el proveedor responde 429, ningún hilo vuelve a llamar hasta que
+    pase el tiempo indicado en ``Retry-After`` (o una espera exponencial con
+    jitter si no lo indica). Así la concurrencia no multiplica los rechazos.
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limited = 0
+        self._consecutive = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Espera a que termine la pausa vigente, si la hay"""
+        while True:
+            with self._lock:
+                delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def penalize(self, retry_after: Optional[float] = None) -> float:
+        """Registra un 429 y amplía la pausa compartida"""
+        with self._lock:
+            self.rate_limited += 1
+            self._consecutive += 1
+            if retry_after is None:
+                retry_after = min(self.max_delay, self.base_delay * 2 ** (self._consecutive - 1))
+                retry_after *= random.uniform(0.5, 1.0)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            return retry_after
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+
+
+def _retry_after(error: openai.RateLimitError) -> Optional[float]:
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def complete_with_backoff(use_case: str, messages: List[Dict], backoff: ProviderBackoff,
+                          max_attempts: int = 5, **overrides) -> LLMResult:
+    """Llamada al LLM que reintenta los 429 respetando la pausa compartida"""
+    for attempt in range(1, max_attempts + 1):
+        backoff.wait()
+        try:
+            # Sin reintentos internos del SDK: los 429 los gestiona ``backoff``
+            result = llm.complete(use_case, messages, max_retries=0, **overrides)
+        except openai.RateLimitError as e:
+            if attempt == max_attempts:
+                raise
+            delay = backoff.penalize(_retry_after(e))
+            logger.warning(f"LLM {use_case}: 429 del proveedor, pausa de {delay:.1f}s (intento {attempt})")
+            continue
+        backoff.success()
+        return result
+
+
+def fan_out(func: Callable, items: Dict, max_workers: int) -> Iterator[Tuple[object, object, Optional[Exception]]]:
+    """Ejecuta ``func(valor)`` para cada elemento con concurrencia acotada.
+
+    Devuelve ``(clave, resultado, error)`` a medida que termina cada llamada,
+    de modo que el llamante puede ir guardando resultados por lotes.
+    """
+    if not items:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-bulk') as pool:
+        futures = {pool.submit(func, value): key for key, value in items.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                yield key, future.result(), None
+            except Exception as e:
+                yield key, None, e
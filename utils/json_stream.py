@@ -0,0 +1,95 @@
+import json
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalArrayParser:
+    """Parser JSON incremental que extrae los elementos de un array a medida que se cierran.
+
+    Se alimenta con los fragmentos de una respuesta en streaming y devuelve
+    cada objeto de ``<clave>`` (p. ej. ``weeks``) del objeto raíz en cuanto
+    llega su llave de cierre, sin esperar al resto del documento. El texto
+    previo al objeto raíz (p. ej. un bloque ```json) se ignora.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.text = ''
+        self._pos = 0
+        self._stack: List[str] = []
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._current_key = None
+        self._in_target = False
+        self._element_start = None
+        self.items: List[Dict] = []
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Procesa un fragmento y devuelve los elementos completados en él"""
+        self.text += chunk
+        completed = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            char = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if not self._started:
+                if char == '{':
+                    self._started = True
+                    self._stack.append('{')
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ':' and len(self._stack) == 1:
+                self._current_key = self._last_string
+            elif char in '{[':
+                self._stack.append(char)
+                depth = len(self._stack)
+                if char == '[' and depth == 2 and self._current_key == self.key:
+                    self._in_target = True
+                elif char == '{' and depth == 3 and self._in_target:
+                    self._element_start = i
+            elif char in '}]':
+                depth = len(self._stack)
+                if char == '}' and depth == 3 and self._in_target and self._element_start is not None:
+                    item = self._parse_element(text[self._element_start:i + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._element_start = None
+                elif char == ']' and depth == 2 and self._in_target:
+                    self._in_target = False
+                if self._stack:
+                    self._stack.pop()
+
+        self._pos = len(text)
+        self.items.extend(completed)
+        return completed
+
+    def _parse_element(self, raw: str):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Elemento de '{self.key}' descartado, JSON inválido: {e}")
+            return None
+
+    @property
+    def complete(self) -> bool:
+        """Indica si el objeto raíz se ha cerrado"""
+        return self._started and not self._stack
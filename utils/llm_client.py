@@ -0,0 +1,433 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+
+from utils.metrics import metrics
+from utils.resilience import Bulkhead, CircuitBreaker, LatencyTracker, LLMUnavailable
+from utils.scheduler import PriorityScheduler
+
+logger = logging.getLogger(__name__)
+
+# Parámetros por caso de uso (se pueden sobrescribir con LLM_<CASO>_MODEL,
+# LLM_<CASO>_MAX_TOKENS y LLM_<CASO>_TEMPERATURE)
+DEFAULT_USE_CASES = {
+    'workout_plan': {'model': 'gpt-3.5-turbo', 'max_tokens': 2000, 'temperature': 0.7},
+    'nutrition_plan': {'model': 'gpt-3.5-turbo', 'max_tokens': 2000, 'temperature': 0.7},
+    'chat': {'model': 'gpt-3.5-turbo', 'max_tokens': 500, 'temperature': 0.7},
+    'workout_plan_detailed': {'model': 'gpt-3.5-turbo', 'max_tokens': 3000, 'temperature': 0.7},
+    'nutrition_plan_detailed': {'model': 'gpt-3.5-turbo', 'max_tokens': 3000, 'temperature': 0.7},
+    'advice': {'model': 'gpt-3.5-turbo', 'max_tokens': 300, 'temperature': 0.7},
+}
+
+# Llamadas simultáneas por caso de uso y espera máxima por una plaza
+# (LLM_<CASO>_MAX_CONCURRENCY). Las interactivas no esperan: así un
+# proveedor lento no ocupa todos los hilos de gunicorn.
+DEFAULT_BULKHEADS = {
+    'workout_plan': {'max_concurrency': 8, 'queue_timeout': 30.0},
+    'nutrition_plan': {'max_concurrency': 8, 'queue_timeout': 30.0},
+    'chat': {'max_concurrency': 4, 'queue_timeout': 0.0},
+    'workout_plan_detailed': {'max_concurrency': 4, 'queue_timeout': 30.0},
+    'nutrition_plan_detailed': {'max_concurrency': 4, 'queue_timeout': 30.0},
+    'advice': {'max_concurrency': 4, 'queue_timeout': 0.0},
+}
+
+# Precio en dólares por 1K tokens (prompt, respuesta); se amplía con LLM_PRICES.
+# Se aplica el del prefijo más largo que coincida con el modelo
+DEFAULT_PRICES = {
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4': (0.03, 0.06),
+}
+
+# Errores que indican que el proveedor está caído o degradado
+PROVIDER_ERRORS = (openai.APIConnectionError, openai.InternalServerError, httpx.TransportError)
+
+
+class LLMNotConfigured(ValueError):
+    """No hay API key ni URL base configuradas para el proveedor"""
+
+
+@dataclass
+class LLMResult:
+    """Respuesta completa de una llamada al modelo"""
+    content: str
+    model: str
+    latency_ms: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    retries: int = 0
+    ttfb_ms: Optional[float] = None
+
+    @property
+    def total_tokens(self) -> int:
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
+
+
+class LLMStream:
+    """Iterador de tokens de una respuesta en streaming"""
+
+    def __init__(self, upstream, model: str, started: float, on_finish: Optional[Callable] = None,
+                 prompt_tokens: Optional[int] = None, retries: int = 0):
+        self._upstream = upstream
+        self._on_finish = on_finish
+        self.model = model
+        self.started = started
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # El proveedor no informa del uso en streaming: prompt estimado y un token por fragmento
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self.retries = retries
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self._upstream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if not token:
+                    continue
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self.completion_tokens += 1
+                yield token
+        except Exception as e:
+            self._finish(e)
+            raise
+        self.finished_at = time.monotonic()
+        self._finish(None)
+
+    def _finish(self, error: Optional[Exception]):
+        """Notifica el final del stream una sola vez (libera la plaza del bulkhead)"""
+        if self._on_finish is not None:
+            on_finish, self._on_finish = self._on_finish, None
+            on_finish(self, error)
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return round((self.first_token_at - self.started) * 1000, 1)
+
+    @property
+    def total_ms(self) -> float:
+        end = self.finished_at or time.monotonic()
+        return round((end - self.started) * 1000, 1)
+
+    @property
+    def total_tokens(self) -> int:
+        return (self.prompt_tokens or 0) + self.completion_tokens
+
+    def close(self):
+        """Cierra la conexión con el proveedor (p. ej. si el cliente se desconectó)"""
+        try:
+            self._upstream.response.close()
+        finally:
+            self._finish(None)
+
+
+class LLMClient:
+    """Cliente del proveedor de LLM con un pool de conexiones por proceso.
+
+    Se inicializa como el resto de extensiones (``llm.init_app(app)``). El
+    cliente HTTP se crea de forma perezosa y se recrea si el proceso cambia
+    (p. ej. tras el fork de gunicorn), de modo que cada worker mantiene sus
+    propias conexiones keep-alive y no repite el handshake TLS en cada llamada.
+    """
+
+    def __init__(self, app=None):
+        self.config: Dict = {}
+        self.use_cases: Dict[str, Dict] = {k: dict(v) for k, v in DEFAULT_USE_CASES.items()}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.bulkheads: Dict[str, Bulkhead] = {}
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.scheduler = PriorityScheduler()
+        self.prices: Dict[str, tuple] = dict(DEFAULT_PRICES)
+        self._attempts = threading.local()
+        self._client: Optional[openai.OpenAI] = None
+        self._client_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = {
+            'api_key': app.config.get('OPENAI_API_KEY'),
+            'base_url': app.config.get('LLM_BASE_URL'),
+            'connect_timeout': app.config.get('LLM_CONNECT_TIMEOUT', 5.0),
+            'read_timeout': app.config.get('LLM_READ_TIMEOUT', 60.0),
+            'max_connections': app.config.get('LLM_MAX_CONNECTIONS', 20),
+            'max_retries': app.config.get('LLM_MAX_RETRIES', 2),
+        }
+
+        self.prices = dict(DEFAULT_PRICES, **app.config.get('LLM_PRICES', {}))
+        self.scheduler = PriorityScheduler(app.config.get('LLM_SCHEDULER_CONCURRENCY', 8))
+        self.scheduler_wait = app.config.get('LLM_SCHEDULER_INTERACTIVE_WAIT', 5.0)
+
+        default_model = app.config.get('LLM_MODEL')
+        for name, params in self.use_cases.items():
+            prefix = f'LLM_{name.upper()}_'
+            if default_model:
+                params['model'] = default_model
+            if os.getenv(prefix + 'MODEL'):
+                params['model'] = os.getenv(prefix + 'MODEL')
+            if os.getenv(prefix + 'MAX_TOKENS'):
+                params['max_tokens'] = int(os.getenv(prefix + 'MAX_TOKENS'))
+            if os.getenv(prefix + 'TEMPERATURE'):
+                params['temperature'] = float(os.getenv(prefix + 'TEMPERATURE'))
+
+            bulkhead = DEFAULT_BULKHEADS.get(name, {'max_concurrency': 4, 'queue_timeout': 0.0})
+            self.bulkheads[name] = Bulkhead(
+                name,
+                int(os.getenv(prefix + 'MAX_CONCURRENCY', bulkhead['max_concurrency'])),
+                bulkhead['queue_timeout']
+            )
+            self.breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=app.config.get('LLM_BREAKER_FAILURE_THRESHOLD', 5),
+                reset_timeout=app.config.get('LLM_BREAKER_RESET_SECONDS', 30)
+            )
+            # Llamadas completas: latencia total; streaming: tiempo hasta el primer token
+            for key in (name, f'{name}:stream'):
+                self.latencies[key] = LatencyTracker(
+                    window=app.config.get('LLM_LATENCY_WINDOW', 200),
+                    min_samples=app.config.get('LLM_LATENCY_MIN_SAMPLES', 20),
+                    multiplier=app.config.get('LLM_TIMEOUT_P99_MULTIPLIER', 1.5),
+                    min_timeout=app.config.get('LLM_MIN_TIMEOUT', 5.0),
+                    max_timeout=self.config['read_timeout']
+                )
+
+        self._client = None
+        app.extensions['llm'] = self
+
+    @property
+    def client(self) -> openai.OpenAI:
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._lock:
+                if self._client is None or self._client_pid != pid:
+                    self._client = self._create_client()
+                    self._client_pid = pid
+        return self._client
+
+    def _create_client(self) -> openai.OpenAI:
+        api_key = self.config.get('api_key')
+        base_url = self.config.get('base_url')
+        if not api_key and not base_url:
+            raise LLMNotConfigured("OpenAI API key not configured")
+
+        timeout = httpx.Timeout(self.config['read_timeout'], connect=self.config['connect_timeout'])
+        http_client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=self.config['max_connections'],
+                max_keepalive_connections=self.config['max_connections'],
+                keepalive_expiry=300
+            ),
+            event_hooks={'request': [self._on_request], 'response': [self._on_response]}
+        )
+
+        return openai.OpenAI(
+            # Los sustitutos locales compatibles con OpenAI no suelen pedir key
+            api_key=api_key or 'not-needed',
+            base_url=base_url or None,
+            timeout=timeout,
+            max_retries=self.config['max_retries'],
+            http_client=http_client
+        )
+
+    def _on_request(self, request):
+        self._attempts.count = getattr(self._attempts, 'count', 0) + 1
+
+    def _on_response(self, response):
+        # Se llama al recibir las cabeceras, antes de leer el cuerpo
+        self._attempts.first_byte_at = time.monotonic()
+
+    def _start_attempts(self):
+        self._attempts.count = 0
+        self._attempts.first_byte_at = None
+
+    def _retries(self) -> int:
+        return max(0, getattr(self._attempts, 'count', 0) - 1)
+
+    def cost(self, model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> float:
+        """Coste estimado en dólares de una llamada"""
+        matches = [name for name in self.prices if model.startswith(name)]
+        if not matches:
+            return 0.0
+        prompt_price, completion_price = self.prices[max(matches, key=len)]
+        return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1000
+
+    def _record(self, use_case: str, model: str, outcome: str, latency: Optional[float] = None,
+                ttfb: Optional[float] = None, prompt_tokens: Optional[int] = None,
+                completion_tokens: Optional[int] = None, retries: int = 0):
+        """Registra la telemetría de una llamada al proveedor"""
+        labels = {'use_case': use_case, 'model': model}
+        metrics.inc('ai_llm_requests_total', dict(labels, outcome=outcome))
+        metrics.inc('ai_llm_retries_total', labels, retries)
+        if latency is not None:
+            metrics.observe('ai_llm_latency_seconds', latency, labels)
+        if ttfb is not None:
+            metrics.observe('ai_llm_ttfb_seconds', ttfb, labels)
+        if prompt_tokens or completion_tokens:
+            metrics.inc('ai_llm_tokens_total', dict(labels, type='prompt'), prompt_tokens or 0)
+            metrics.inc('ai_llm_tokens_total', dict(labels, type='completion'), completion_tokens or 0)
+            metrics.inc('ai_llm_cost_usd_total', labels, self.cost(model, prompt_tokens, completion_tokens))
+
+    def params_for(self, use_case: str, **overrides) -> Dict:
+        params = dict(self.use_cases[use_case])
+        params.update({k: v for k, v in overrides.items() if v is not None})
+        return params
+
+    def _acquire(self, use_case: str, tier: Optional[str]):
+        """Comprueba el circuito, espera turno en el planificador y reserva plaza en el bulkhead.
+
+        La cola del planificador va antes que el bulkhead para que las llamadas
+        en espera no ocupen plazas que podría usar un nivel de más prioridad.
+        """
+        breaker = self.breakers[use_case]
+        bulkhead = self.bulkheads[use_case]
+        breaker.before_call()
+        try:
+            # Las llamadas en segundo plano esperan lo mismo que en el bulkhead;
+            # las interactivas, como mucho LLM_SCHEDULER_INTERACTIVE_WAIT
+            self.scheduler.acquire(tier, bulkhead.queue_timeout or self.scheduler_wait)
+        except Exception:
+            breaker.release_probe()
+            raise
+        try:
+            bulkhead.acquire()
+        except Exception:
+            self.scheduler.release(tier)
+            breaker.release_probe()
+            raise
+
+    def _release(self, use_case: str, tier: Optional[str], error: Optional[Exception]):
+        """Libera las plazas y actualiza el circuito según el resultado"""
+        self.scheduler.release(tier)
+        self.bulkheads[use_case].release()
+        breaker = self.breakers[use_case]
+        if error is None:
+            breaker.record_success()
+        elif isinstance(error, PROVIDER_ERRORS):
+            breaker.record_failure()
+            if breaker.state != CircuitBreaker.CLOSED:
+                logger.warning(f"LLM {use_case}: circuito abierto tras {breaker.consecutive_failures} fallos")
+        else:
+            breaker.release_probe()
+
+    def _timeout(self, key: str) -> httpx.Timeout:
+        return httpx.Timeout(self.latencies[key].timeout, connect=self.config['connect_timeout'])
+
+    def status(self) -> Dict:
+        """Estado del circuito, bulkhead y timeouts de cada caso de uso"""
+        return {
+            name: {
+                'circuit': self.breakers[name].to_dict(),
+                'bulkhead': self.bulkheads[name].to_dict(),
+                'latency': self.latencies[name].to_dict(),
+                'stream_latency': self.latencies[f'{name}:stream'].to_dict()
+            }
+            for name in self.use_cases
+        }
+
+    def complete(self, use_case: str, messages: List[Dict], max_retries: Optional[int] = None,
+                 tier: Optional[str] = None, **overrides) -> LLMResult:
+        """Ejecuta una llamada de chat completa y mide su latencia.
+
+        ``tier`` es el nivel de suscripción del usuario y fija la prioridad en la cola.
+        """
+        params = self.params_for(use_case, **overrides)
+        client = self.client if max_retries is None else self.client.with_options(max_retries=max_retries)
+
+        try:
+            self._acquire(use_case, tier)
+        except LLMUnavailable:
+            self._record(use_case, params['model'], 'rejected')
+            raise
+        started = time.monotonic()
+        self._start_attempts()
+        error = None
+        try:
+            response = client.chat.completions.create(messages=messages, timeout=self._timeout(use_case), **params)
+        except Exception as e:
+            error = e
+            self._record(use_case, params['model'], 'error', time.monotonic() - started, retries=self._retries())
+            raise
+        finally:
+            self._release(use_case, tier, error)
+
+        latency = time.monotonic() - started
+        self.latencies[use_case].record(latency)
+        first_byte_at = self._attempts.first_byte_at
+        usage = response.usage
+        result = LLMResult(
+            content=(response.choices[0].message.content or '').strip(),
+            model=response.model or params['model'],
+            latency_ms=round(latency * 1000, 1),
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+            retries=self._retries(),
+            ttfb_ms=round((first_byte_at - started) * 1000, 1) if first_byte_at else None
+        )
+        self._record(use_case, params['model'], 'ok', latency,
+                     first_byte_at - started if first_byte_at else None,
+                     result.prompt_tokens, result.completion_tokens, result.retries)
+        logger.info(f"LLM {use_case} ({params['model']}): {result.latency_ms}ms, "
+                    f"{result.total_tokens} tokens, {result.retries} reintentos")
+
+        return result
+
+    def stream(self, use_case: str, messages: List[Dict], tier: Optional[str] = None, **overrides) -> LLMStream:
+        """Abre una llamada de chat en streaming"""
+        from utils.prompts import estimate_tokens
+
+        params = self.params_for(use_case, **overrides)
+        client = self.client
+        model = params['model']
+
+        try:
+            self._acquire(use_case, tier)
+        except LLMUnavailable:
+            self._record(use_case, model, 'rejected')
+            raise
+        started = time.monotonic()
+        self._start_attempts()
+        try:
+            upstream = client.chat.completions.create(
+                messages=messages, stream=True, timeout=self._timeout(f'{use_case}:stream'), **params
+            )
+        except Exception as e:
+            self._record(use_case, model, 'error', time.monotonic() - started, retries=self._retries())
+            self._release(use_case, tier, e)
+            raise
+        prompt_tokens = sum(estimate_tokens(m.get('content') or '') + 4 for m in messages)
+
+        def on_finish(stream: LLMStream, error: Optional[Exception]):
+            outcome = 'error' if error is not None else 'ok' if stream.finished_at is not None else 'cancelled'
+            ttft = stream.first_token_at - stream.started if stream.first_token_at is not None else None
+            self._record(use_case, model, outcome, time.monotonic() - stream.started, ttft,
+                         stream.prompt_tokens, stream.completion_tokens, stream.retries)
+            if stream.first_token_at is not None:
+                self.latencies[f'{use_case}:stream'].record(stream.first_token_at - stream.started)
+            elif error is None and stream.finished_at is None:
+                # Cerrado antes del primer token (p. ej. el cliente se desconectó):
+                # no dice nada sobre el estado del proveedor
+                self.scheduler.release(tier)
+                self.bulkheads[use_case].release()
+                self.breakers[use_case].release_probe()
+                return
+            self._release(use_case, tier, error)
+
+        return LLMStream(upstream, model, started, on_finish=on_finish,
+                         prompt_tokens=prompt_tokens, retries=self._retries())
+
+
+llm = LLMClient()
@@ -0,0 +1,170 @@
+"""Métricas de IA en formato Prometheus compartidas entre workers.
+
+Cada worker acumula en memoria los incrementos de contadores e histogramas
+y los vuelca cada METRICS_FLUSH_SECONDS en la tabla ai_metrics sumándolos
+con un UPDATE atómico, de modo que el endpoint de métricas de cualquier
+worker devuelve los totales de todos. Cada serie se guarda con su nombre
+Prometheus completo (``nombre{etiquetas}``) como clave primaria.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (en segundos) de los buckets de latencia
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, math.inf)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+
+def _series_key(sample: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return sample
+    inner = ','.join(f'{k}="{str(v)}"' for k, v in sorted(labels.items(), key=lambda kv: (kv[0] == 'le', kv[0])))
+    return f'{sample}{{{inner}}}'
+
+
+class MetricsRegistry:
+    """Registro de contadores e histogramas con volcado periódico a la base de datos"""
+
+    def __init__(self, app=None):
+        self._families: Dict[str, Tuple[str, str]] = {}
+        self._pending: Dict[str, float] = defaultdict(float)
+        self._series: Dict[str, Tuple[str, str, Dict]] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['metrics'] = self
+        interval = app.config.get('METRICS_FLUSH_SECONDS', 10)
+        if interval > 0 and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name='ai-metrics', daemon=True)
+            self._flusher.start()
+
+    def describe(self, name: str, kind: str, help_text: str):
+        """Declara una familia (counter o histogram) con su texto de ayuda"""
+        self._families[name] = (kind, help_text)
+
+    def _add(self, family: str, sample: str, labels: Dict, value: float):
+        key = _series_key(sample, labels)
+        with self._lock:
+            self._pending[key] += value
+            if key not in self._series:
+                self._series[key] = (family, sample, labels)
+
+    def inc(self, name: str, labels: Optional[Dict] = None, value: float = 1):
+        if value:
+            self._add(name, name, dict(labels or {}), value)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict] = None,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """Registra una observación en un histograma (buckets acumulados)"""
+        labels = dict(labels or {})
+        for bound in buckets:
+            # Los buckets vacíos también se registran: Prometheus espera la serie completa
+            self._add(name, f'{name}_bucket', dict(labels, le=_format_value(bound)), 1 if value <= bound else 0)
+        self._add(name, f'{name}_sum', labels, value)
+        self._add(name, f'{name}_count', labels, 1)
+
+    def flush(self):
+        """Suma los incrementos pendientes de este worker a la tabla compartida"""
+        from sqlalchemy.exc import IntegrityError
+        from app import db
+        from models.ai import AIMetric
+
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            series = {key: self._series[key] for key in pending}
+        if not pending:
+            return
+
+        flushed = set()
+        try:
+            for key, delta in pending.items():
+                family, sample, labels = series[key]
+                increment = {'value': AIMetric.value + delta}
+                if not AIMetric.query.filter_by(series_key=key).update(increment, synchronize_session=False):
+                    db.session.add(AIMetric(series_key=key, family=family, sample=sample,
+                                            labels=json.dumps(labels), value=delta))
+                    try:
+                        db.session.commit()
+                    except IntegrityError:
+                        # Otro worker creó la serie entretanto
+                        db.session.rollback()
+                        AIMetric.query.filter_by(series_key=key).update(increment, synchronize_session=False)
+                db.session.commit()
+                flushed.add(key)
+        except Exception:
+            db.session.rollback()
+            # Conservar los incrementos no volcados para el siguiente intento
+            with self._lock:
+                for key, delta in pending.items():
+                    if key not in flushed:
+                        self._pending[key] += delta
+            raise
+
+    def _flush_loop(self, interval: float):
+        from app import db
+
+        while True:
+            time.sleep(interval)
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Error volcando métricas: {e}")
+                finally:
+                    db.session.remove()
+
+    def render(self) -> str:
+        """Texto de exposición Prometheus con los totales de todos los workers"""
+        from models.ai import AIMetric
+
+        self.flush()
+        rows = AIMetric.query.all()
+
+        by_family: Dict[str, List] = defaultdict(list)
+        for row in rows:
+            by_family[row.family].append(row)
+
+        lines = []
+        for family in sorted(by_family):
+            kind, help_text = self._families.get(family, ('untyped', family))
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+
+            def order(row):
+                labels = json.loads(row.labels or '{}')
+                le = labels.pop('le', None)
+                bound = math.inf if le == '+Inf' else float(le) if le is not None else -1
+                return sorted(labels.items()), row.sample, bound
+
+            for row in sorted(by_family[family], key=order):
+                lines.append(f'{row.series_key} {_format_value(float(row.value))}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+metrics.describe('ai_llm_requests_total', 'counter', 'Llamadas al LLM por caso de uso, modelo y resultado')
+metrics.describe('ai_llm_retries_total', 'counter', 'Reintentos internos del cliente del proveedor')
+metrics.describe('ai_llm_tokens_total', 'counter', 'Tokens de prompt y de respuesta (estimados en streaming)')
+metrics.describe('ai_llm_cost_usd_total', 'counter', 'Coste estimado en dólares según LLM_PRICES')
+metrics.describe('ai_llm_latency_seconds', 'histogram', 'Latencia total de las llamadas al LLM')
+metrics.describe('ai_llm_ttfb_seconds', 'histogram', 'Tiempo hasta el primer byte (primer token en streaming)')
+metrics.describe('ai_plan_parse_total', 'counter', 'Resultado de reparar y validar el JSON de los planes')
+metrics.describe('ai_plan_fallback_total', 'counter', 'Planes o secciones completados sin el LLM o con una petición parcial')
+metrics.describe('ai_errors_total', 'counter', 'Errores en las operaciones de IA')
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app import db
+from models.ai import PlanCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Contadores del proceso actual (aciertos, fallos y desalojos)
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+_stats_lock = threading.Lock()
+
+AGE_BUCKETS = [(18, 'under_18'), (30, '18_29'), (40, '30_39'), (50, '40_49'), (60, '50_59')]
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def age_bucket(age: Optional[int]) -> str:
+    """Agrupa la edad en rangos para que perfiles parecidos compartan caché"""
+    if not age:
+        return 'unknown'
+    for limit, label in AGE_BUCKETS:
+        if age < limit:
+            return label
+    return '60_plus'
+
+
+def _normalize_list(values) -> List[str]:
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = [values]
+    return sorted({str(v).strip().lower() for v in values if str(v).strip()})
+
+
+def make_workout_cache_key(params: Dict, age: Optional[int], gender: Optional[str], prompt_version: str) -> str:
+    """Calcula la clave de caché a partir de los parámetros normalizados"""
+    canonical = {
+        'type': 'workout',
+        'prompt_version': prompt_version,
+        'fitness_goal': str(params.get('fitness_goal') or '').strip().lower(),
+        'activity_level': str(params.get('activity_level') or '').strip().lower(),
+        'duration_weeks': int(params.get('duration_weeks') or 0),
+        'workouts_per_week': int(params.get('workouts_per_week') or 0),
+        'equipment_available': _normalize_list(params.get('equipment_available')),
+        'focus_areas': _normalize_list(params.get('focus_areas')),
+        'age_bucket': age_bucket(age),
+        'gender': (gender or 'unknown').strip().lower()
+    }
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_plan(cache_key: str) -> Optional[Dict]:
+    """Devuelve una copia del plan en caché o None si no existe o expiró"""
+    entry = db.session.get(PlanCacheEntry, cache_key)
+    now = datetime.utcnow()
+
+    if entry is None:
+        _count('misses')
+        return None
+
+    if entry.expires_at <= now:
+        db.session.delete(entry)
+        db.session.commit()
+        _count('expired')
+        _count('misses')
+        return None
+
+    entry.hit_count = (entry.hit_count or 0) + 1
+    entry.last_accessed_at = now
+    plan_data = entry.get_plan_data()
+    db.session.commit()
+
+    _count('hits')
+    return plan_data
+
+
+def store_plan(app, cache_key: str, plan_type: str, plan_data: Dict):
+    """Guarda un plan en la caché y desaloja las entradas menos usadas si se supera el límite"""
+    now = datetime.utcnow()
+    ttl = timedelta(seconds=app.config.get('PLAN_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+    entry = db.session.get(PlanCacheEntry, cache_key)
+    if entry is None:
+        entry = PlanCacheEntry(cache_key=cache_key, plan_type=plan_type, hit_count=0)
+        db.session.add(entry)
+
+    entry.set_plan_data(plan_data)
+    entry.created_at = now
+    entry.last_accessed_at = now
+    entry.expires_at = now + ttl
+    db.session.commit()
+
+    _evict(app.config.get('PLAN_CACHE_MAX_ENTRIES', 1000))
+
+
+def _evict(max_entries: int):
+    """Elimina las entradas expiradas y, si sobra, las de acceso más antiguo (LRU)"""
+    now = datetime.utcnow()
+    expired = PlanCacheEntry.query.filter(PlanCacheEntry.expires_at <= now).delete(synchronize_session=False)
+
+    excess = PlanCacheEntry.query.count() - max_entries
+    evicted = 0
+    if excess > 0:
+        oldest = db.session.query(PlanCacheEntry.cache_key)\
+            .order_by(PlanCacheEntry.last_accessed_at)\
+            .limit(excess)\
+            .subquery()
+        evicted = PlanCacheEntry.query.filter(PlanCacheEntry.cache_key.in_(db.select(oldest.c.cache_key)))\
+            .delete(synchronize_session=False)
+
+    db.session.commit()
+
+    if expired:
+        _count('expired', expired)
+    if evicted:
+        _count('evictions', evicted)
+        logger.info(f"Caché de planes: {evicted} entradas desalojadas")
+
+
+def cache_stats() -> Dict:
+    """Estadísticas de la caché: contadores del proceso y tamaño actual"""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+    stats['entries'] = PlanCacheEntry.query.count()
+    return stats
@@ -0,0 +1,363 @@
+"""Motor local de planes de entrenamiento basado en reglas.
+
+Construye en milisegundos un plan completo con la misma estructura JSON que
+produce el LLM, combinando una biblioteca de ejercicios indexada (por equipo,
+grupo muscular y dificultad), plantillas de división según los
+entrenamientos por semana y reglas de progresión según el nivel.
+"""
+from collections import defaultdict
+from typing import Dict, Set
+
+LEVELS = ['beginner', 'intermediate', 'advanced']
+
+# Niveles de actividad genéricos equivalentes a un nivel de entrenamiento
+LEVEL_ALIASES = {
+    'sedentary': 'beginner',
+    'light': 'beginner',
+    'moderate': 'intermediate',
+    'active': 'intermediate',
+    'very_active': 'advanced'
+}
+
+# Nombres alternativos del equipo que envían los clientes
+EQUIPMENT_ALIASES = {
+    'peso corporal': 'bodyweight',
+    'mancuernas': 'dumbbells',
+    'barra': 'barbell',
+    'pesas rusas': 'kettlebell',
+    'bandas': 'resistance_bands',
+    'bandas elásticas': 'resistance_bands',
+    'máquinas': 'machines',
+    'gimnasio': 'gym',
+    'barra de dominadas': 'pull_up_bar',
+    'banco': 'bench'
+}
+
+# 'gym' equivale a disponer de todo el equipo
+GYM_EQUIPMENT = {'bodyweight', 'dumbbells', 'barbell', 'kettlebell', 'resistance_bands', 'machines', 'pull_up_bar', 'bench'}
+
+EXERCISE_LIBRARY = [
+    # Pecho
+    {'name': 'Flexiones', 'equipment': {'bodyweight'}, 'muscles': ['pecho', 'tríceps'], 'difficulty': 'beginner',
+     'instructions': 'Cuerpo alineado, baja el pecho hasta casi tocar el suelo. Apoya rodillas si es necesario'},
+    {'name': 'Flexiones declinadas', 'equipment': {'bodyweight', 'bench'}, 'muscles': ['pecho', 'hombros'], 'difficulty': 'intermediate',
+     'instructions': 'Pies elevados sobre el banco, mantén el core firme'},
+    {'name': 'Press de pecho con mancuernas', 'equipment': {'dumbbells', 'bench'}, 'muscles': ['pecho', 'tríceps'], 'difficulty': 'beginner',
+     'instructions': 'Controla el movimiento, baja lentamente'},
+    {'name': 'Press de banca', 'equipment': {'barbell', 'bench'}, 'muscles': ['pecho', 'tríceps'], 'difficulty': 'intermediate',
+     'instructions': 'Escápulas retraídas, baja la barra a la parte media del pecho'},
+    {'name': 'Aperturas con mancuernas', 'equipment': {'dumbbells', 'bench'}, 'muscles': ['pecho'], 'difficulty': 'intermediate',
+     'instructions': 'Codos ligeramente flexionados, abre hasta sentir estiramiento'},
+    {'name': 'Press de pecho en máquina', 'equipment': {'machines'}, 'muscles': ['pecho'], 'difficulty': 'beginner',
+     'instructions': 'Ajusta el asiento a la altura del pecho y empuja sin bloquear codos'},
+    {'name': 'Fondos en paralelas', 'equipment': {'pull_up_bar'}, 'muscles': ['pecho', 'tríceps'], 'difficulty': 'advanced',
+     'instructions': 'Inclina el torso hacia delante y baja hasta 90 grados de codo'},
+    {'name': 'Press de pecho con banda', 'equipment': {'resistance_bands'}, 'muscles': ['pecho'], 'difficulty': 'beginner',
+     'instructions': 'Ancla la banda a la espalda y empuja al frente'},
+    # Espalda
+    {'name': 'Remo invertido', 'equipment': {'bodyweight'}, 'muscles': ['espalda', 'bíceps'], 'difficulty': 'beginner',
+     'instructions': 'Usa una mesa firme o barra baja, lleva el pecho hacia ella'},
+    {'name': 'Superman', 'equipment': {'bodyweight'}, 'muscles': ['espalda', 'core'], 'difficulty': 'beginner',
+     'instructions': 'Boca abajo, eleva brazos y piernas manteniendo 2 segundos'},
+    {'name': 'Remo con mancuerna a una mano', 'equipment': {'dumbbells'}, 'muscles': ['espalda', 'bíceps'], 'difficulty': 'beginner',
+     'instructions': 'Espalda neutra, lleva el codo hacia la cadera'},
+    {'name': 'Remo con barra', 'equipment': {'barbell'}, 'muscles': ['espalda', 'bíceps'], 'difficulty': 'intermediate',
+     'instructions': 'Torso inclinado a 45 grados, lleva la barra al abdomen'},
+    {'name': 'Dominadas', 'equipment': {'pull_up_bar'}, 'muscles': ['espalda', 'bíceps'], 'difficulty': 'advanced',
+     'instructions': 'Agarre prono, sube hasta pasar la barbilla sobre la barra'},
+    {'name': 'Dominadas asistidas con banda', 'equipment': {'pull_up_bar', 'resistance_bands'}, 'muscles': ['espalda', 'bíceps'], 'difficulty': 'intermediate',
+     'instructions': 'Coloca la banda bajo las rodillas para reducir la carga'},
+    {'name': 'Jalón al pecho', 'equipment': {'machines'}, 'muscles': ['espalda', 'bíceps'], 'difficulty': 'beginner',
+     'instructions': 'Lleva la barra a la parte alta del pecho sin balancearte'},
+    {'name': 'Remo con banda', 'equipment': {'resistance_bands'}, 'muscles': ['espalda'], 'difficulty': 'beginner',
+     'instructions': 'Tira hacia el abdomen juntando las escápulas'},
+    {'name': 'Swing con pesa rusa', 'equipment': {'kettlebell'}, 'muscles': ['espalda', 'glúteos', 'isquiotibiales'], 'difficulty': 'intermediate',
+     'instructions': 'El impulso sale de la cadera, no de los brazos'},
+    # Hombros
+    {'name': 'Flexiones en pica', 'equipment': {'bodyweight'}, 'muscles': ['hombros', 'tríceps'], 'difficulty': 'intermediate',
+     'instructions': 'Cadera elevada formando una V invertida, baja la cabeza entre las manos'},
+    {'name': 'Press militar con mancuernas', 'equipment': {'dumbbells'}, 'muscles': ['hombros', 'tríceps'], 'difficulty': 'beginner',
+     'instructions': 'Empuja por encima de la cabeza sin arquear la zona lumbar'},
+    {'name': 'Elevaciones laterales', 'equipment': {'dumbbells'}, 'muscles': ['hombros'], 'difficulty': 'beginner',
+     'instructions': 'Eleva hasta la altura de los hombros con codos ligeramente flexionados'},
+    {'name': 'Press militar con barra', 'equipment': {'barbell'}, 'muscles': ['hombros', 'tríceps'], 'difficulty': 'advanced',
+     'instructions': 'Glúteos y core activos, la barra sube en línea recta'},
+    {'name': 'Elevaciones laterales con banda', 'equipment': {'resistance_bands'}, 'muscles': ['hombros'], 'difficulty': 'beginner',
+     'instructions': 'Pisa la banda y eleva los brazos de forma controlada'},
+    {'name': 'Press de hombros en máquina', 'equipment': {'machines'}, 'muscles': ['hombros'], 'difficulty': 'beginner',
+     'instructions': 'Espalda apoyada, empuja sin bloquear los codos'},
+    # Brazos
+    {'name': 'Curl de bíceps con mancuernas', 'equipment': {'dumbbells'}, 'muscles': ['bíceps'], 'difficulty': 'beginner',
+     'instructions': 'Codos pegados al cuerpo, sin balanceo'},
+    {'name': 'Curl con barra', 'equipment': {'barbell'}, 'muscles': ['bíceps'], 'difficulty': 'intermediate',
+     'instructions': 'Mantén los codos fijos y baja en 3 segundos'},
+    {'name': 'Curl con banda', 'equipment': {'resistance_bands'}, 'muscles': ['bíceps'], 'difficulty': 'beginner',
+     'instructions': 'Pisa la banda y flexiona los codos'},
+    {'name': 'Fondos en banco', 'equipment': {'bodyweight', 'bench'}, 'muscles': ['tríceps'], 'difficulty': 'beginner',
+     'instructions': 'Manos en el borde del banco, baja flexionando los codos hacia atrás'},
+    {'name': 'Extensión de tríceps con mancuerna', 'equipment': {'dumbbells'}, 'muscles': ['tríceps'], 'difficulty': 'beginner',
+     'instructions': 'Codos apuntando al techo, extiende por completo'},
+    {'name': 'Flexiones diamante', 'equipment': {'bodyweight'}, 'muscles': ['tríceps', 'pecho'], 'difficulty': 'intermediate',
+     'instructions': 'Manos juntas bajo el pecho formando un diamante'},
+    {'name': 'Extensión de tríceps con banda', 'equipment': {'resistance_bands'}, 'muscles': ['tríceps'], 'difficulty': 'beginner',
+     'instructions': 'Ancla la banda arriba y extiende los codos hacia abajo'},
+    # Piernas
+    {'name': 'Sentadillas', 'equipment': {'bodyweight'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'beginner',
+     'instructions': 'Mantén la espalda recta y las rodillas alineadas con los pies'},
+    {'name': 'Zancadas', 'equipment': {'bodyweight'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'beginner',
+     'instructions': 'Paso largo, la rodilla trasera casi toca el suelo'},
+    {'name': 'Sentadilla búlgara', 'equipment': {'bodyweight', 'bench'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'intermediate',
+     'instructions': 'Pie trasero sobre el banco, baja en vertical'},
+    {'name': 'Sentadilla con salto', 'equipment': {'bodyweight'}, 'muscles': ['cuádriceps', 'cardio'], 'difficulty': 'intermediate',
+     'instructions': 'Aterriza suave flexionando rodillas y caderas'},
+    {'name': 'Sentadilla goblet', 'equipment': {'dumbbells'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'beginner',
+     'instructions': 'Sujeta la mancuerna pegada al pecho, codos entre las rodillas'},
+    {'name': 'Sentadilla con barra', 'equipment': {'barbell'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'intermediate',
+     'instructions': 'Barra sobre los trapecios, baja hasta paralelo con el torso firme'},
+    {'name': 'Prensa de piernas', 'equipment': {'machines'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'beginner',
+     'instructions': 'No bloquees las rodillas al extender'},
+    {'name': 'Sentadilla con pesa rusa', 'equipment': {'kettlebell'}, 'muscles': ['cuádriceps', 'glúteos'], 'difficulty': 'beginner',
+     'instructions': 'Sujeta la pesa por los cuernos a la altura del pecho'},
+    {'name': 'Puente de glúteos', 'equipment': {'bodyweight'}, 'muscles': ['glúteos', 'isquiotibiales'], 'difficulty': 'beginner',
+     'instructions': 'Eleva la cadera apretando glúteos, mantén 1 segundo arriba'},
+    {'name': 'Hip thrust con barra', 'equipment': {'barbell', 'bench'}, 'muscles': ['glúteos', 'isquiotibiales'], 'difficulty': 'intermediate',
+     'instructions': 'Espalda alta apoyada en el banco, extiende la cadera por completo'},
+    {'name': 'Peso muerto rumano con mancuernas', 'equipment': {'dumbbells'}, 'muscles': ['isquiotibiales', 'glúteos'], 'difficulty': 'beginner',
+     'instructions': 'Cadera hacia atrás, mancuernas pegadas a las piernas'},
+    {'name': 'Peso muerto', 'equipment': {'barbell'}, 'muscles': ['isquiotibiales', 'glúteos', 'espalda'], 'difficulty': 'advanced',
+     'instructions': 'Espalda neutra, empuja el suelo con las piernas'},
+    {'name': 'Curl femoral en máquina', 'equipment': {'machines'}, 'muscles': ['isquiotibiales'], 'difficulty': 'beginner',
+     'instructions': 'Movimiento controlado en ambas fases'},
+    {'name': 'Buenos días con banda', 'equipment': {'resistance_bands'}, 'muscles': ['isquiotibiales'], 'difficulty': 'beginner',
+     'instructions': 'Banda bajo los pies y sobre los hombros, flexiona la cadera'},
+    {'name': 'Patada de glúteo con banda', 'equipment': {'resistance_bands'}, 'muscles': ['glúteos'], 'difficulty': 'beginner',
+     'instructions': 'En cuadrupedia, extiende la pierna hacia atrás'},
+    {'name': 'Elevación de talones', 'equipment': {'bodyweight'}, 'muscles': ['pantorrillas'], 'difficulty': 'beginner',
+     'instructions': 'Sube sobre la punta de los pies y baja lentamente'},
+    {'name': 'Elevación de talones con mancuernas', 'equipment': {'dumbbells'}, 'muscles': ['pantorrillas'], 'difficulty': 'beginner',
+     'instructions': 'Pausa de 1 segundo arriba'},
+    # Core
+    {'name': 'Plancha', 'equipment': {'bodyweight'}, 'muscles': ['core'], 'difficulty': 'beginner', 'timed': True,
+     'instructions': 'Cuerpo alineado de cabeza a talones, sin hundir la cadera'},
+    {'name': 'Plancha lateral', 'equipment': {'bodyweight'}, 'muscles': ['core'], 'difficulty': 'beginner', 'timed': True,
+     'instructions': 'Apoya el antebrazo y eleva la cadera'},
+    {'name': 'Dead bug', 'equipment': {'bodyweight'}, 'muscles': ['core'], 'difficulty': 'beginner',
+     'instructions': 'Zona lumbar pegada al suelo mientras extiendes brazo y pierna contrarios'},
+    {'name': 'Elevaciones de piernas colgado', 'equipment': {'pull_up_bar'}, 'muscles': ['core'], 'difficulty': 'advanced',
+     'instructions': 'Sube las piernas sin balanceo'},
+    {'name': 'Dragon flag', 'equipment': {'bench'}, 'muscles': ['core'], 'difficulty': 'advanced',
+     'instructions': 'Sujétate al banco y baja el cuerpo recto de forma controlada'},
+    {'name': 'Russian twist con pesa rusa', 'equipment': {'kettlebell'}, 'muscles': ['core'], 'difficulty': 'intermediate',
+     'instructions': 'Gira el torso desde el core, no solo los brazos'},
+    # Cardio
+    {'name': 'Jumping jacks', 'equipment': {'bodyweight'}, 'muscles': ['cardio'], 'difficulty': 'beginner', 'timed': True,
+     'instructions': 'Ritmo constante, aterriza suave'},
+    {'name': 'Mountain climbers', 'equipment': {'bodyweight'}, 'muscles': ['cardio', 'core'], 'difficulty': 'beginner', 'timed': True,
+     'instructions': 'Lleva las rodillas al pecho alternando rápido'},
+    {'name': 'Burpees', 'equipment': {'bodyweight'}, 'muscles': ['cardio'], 'difficulty': 'intermediate', 'timed': True,
+     'instructions': 'Flexión, salto y palmada arriba'},
+    {'name': 'Swing rápido con pesa rusa', 'equipment': {'kettlebell'}, 'muscles': ['cardio'], 'difficulty': 'intermediate', 'timed': True,
+     'instructions': 'Ritmo alto manteniendo la técnica'},
+]
+
+# Plantillas de sesión: grupos musculares en orden de ejecución
+SESSION_TEMPLATES = {
+    'full_body': ('Cuerpo completo', ['cuádriceps', 'pecho', 'espalda', 'isquiotibiales', 'hombros', 'core']),
+    'upper': ('Tren superior', ['pecho', 'espalda', 'hombros', 'espalda', 'bíceps', 'tríceps']),
+    'lower': ('Tren inferior', ['cuádriceps', 'isquiotibiales', 'glúteos', 'cuádriceps', 'pantorrillas', 'core']),
+    'push': ('Empuje', ['pecho', 'hombros', 'pecho', 'hombros', 'tríceps']),
+    'pull': ('Tirón', ['espalda', 'espalda', 'bíceps', 'espalda', 'core']),
+    'legs': ('Piernas', ['cuádriceps', 'isquiotibiales', 'glúteos', 'cuádriceps', 'pantorrillas'])
+}
+
+# División semanal según el número de entrenamientos
+SPLITS = {
+    1: ['full_body'],
+    2: ['full_body', 'full_body'],
+    3: ['full_body', 'full_body', 'full_body'],
+    4: ['upper', 'lower', 'upper', 'lower'],
+    5: ['push', 'pull', 'legs', 'upper', 'lower'],
+    6: ['push', 'pull', 'legs', 'push', 'pull', 'legs']
+}
+
+TRAINING_DAYS = {
+    1: ['Lunes'],
+    2: ['Lunes', 'Jueves'],
+    3: ['Lunes', 'Miércoles', 'Viernes'],
+    4: ['Lunes', 'Martes', 'Jueves', 'Viernes'],
+    5: ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes'],
+    6: ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado']
+}
+
+# Límites de los parámetros de generación (las rutas validan con los mismos)
+MAX_DURATION_WEEKS = 52
+MAX_WORKOUTS_PER_WEEK = max(TRAINING_DAYS)
+
+# Reglas de progresión por nivel
+PROGRESSION = {
+    'beginner': {'base_sets': 2, 'max_sets': 3, 'reps': '12-15', 'rest_seconds': 60, 'deload_every': None},
+    'intermediate': {'base_sets': 3, 'max_sets': 4, 'reps': '8-12', 'rest_seconds': 90, 'deload_every': 4},
+    'advanced': {'base_sets': 4, 'max_sets': 5, 'reps': '6-10', 'rest_seconds': 120, 'deload_every': 4}
+}
+
+# Ajustes según el objetivo
+GOAL_ADJUSTMENTS = {
+    'strength': {'reps': '4-6', 'rest_factor': 1.5, 'cardio': False},
+    'muscle_gain': {'reps': '8-12', 'rest_factor': 1.0, 'cardio': False},
+    'endurance': {'reps': '15-20', 'rest_factor': 0.5, 'cardio': True},
+    'weight_loss': {'reps': None, 'rest_factor': 0.75, 'cardio': True}
+}
+
+# Índices de la biblioteca (posiciones en EXERCISE_LIBRARY)
+_BY_EQUIPMENT: Dict[str, Set[int]] = defaultdict(set)
+_BY_MUSCLE: Dict[str, Set[int]] = defaultdict(set)
+_BY_DIFFICULTY: Dict[str, Set[int]] = defaultdict(set)
+
+for _i, _exercise in enumerate(EXERCISE_LIBRARY):
+    for _item in _exercise['equipment']:
+        _BY_EQUIPMENT[_item].add(_i)
+    for _muscle in _exercise['muscles']:
+        _BY_MUSCLE[_muscle].add(_i)
+    _BY_DIFFICULTY[_exercise['difficulty']].add(_i)
+
+
+def normalize_level(level: str) -> str:
+    level = (level or 'beginner').strip().lower()
+    level = LEVEL_ALIASES.get(level, level)
+    return level if level in PROGRESSION else 'beginner'
+
+
+def normalize_equipment(equipment) -> Set[str]:
+    if isinstance(equipment, str):
+        equipment = [equipment]
+    items = set()
+    for item in equipment or []:
+        key = str(item).strip().lower()
+        key = EQUIPMENT_ALIASES.get(key, key)
+        if key == 'gym':
+            items |= GYM_EQUIPMENT
+        else:
+            items.add(key)
+    # El peso corporal siempre está disponible
+    items.add('bodyweight')
+    return items
+
+
+def _available_exercises(equipment: Set[str], level: str) -> Set[int]:
+    """Ejercicios cuyo equipo está completo y cuya dificultad no supera el nivel"""
+    allowed_levels = LEVELS[:LEVELS.index(level) + 1]
+    by_level = set().union(*(_BY_DIFFICULTY[lvl] for lvl in allowed_levels))
+    candidates = set().union(*(_BY_EQUIPMENT[item] for item in equipment))
+    return {i for i in candidates & by_level if EXERCISE_LIBRARY[i]['equipment'] <= equipment}
+
+
+def _week_prescription(week: int, level: str, goal: str) -> Dict:
+    rules = PROGRESSION[level]
+    adjust = GOAL_ADJUSTMENTS.get(goal, {})
+
+    deload = bool(rules['deload_every']) and week % rules['deload_every'] == 0
+    # +1 serie cada dos semanas hasta el máximo del nivel
+    sets = min(rules['base_sets'] + (week - 1) // 2, rules['max_sets'])
+    if deload:
+        sets = max(rules['base_sets'] - 1, 1)
+
+    return {
+        'sets': sets,
+        'reps': adjust.get('reps') or rules['reps'],
+        'rest_seconds': int(rules['rest_seconds'] * adjust.get('rest_factor', 1.0)),
+        'deload': deload
+    }
+
+
+def _week_focus(week: int, total_weeks: int, deload: bool) -> str:
+    if deload:
+        return 'Descarga y recuperación'
+    if week == 1:
+        return 'Adaptación y técnica'
+    if week == total_weeks:
+        return 'Consolidación'
+    return 'Progresión de volumen'
+
+
+def build_workout_plan(params: Dict, exercises_key: str = 'exercises') -> Dict:
+    """Genera un plan completo a partir de los parámetros de generación"""
+    goal = (params.get('fitness_goal') or 'general_fitness').strip().lower()
+    level = normalize_level(params.get('activity_level'))
+    duration_weeks = max(1, min(int(params.get('duration_weeks') or 4), MAX_DURATION_WEEKS))
+    workouts_per_week = max(1, min(int(params.get('workouts_per_week') or 3), MAX_WORKOUTS_PER_WEEK))
+    equipment = normalize_equipment(params.get('equipment_available'))
+    focus_areas = [str(area).strip().lower() for area in params.get('focus_areas') or []]
+
+    available = _available_exercises(equipment, level)
+    include_cardio = GOAL_ADJUSTMENTS.get(goal, {}).get('cardio', False)
+
+    weeks = []
+    for week in range(1, duration_weeks + 1):
+        prescription = _week_prescription(week, level, goal)
+        # Los ejercicios rotan cada dos semanas para poder progresar en cada uno
+        rotation = (week - 1) // 2
+        workouts = []
+
+        for session_index, (day, split) in enumerate(zip(TRAINING_DAYS[workouts_per_week], SPLITS[workouts_per_week])):
+            session_name, muscles = SESSION_TEMPLATES[split]
+            muscles = list(muscles)
+            muscles += [area for area in focus_areas if area in _BY_MUSCLE and area not in muscles]
+            if include_cardio:
+                muscles.append('cardio')
+
+            used = set()
+            session_exercises = []
+            for slot, muscle in enumerate(muscles):
+                candidates = sorted((_BY_MUSCLE[muscle] & available) - used)
+                if not candidates:
+                    continue
+                choice = candidates[(rotation + session_index + slot) % len(candidates)]
+                used.add(choice)
+                exercise = EXERCISE_LIBRARY[choice]
+
+                session_exercises.append({
+                    'name': exercise['name'],
+                    'sets': prescription['sets'],
+                    'reps': '30-45 segundos' if exercise.get('timed') else prescription['reps'],
+                    'rest_seconds': prescription['rest_seconds'],
+                    'instructions': exercise['instructions'],
+                    'muscle_groups': exercise['muscles'],
+                    'difficulty': exercise['difficulty']
+                })
+
+            # ~40 s por serie más descansos, y 10 minutos de calentamiento y vuelta a la calma
+            work_seconds = sum(e['sets'] * (40 + e['rest_seconds']) for e in session_exercises)
+            duration_minutes = int(round((work_seconds / 60 + 10) / 5) * 5)
+
+            workouts.append({
+                'day': day,
+                'name': f'{session_name} - Semana {week}',
+                'duration_minutes': duration_minutes,
+                'warm_up': [{
+                    'exercise': 'Movilidad articular y cardio suave',
+                    'duration': '5 minutos',
+                    'instructions': 'Círculos de brazos, rotaciones de cadera y marcha en el sitio'
+                }],
+                exercises_key: session_exercises,
+                'cool_down': [{
+                    'exercise': 'Estiramientos de los grupos trabajados',
+                    'duration': '5 minutos',
+                    'instructions': 'Mantén cada estiramiento 30 segundos sin rebotes'
+                }]
+            })
+
+        weeks.append({
+            'week': week,
+            'focus': _week_focus(week, duration_weeks, prescription['deload']),
+            'workouts': workouts
+        })
+
+    return {
+        'name': f"Plan de {goal.replace('_', ' ').title()} - {level.title()}",
+        'description': f"Plan de {duration_weeks} semanas con {workouts_per_week} entrenamientos por semana para {goal.replace('_', ' ')}",
+        'difficulty': level,
+        'weeks': weeks,
+        'nutrition_tips': ['Mantente hidratado', 'Come proteína después del entrenamiento'],
+        'safety_notes': ['Calienta antes de entrenar', 'Escucha a tu cuerpo', 'Detente si sientes dolor agudo'],
+        'generated_by': 'local'
+    }
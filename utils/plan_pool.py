@@ -0,0 +1,255 @@
+"""Pool de planes pregenerados para los arquetipos más pedidos.
+
+Fuera de hora punta se extraen las combinaciones de parámetros más
+frecuentes (planes recientes y perfiles de usuario), se generan variantes
+nuevas con el LLM y se guardan en plan_pool. En hora punta, una petición
+que coincide con un arquetipo recibe al instante una de esas variantes, que
+se retira del pool para que cada usuario tenga un plan distinto.
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from app import db
+from models.ai import PlanPoolEntry
+from models.user import User, WorkoutPlan
+from utils.plan_cache import make_workout_cache_key
+from utils.prompts import get_prompt
+from utils.rate_limit import consume
+from utils.resilience import LLMUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Parámetros que usa una petición sin equipo ni zonas de enfoque
+DEFAULT_EQUIPMENT = ['bodyweight']
+
+_generators: Dict[str, Callable] = {}
+_refiller: Optional[threading.Thread] = None
+_refiller_lock = threading.Lock()
+
+_stats = {'hits': 0, 'misses': 0, 'generated': 0, 'failed': 0, 'expired': 0, 'runs': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def pool_generator(plan_type: str):
+    """Registra la función que genera una variante de un arquetipo.
+
+    Recibe el arquetipo (``params``, ``age``, ``gender``) y devuelve el plan
+    o None si no se pudo generar uno completo.
+    """
+    def decorator(func):
+        _generators[plan_type] = func
+        return func
+    return decorator
+
+
+def parse_hours(spec: str) -> List[int]:
+    """Convierte '1-6' (o '23-5') en la lista de horas UTC de ese intervalo"""
+    start, _, end = str(spec).partition('-')
+    start, end = int(start) % 24, int(end or start) % 24
+    if start == end:
+        return [start]
+    return list(range(start, end)) if start < end else list(range(start, 24)) + list(range(0, end))
+
+
+def is_off_peak(app, now: Optional[datetime] = None) -> bool:
+    hour = (now or datetime.utcnow()).hour
+    return hour in parse_hours(app.config.get('PLAN_POOL_OFFPEAK_HOURS', '1-6'))
+
+
+def mine_workout_archetypes(limit: int, days: int) -> List[Dict]:
+    """Combinaciones de parámetros más frecuentes, de más a menos populares.
+
+    Cuentan los planes creados en los últimos ``days`` días (con su duración
+    y frecuencia) y los perfiles activos (con la duración y frecuencia por
+    defecto), agrupados con la misma clave que la caché de planes.
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    profile_columns = (User.fitness_goal, User.activity_level, User.age, User.gender)
+
+    plan_rows = db.session.query(*profile_columns, WorkoutPlan.duration_weeks, WorkoutPlan.workouts_per_week,
+                                 db.func.count(WorkoutPlan.id))\
+        .join(User, User.id == WorkoutPlan.user_id)\
+        .filter(WorkoutPlan.created_at >= since)\
+        .group_by(*profile_columns, WorkoutPlan.duration_weeks, WorkoutPlan.workouts_per_week)\
+        .all()
+
+    profile_rows = db.session.query(*profile_columns, db.func.count(User.id))\
+        .filter(User.is_active.is_(True))\
+        .group_by(*profile_columns)\
+        .all()
+    profile_rows = [(goal, level, age, gender, None, None, count) for goal, level, age, gender, count in profile_rows]
+
+    prompt_key = get_prompt('workout_plan').key
+    counts = Counter()
+    archetypes = {}
+    ages = {}
+
+    for goal, level, age, gender, duration_weeks, workouts_per_week, count in list(plan_rows) + profile_rows:
+        params = {
+            'fitness_goal': goal or 'general_fitness',
+            'activity_level': level or 'beginner',
+            'duration_weeks': duration_weeks or 4,
+            'workouts_per_week': workouts_per_week or 3,
+            'equipment_available': DEFAULT_EQUIPMENT,
+            'focus_areas': []
+        }
+        key = make_workout_cache_key(params, age, gender, prompt_key)
+        counts[key] += count
+        archetypes.setdefault(key, {'params': params, 'gender': gender})
+        ages.setdefault(key, Counter())[age] += count
+
+    result = []
+    for key, count in counts.most_common(limit):
+        # Edad más frecuente del rango como edad representativa para el prompt
+        archetype = dict(archetypes[key], key=key, count=count, age=ages[key].most_common(1)[0][0])
+        result.append(archetype)
+    return result
+
+
+def take_pooled_plan(archetype_key: str) -> Optional[Dict]:
+    """Retira del pool la variante más antigua del arquetipo, o None si no hay.
+
+    El borrado condicional garantiza que dos workers no entreguen la misma.
+    """
+    for _ in range(3):
+        row = db.session.execute(
+            db.select(PlanPoolEntry.id, PlanPoolEntry.plan_data)
+            .filter(PlanPoolEntry.archetype_key == archetype_key, PlanPoolEntry.expires_at > datetime.utcnow())
+            .order_by(PlanPoolEntry.created_at)
+            .limit(1)
+        ).first()
+        if row is None:
+            break
+
+        claimed = PlanPoolEntry.query.filter_by(id=row.id).delete(synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            _count('hits')
+            return json.loads(row.plan_data)
+
+    _count('misses')
+    return None
+
+
+def _ready_count(archetype_key: str) -> int:
+    return PlanPoolEntry.query\
+        .filter(PlanPoolEntry.archetype_key == archetype_key, PlanPoolEntry.expires_at > datetime.utcnow())\
+        .count()
+
+
+def refill_pool(app, force: bool = False) -> Dict:
+    """Repone las variantes de los arquetipos por debajo del umbral.
+
+    Un arquetipo se repone cuando le quedan PLAN_POOL_LOW_WATER variantes o
+    menos, hasta PLAN_POOL_TARGET_SIZE. Cada ejecución genera como mucho
+    PLAN_POOL_MAX_PER_RUN planes y se detiene al salir de la franja valle
+    (salvo ``force``) o si el LLM deja de estar disponible.
+    """
+    generator = _generators.get('workout')
+    summary = {'archetypes': 0, 'generated': 0, 'failed': 0, 'expired': 0}
+    if generator is None:
+        return summary
+
+    _count('runs')
+    expired = PlanPoolEntry.query.filter(PlanPoolEntry.expires_at <= datetime.utcnow())\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    summary['expired'] = expired
+    _count('expired', expired)
+
+    archetypes = mine_workout_archetypes(app.config.get('PLAN_POOL_ARCHETYPES', 20),
+                                         app.config.get('PLAN_POOL_MINING_DAYS', 30))
+    summary['archetypes'] = len(archetypes)
+
+    target = app.config.get('PLAN_POOL_TARGET_SIZE', 5)
+    low_water = app.config.get('PLAN_POOL_LOW_WATER', 2)
+    budget = app.config.get('PLAN_POOL_MAX_PER_RUN', 100)
+    ttl = timedelta(seconds=app.config.get('PLAN_POOL_TTL_SECONDS', 7 * 24 * 3600))
+
+    for archetype in archetypes:
+        if budget <= 0 or not (force or is_off_peak(app)):
+            break
+
+        ready = _ready_count(archetype['key'])
+        if ready > low_water:
+            continue
+
+        for _ in range(min(target - ready, budget)):
+            budget -= 1
+            try:
+                plan_data = generator(archetype)
+            except LLMUnavailable as e:
+                logger.warning(f"Pool de planes: LLM no disponible, se detiene la reposición ({e})")
+                budget = 0
+                break
+            except Exception as e:
+                logger.error(f"Pool de planes: error generando el arquetipo {archetype['key'][:12]}: {e}")
+                plan_data = None
+
+            if plan_data is None:
+                summary['failed'] += 1
+                _count('failed')
+                continue
+
+            entry = PlanPoolEntry(
+                archetype_key=archetype['key'],
+                plan_type='workout',
+                archetype=json.dumps({k: archetype[k] for k in ('params', 'age', 'gender', 'count')}),
+                expires_at=datetime.utcnow() + ttl
+            )
+            entry.set_plan_data(plan_data)
+            db.session.add(entry)
+            db.session.commit()
+            summary['generated'] += 1
+            _count('generated')
+
+    logger.info(f"Pool de planes repuesto: {summary}")
+    return summary
+
+
+def _refill_loop(app):
+    interval = app.config.get('PLAN_POOL_CHECK_SECONDS', 900)
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                # Un único token por intervalo compartido entre workers: solo uno repone
+                if is_off_peak(app) and consume('pool:refill', 1, 1 / interval)[0]:
+                    refill_pool(app)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error reponiendo el pool de planes: {e}")
+            finally:
+                db.session.remove()
+
+
+def start_pool_refiller(app):
+    """Arranca (una vez por proceso) el hilo que repone el pool en la franja valle"""
+    global _refiller
+    with _refiller_lock:
+        if _refiller is None:
+            _refiller = threading.Thread(target=_refill_loop, args=(app,), name='plan-pool', daemon=True)
+            _refiller.start()
+
+
+def pool_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+    now = datetime.utcnow()
+    stats['ready'] = PlanPoolEntry.query.filter(PlanPoolEntry.expires_at > now).count()
+    stats['archetypes_ready'] = db.session.query(db.func.count(db.distinct(PlanPoolEntry.archetype_key)))\
+        .filter(PlanPoolEntry.expires_at > now).scalar()
+    return stats
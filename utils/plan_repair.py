@@ -0,0 +1,436 @@
+"""Reparación y validación de los planes JSON que devuelve el LLM.
+
+Antes de descartar una respuesta se intenta arreglarla localmente: se quitan
+los bloques ```json, las comas finales y el texto sobrante, y si la
+respuesta llegó truncada se cierra en el último elemento completo. Después
+se valida contra el esquema declarado del plan, convirtiendo los tipos
+habituales (``"3"`` → 3 en ``sets``, 10 → ``"10"`` en ``reps``) y
+descartando solo los elementos que no se pueden aprovechar. Las secciones
+obligatorias que falten se devuelven para pedir únicamente esas al LLM.
+"""
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_FENCE_RE = re.compile(r'```(?:json|JSON)?\s*(.*?)(?:```|$)', re.DOTALL)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+_TRUE_VALUES = ('true', 'yes', 'si', 'sí')
+_FALSE_VALUES = ('false', 'no')
+
+# strict=False admite saltos de línea sin escapar dentro de los textos
+_decoder = json.JSONDecoder(strict=False)
+_INVALID = object()
+
+# Al cortar una respuesta truncada se prefiere un punto con esta profundidad
+# como máximo (objeto raíz + sus arrays): así una semana o comida a medias se
+# descarta entera en lugar de guardarse incompleta
+TRUNCATE_DEPTH = 2
+
+# Resultados de este proceso
+_stats = {'valid': 0, 'repaired': 0, 'unrepairable': 0, 'coerced_fields': 0, 'dropped_items': 0,
+          'section_reprompts': 0, 'section_reprompts_failed': 0, 'local_fills': 0}
+_stats_lock = threading.Lock()
+
+
+class Field:
+    """Campo del esquema: tipo simple, objeto (dict de campos) o lista ([tipo])"""
+
+    __slots__ = ('kind', 'required')
+
+    def __init__(self, kind, required: bool = False):
+        self.kind = kind
+        self.required = required
+
+
+EXERCISE_SCHEMA = {
+    'name': Field(str, required=True),
+    'sets': Field(int),
+    'reps': Field(str),
+    'rest_seconds': Field(int),
+    'instructions': Field(str),
+    'weight_guidance': Field(str),
+    'muscle_groups': Field([str]),
+    'difficulty': Field(str)
+}
+
+ROUTINE_STEP_SCHEMA = {
+    'exercise': Field(str, required=True),
+    'duration': Field(str),
+    'instructions': Field(str)
+}
+
+WEEK_SCHEMA = {
+    'week': Field(int),
+    'focus': Field(str),
+    'workouts': Field([{
+        'day': Field(str),
+        'name': Field(str),
+        'duration_minutes': Field(int),
+        'warm_up': Field([ROUTINE_STEP_SCHEMA]),
+        'exercises': Field([EXERCISE_SCHEMA]),
+        'main_exercises': Field([EXERCISE_SCHEMA]),
+        'cool_down': Field([ROUTINE_STEP_SCHEMA])
+    }], required=True)
+}
+
+WORKOUT_PLAN_SCHEMA = {
+    'name': Field(str),
+    'description': Field(str),
+    'difficulty': Field(str),
+    'estimated_calories_per_session': Field(int),
+    'weeks': Field([WEEK_SCHEMA], required=True),
+    'nutrition_tips': Field([str]),
+    'safety_notes': Field([str])
+}
+
+FOOD_SCHEMA = {
+    'name': Field(str, required=True),
+    'quantity': Field(str),
+    'calories': Field(int),
+    'protein': Field(float),
+    'carbs': Field(float),
+    'fats': Field(float),
+    'benefits': Field(str)
+}
+
+NUTRITION_PLAN_SCHEMA = {
+    'name': Field(str),
+    'description': Field(str),
+    'daily_structure': Field({
+        'total_calories': Field(int),
+        'macros': Field({
+            'protein_grams': Field(float),
+            'carbs_grams': Field(float),
+            'fats_grams': Field(float)
+        })
+    }),
+    'daily_meals': Field([{
+        'name': Field(str, required=True),
+        'time': Field(str),
+        'calories': Field(int),
+        'foods': Field([FOOD_SCHEMA]),
+        'alternatives': Field([str]),
+        'preparation_tips': Field(str)
+    }], required=True),
+    'weekly_variations': Field([{
+        'week': Field(int),
+        'notes': Field(str),
+        'meal_suggestions': Field([str])
+    }]),
+    'weekly_meal_prep': Field([{'day': Field(str), 'tasks': Field([str])}]),
+    'hydration_guide': Field({'daily_water_goal': Field(str), 'timing': Field([str])}),
+    'supplements_suggestions': Field([{
+        'name': Field(str, required=True),
+        'when': Field(str),
+        'reason': Field(str),
+        'optional': Field(bool)
+    }]),
+    'success_tips': Field([str])
+}
+
+
+@dataclass
+class PlanParse:
+    """Resultado de reparar y validar una respuesta"""
+    data: Optional[Dict]
+    missing: List[str] = field(default_factory=list)
+    repairs: List[str] = field(default_factory=list)
+    coerced: int = 0
+    dropped: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.data is not None and not self.missing
+
+
+def strip_fences(text: str) -> str:
+    """Devuelve el contenido del primer bloque ``` si lo hay"""
+    match = _FENCE_RE.search(text)
+    return match.group(1) if match else text
+
+
+def _strip_trailing_comma(out: List[str]) -> bool:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+        return True
+    return False
+
+
+def _closed(out: List[str], length: int, stack: Tuple[str, ...], in_string: bool = False) -> str:
+    text = ''.join(out[:length])
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(','):
+        text = text[:-1]
+    return text + ''.join(reversed(stack))
+
+
+def _decode(text: str):
+    try:
+        return _decoder.raw_decode(text)[0], None
+    except json.JSONDecodeError as e:
+        return _INVALID, e
+
+
+def repair_json(text: Optional[str]) -> Tuple[Any, List[str]]:
+    """Decodifica ``text`` arreglando los fallos típicos de un LLM.
+
+    Devuelve el valor (None si no hay nada aprovechable) y la lista de
+    reparaciones aplicadas. Una respuesta truncada se cierra en el último
+    elemento completo, así que el resultado puede estar incompleto.
+    """
+    if not text or not text.strip():
+        return None, []
+
+    repairs = []
+    body = strip_fences(text)
+    if body != text:
+        repairs.append('fences')
+
+    starts = [i for i in (body.find('{'), body.find('[')) if i >= 0]
+    if not starts:
+        return None, repairs
+    body = body[min(starts):]
+
+    try:
+        value, end = _decoder.raw_decode(body)
+        if body[end:].strip():
+            repairs.append('trailing_text')
+        return value, repairs
+    except json.JSONDecodeError:
+        pass
+
+    # Recorrido carácter a carácter: quita comas finales, corrige cierres
+    # desparejados y anota los puntos donde se puede cortar el documento
+    out: List[str] = []
+    stack: List[str] = []
+    safe_points: List[Tuple[int, Tuple[str, ...]]] = []
+    in_string = escape = False
+
+    for char in body:
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char in '{[':
+            stack.append('}' if char == '{' else ']')
+            out.append(char)
+            safe_points.append((len(out), tuple(stack)))
+            continue
+
+        if char in '}]':
+            if _strip_trailing_comma(out) and 'trailing_commas' not in repairs:
+                repairs.append('trailing_commas')
+            closer = stack.pop()
+            if closer != char and 'brackets' not in repairs:
+                repairs.append('brackets')
+            out.append(closer)
+            safe_points.append((len(out), tuple(stack)))
+            if not stack:
+                break
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char == ',':
+            safe_points.append((len(out), tuple(stack)))
+        out.append(char)
+
+    if not stack:
+        value, error = _decode(_closed(out, len(out), ()))
+        if value is not _INVALID:
+            return value, repairs
+        limit = min(error.pos, len(out))
+    else:
+        repairs.append('unbalanced')
+        if len(stack) <= TRUNCATE_DEPTH:
+            value, _ = _decode(_closed(out, len(out), tuple(stack), in_string))
+            if value is not _INVALID:
+                return value, repairs
+        limit = len(out)
+
+    # Cortar en el último punto seguro anterior al error, primero sin dejar
+    # elementos anidados a medias y, si no hay ninguno, en cualquiera
+    candidates = [point for point in reversed(safe_points) if point[0] <= limit]
+    for max_depth in (TRUNCATE_DEPTH, None):
+        for length, point_stack in candidates:
+            if max_depth is not None and len(point_stack) > max_depth:
+                continue
+            value, _ = _decode(_closed(out, length, point_stack))
+            if value is not _INVALID:
+                repairs.append('truncated')
+                return value, repairs
+
+    return None, repairs
+
+
+def _coerce(value, kind, path: str, result: PlanParse):
+    """Convierte ``value`` al tipo del esquema o devuelve _INVALID"""
+    if isinstance(kind, dict):
+        if not isinstance(value, dict):
+            return _INVALID
+        return _validate_object(value, kind, path, result)
+
+    if isinstance(kind, list):
+        if not isinstance(value, list):
+            value = [value]
+            result.coerced += 1
+        items = []
+        for index, item in enumerate(value):
+            coerced = _coerce(item, kind[0], f'{path}[{index}]', result)
+            if coerced is _INVALID:
+                result.dropped.append(f'{path}[{index}]')
+            else:
+                items.append(coerced)
+        return items
+
+    if kind is str:
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            result.coerced += 1
+            return f'{value:g}' if isinstance(value, float) else str(value)
+        if isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value):
+            result.coerced += 1
+            return ', '.join(str(v) for v in value)
+        return _INVALID
+
+    if kind in (int, float):
+        if isinstance(value, bool):
+            return _INVALID
+        if isinstance(value, int) and kind is int:
+            return value
+        if isinstance(value, (int, float)):
+            if kind is int:
+                result.coerced += 1
+                return int(round(value))
+            return float(value)
+        if isinstance(value, str):
+            match = _NUMBER_RE.search(value.replace(',', '.'))
+            if match:
+                result.coerced += 1
+                number = float(match.group())
+                return int(round(number)) if kind is int else number
+        return _INVALID
+
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in _TRUE_VALUES + _FALSE_VALUES:
+            result.coerced += 1
+            return value.strip().lower() in _TRUE_VALUES
+        return _INVALID
+
+    return value
+
+
+def _validate_object(value: Dict, schema: Dict[str, Field], path: str, result: PlanParse, root: bool = False):
+    """Valida un objeto; las claves desconocidas se conservan sin tocar"""
+    data = dict(value)
+    for key, spec in schema.items():
+        coerced = _INVALID
+        if data.get(key) is not None:
+            coerced = _coerce(data[key], spec.kind, f'{path}.{key}', result)
+            if coerced in ('', []) and spec.required:
+                coerced = _INVALID
+
+        if coerced is not _INVALID:
+            data[key] = coerced
+            continue
+
+        if key in data:
+            del data[key]
+            if not spec.required:
+                result.dropped.append(f'{path}.{key}')
+        if spec.required:
+            if not root:
+                return _INVALID
+            result.missing.append(key)
+    return data
+
+
+def validate_plan(data: Any, schema: Dict[str, Field]) -> PlanParse:
+    """Valida y convierte un plan ya decodificado"""
+    result = PlanParse(data=None)
+    if not isinstance(data, dict):
+        return result
+    result.data = _validate_object(data, schema, '$', result, root=True)
+    return result
+
+
+def parse_plan(text: Optional[str], schema: Dict[str, Field], plan_type: str) -> PlanParse:
+    """Repara, decodifica y valida la respuesta de un plan (``plan_type`` etiqueta las métricas)"""
+    value, repairs = repair_json(text)
+    # Un array suelto en la raíz no es un plan
+    result = validate_plan(value, schema) if isinstance(value, dict) else PlanParse(data=None)
+    result.repairs = repairs
+
+    outcome = 'unrepairable' if result.data is None else 'repaired' if repairs else 'valid'
+    with _stats_lock:
+        _stats[outcome] += 1
+        _stats['coerced_fields'] += result.coerced
+        _stats['dropped_items'] += len(result.dropped)
+    metrics.inc('ai_plan_parse_total', {'plan_type': plan_type, 'outcome': outcome})
+
+    if repairs or result.dropped or result.missing:
+        logger.info(f"Plan reparado ({', '.join(repairs) or 'sin cambios de sintaxis'}): "
+                    f"{result.coerced} campos convertidos, {len(result.dropped)} descartados, "
+                    f"secciones ausentes: {', '.join(result.missing) or 'ninguna'}")
+    return result
+
+
+def fill_missing_sections(result: PlanParse, fallback: Dict, plan_type: str) -> Dict:
+    """Completa las secciones obligatorias que faltan con las de un plan de respaldo"""
+    missing = [key for key in result.missing if key in fallback]
+    if missing:
+        result.data.update({key: fallback[key] for key in missing})
+        record_fallback(plan_type, 'local_fill')
+    return result.data
+
+
+# Orígenes de fallback que también se cuentan en repair_stats
+_FALLBACK_STATS = {
+    'section_reprompt': 'section_reprompts',
+    'section_reprompt_failed': 'section_reprompts_failed',
+    'local_fill': 'local_fills'
+}
+
+
+def record_fallback(plan_type: str, source: str):
+    """Anota un plan o sección que no sale de la respuesta original del LLM.
+
+    ``source``: local_engine o fallback_plan (plan completo sin LLM),
+    local_fill (secciones del motor local), section_reprompt y
+    section_reprompt_failed (petición de solo las secciones que faltaban).
+    """
+    if source in _FALLBACK_STATS:
+        with _stats_lock:
+            _stats[_FALLBACK_STATS[source]] += 1
+    metrics.inc('ai_plan_fallback_total', {'plan_type': plan_type, 'source': source})
+
+
+def repair_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+
+    # Sin reparación, cada respuesta reparada era un plan vacío y una regeneración completa
+    attempted = stats['repaired'] + stats['unrepairable']
+    stats['repair_success_rate'] = round(stats['repaired'] / attempted, 3) if attempted else None
+    stats['llm_calls_saved'] = stats['repaired']
+    return stats
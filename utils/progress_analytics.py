@@ -0,0 +1,173 @@
+"""Motor vectorizado de analíticas de progreso.
+
+La serie de un usuario se carga una vez en columnas: las fechas como
+ordinales y una matriz métricas × registros con NaN donde falta la medida.
+``summary`` calcula a la vez, para todas las métricas, recuento, media,
+mediana, extremos, desviación típica, primer y último valor, pendiente por
+mínimos cuadrados sobre las fechas reales y media exponencial (EWMA); el
+IMC se calcula sobre el vector de pesos. Los bucles de Python quedan solo
+para construir la respuesta JSON.
+"""
+import math
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app import db
+from models.user import ProgressEntry
+
+METRICS = ProgressEntry.MEASUREMENT_FIELDS
+
+# Peso de cada registro nuevo en la media exponencial
+EWMA_ALPHA = 0.3
+
+BMI_LIMITS = np.array([18.5, 25, 30])
+BMI_CATEGORIES = ('Bajo peso', 'Normal', 'Sobrepeso', 'Obesidad')
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+class ProgressSeries:
+    """Registros de un usuario en columnas, ordenados por fecha"""
+
+    def __init__(self, ordinals: np.ndarray, values: np.ndarray):
+        self.ordinals = ordinals  # int64, una por registro
+        self.values = values  # float64, len(METRICS) × registros, NaN si falta
+        self.present = ~np.isnan(values)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence]) -> 'ProgressSeries':
+        """Serie a partir de filas (fecha, *métricas en el orden de METRICS) ordenadas por fecha"""
+        ordinals = np.fromiter((row[0].toordinal() for row in rows), dtype=np.int64, count=len(rows))
+        # dtype float convierte los None en NaN
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(METRICS)).T
+        return cls(ordinals, np.ascontiguousarray(values))
+
+    @classmethod
+    def load(cls, user_id, start: Optional[date] = None, end: Optional[date] = None) -> 'ProgressSeries':
+        """Una consulta de columnas (sin objetos del ORM) con los registros del usuario entre dos fechas"""
+        query = db.select(ProgressEntry.date, *(getattr(ProgressEntry, metric) for metric in METRICS))\
+            .where(ProgressEntry.user_id == int(user_id))\
+            .order_by(ProgressEntry.date)
+        if start is not None:
+            query = query.where(ProgressEntry.date >= start)
+        if end is not None:
+            query = query.where(ProgressEntry.date <= end)
+        return cls.from_rows(db.session.execute(query).all())
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    @property
+    def first_date(self) -> date:
+        return date.fromordinal(int(self.ordinals[0]))
+
+    @property
+    def last_date(self) -> date:
+        return date.fromordinal(int(self.ordinals[-1]))
+
+    def since(self, day: date) -> 'ProgressSeries':
+        """Registros desde ``day`` (una vista, sin copiar)"""
+        start = int(np.searchsorted(self.ordinals, day.toordinal()))
+        return ProgressSeries(self.ordinals[start:], self.values[:, start:])
+
+    def row(self, metric: str) -> np.ndarray:
+        return self.values[METRICS.index(metric)]
+
+    def endpoint_change(self, metric: str) -> Optional[float]:
+        """Diferencia entre el último y el primer registro (None si a alguno le falta la medida)"""
+        series = self.row(metric)
+        if not len(series) or not series[0] or not series[-1] or np.isnan(series[[0, -1]]).any():
+            return None
+        return float(series[-1] - series[0])
+
+    def ewma(self, alpha: float = EWMA_ALPHA) -> np.ndarray:
+        """Media exponencial de cada métrica en cada registro (NaN hasta su primer valor).
+
+        Un registro sin la medida no la mueve. Es la forma ajustada (media ponderada
+        con pesos (1 - alpha)^k normalizados), que no depende de un valor inicial:
+        numerador y denominador siguen s = d·s + a y se resuelven por bloques con
+        productos y sumas acumuladas. El bloque se limita para que 1 / d^k no desborde.
+        """
+        n = len(self)
+        decay = np.where(self.present, 1 - alpha, 1.0)
+        inputs = np.stack([np.where(self.present, alpha * self.values, 0.0), np.where(self.present, alpha, 0.0)])
+        block = max(1, int(150 / -math.log10(1 - alpha))) if alpha < 1 else 1
+        result = np.empty_like(inputs)
+        state = np.zeros(inputs.shape[:2])
+
+        for start in range(0, n, block):
+            end = min(n, start + block)
+            factor = np.cumprod(decay[:, start:end], axis=1)
+            result[:, :, start:end] = factor * (state[:, :, None] + np.cumsum(inputs[:, :, start:end] / factor, axis=2))
+            state = result[:, :, end - 1]
+
+        numerator, denominator = result
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return numerator / denominator
+
+    def summary(self, alpha: float = EWMA_ALPHA) -> Dict[str, Dict]:
+        """Estadísticas de todas las métricas con al menos un valor, calculadas en bloque"""
+        if not len(self):
+            return {}
+        present, values = self.present, self.values
+        count = present.sum(axis=1)
+        has = count > 0
+        if not has.any():
+            return {}
+        present, count = present[has], count[has]
+        values = values[has]
+        filled = np.where(present, values, 0.0)
+
+        mean = filled.sum(axis=1) / count
+        deviations = np.where(present, values - mean[:, None], 0.0)
+        variance = np.divide((deviations ** 2).sum(axis=1), count - 1, out=np.zeros_like(mean), where=count > 1)
+
+        # Pendiente por mínimos cuadrados con x = días desde el primer registro
+        days = (self.ordinals - self.ordinals[0]).astype(np.float64)
+        day_mean = np.where(present, days, 0.0).sum(axis=1) / count
+        day_deviations = np.where(present, days - day_mean[:, None], 0.0)
+        spread = (day_deviations ** 2).sum(axis=1)
+        slope = np.divide((day_deviations * deviations).sum(axis=1), spread, out=np.zeros_like(mean), where=spread > 0)
+
+        first = present.argmax(axis=1)
+        last = present.shape[1] - 1 - present[:, ::-1].argmax(axis=1)
+        rows = np.arange(len(count))
+        smoothed = self.ewma(alpha)[has][rows, last]
+
+        columns = {
+            'count': count, 'mean': mean, 'median': np.nanmedian(values, axis=1),
+            'min': np.nanmin(values, axis=1), 'max': np.nanmax(values, axis=1), 'stdev': np.sqrt(variance),
+            'first': values[rows, first], 'last': values[rows, last], 'slope': slope, 'smoothed': smoothed
+        }
+        columns = {key: column.tolist() for key, column in columns.items()}
+        metrics = [metric for metric, keep in zip(METRICS, has) if keep]
+        return {metric: {key: column[i] for key, column in columns.items()} for i, metric in enumerate(metrics)}
+
+    def iso_dates(self, mask: Optional[np.ndarray] = None) -> List[str]:
+        """Fechas ISO de los registros (de los marcados en ``mask``), convertidas en bloque"""
+        ordinals = self.ordinals if mask is None else self.ordinals[mask]
+        return (ordinals - _EPOCH).astype('datetime64[D]').astype(str).tolist()
+
+    def points(self, metric: str, alpha: float = EWMA_ALPHA) -> List[Dict]:
+        """Puntos (fecha, valor, media exponencial) de los registros con la métrica"""
+        if metric not in METRICS:
+            return []
+        index = METRICS.index(metric)
+        present = self.present[index]
+        smoothed = np.round(self.ewma(alpha)[index][present], 2).tolist()
+        values = self.values[index][present].tolist()
+        return [{'date': day, 'value': value, 'smoothed': ewma}
+                for day, value, ewma in zip(self.iso_dates(present), values, smoothed)]
+
+    def bmi(self, height_cm: Optional[float]) -> List[Dict]:
+        """IMC de cada registro con peso"""
+        if not height_cm:
+            return []
+        weights = self.row('weight')
+        present = self.present[METRICS.index('weight')] & (weights != 0)
+        bmi = weights[present] / (height_cm / 100) ** 2
+        categories = [BMI_CATEGORIES[c] for c in np.digitize(bmi, BMI_LIMITS).tolist()]
+        return [{'date': day, 'bmi': value, 'category': category}
+                for day, value, category in zip(self.iso_dates(present), np.round(bmi, 1).tolist(), categories)]
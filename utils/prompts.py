@@ -0,0 +1,405 @@
+"""Registro de prompts versionados.
+
+Las plantillas se compilan una sola vez al importar el módulo: se compacta
+el espacio en blanco (sangrías, líneas vacías y esquemas JSON) y se
+precalcula su coste en tokens. Cada plantilla tiene un presupuesto de
+entrada; el de salida (max_tokens) es el del caso de uso del cliente LLM.
+"""
+import json
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from utils.llm_client import llm
+
+# Ventana de contexto del modelo por defecto (gpt-3.5-turbo)
+CONTEXT_WINDOW = 4096
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_FIELD_RE = re.compile(r"(?<!\{)\{(\w+)\}(?!\})")
+
+
+class PromptBudgetExceeded(ValueError):
+    """El prompt renderizado supera el presupuesto de tokens de entrada"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens (~4 caracteres por token en palabras, 1 por signo)"""
+    if not text:
+        return 0
+    return sum(
+        math.ceil(len(piece) / 4) if piece[0].isalnum() or piece[0] == '_' else 1
+        for piece in _TOKEN_RE.findall(text)
+    )
+
+
+def compact(text: str) -> str:
+    """Elimina sangrías, espacios repetidos y líneas vacías"""
+    lines = (' '.join(line.split()) for line in text.strip().splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def schema(example) -> str:
+    """Serializa un ejemplo de respuesta JSON sin espacios, escapado para str.format"""
+    raw = json.dumps(example, ensure_ascii=False, separators=(',', ':'))
+    return raw.replace('{', '{{').replace('}', '}}')
+
+
+@dataclass
+class RenderedPrompt:
+    messages: List[Dict]
+    input_tokens: int
+    max_tokens: int
+    template: str
+
+
+class PromptTemplate:
+    """Plantilla compilada de mensajes system + user"""
+
+    # Coste fijo aproximado por mensaje del formato chat
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(self, name: str, version: int, use_case: str, system: str, user: str,
+                 max_input_tokens: int):
+        self.name = name
+        self.version = version
+        self.use_case = use_case
+        self.system = compact(system)
+        self.user = compact(user)
+        self.max_input_tokens = max_input_tokens
+        self.fields = sorted(set(_FIELD_RE.findall(self.system + self.user)))
+
+        # Tokens de la parte fija (sin los valores a sustituir)
+        static_text = _FIELD_RE.sub('', self.system + self.user).replace('{{', '{').replace('}}', '}')
+        self.static_tokens = estimate_tokens(static_text) + 2 * self.MESSAGE_OVERHEAD
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}@{self.version}'
+
+    def render(self, max_tokens: Optional[int] = None, **values) -> RenderedPrompt:
+        """Sustituye los valores y comprueba el presupuesto de tokens.
+
+        ``max_tokens`` es la salida reservada; por defecto, la del caso de uso.
+        """
+        if max_tokens is None:
+            max_tokens = llm.params_for(self.use_case)['max_tokens']
+        values = {k: '' if v is None else v for k, v in values.items()}
+        system = self.system.format(**values)
+        user = self.user.format(**values)
+
+        input_tokens = estimate_tokens(system) + estimate_tokens(user) + 2 * self.MESSAGE_OVERHEAD
+        if input_tokens > self.max_input_tokens or input_tokens + max_tokens > CONTEXT_WINDOW:
+            raise PromptBudgetExceeded(
+                f"{self.key}: {input_tokens} tokens de entrada (máximo {self.max_input_tokens}, "
+                f"{max_tokens} reservados para la salida)"
+            )
+
+        messages = [{'role': 'system', 'content': system}, {'role': 'user', 'content': user}]
+        return RenderedPrompt(messages, input_tokens, max_tokens, self.key)
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'version': self.version,
+            'key': self.key,
+            'use_case': self.use_case,
+            'fields': self.fields,
+            'static_tokens': self.static_tokens,
+            'max_input_tokens': self.max_input_tokens
+        }
+
+
+# Fragmentos de esquema compartidos
+EXERCISE_EXAMPLE = {
+    'name': 'Nombre del ejercicio',
+    'sets': 3,
+    'reps': '8-10',
+    'rest_seconds': 90,
+    'instructions': 'Instrucciones del ejercicio'
+}
+
+FOOD_EXAMPLE = {
+    'name': 'Avena con frutas',
+    'quantity': '1 taza',
+    'calories': 250,
+    'protein': 8,
+    'carbs': 45,
+    'fats': 5
+}
+
+WEEK_EXAMPLE = {
+    'week': 1,
+    'workouts': [{
+        'day': 'Lunes',
+        'name': 'Nombre del entrenamiento',
+        'duration_minutes': 45,
+        'exercises': [EXERCISE_EXAMPLE]
+    }]
+}
+
+WORKOUT_SCHEMA = schema({
+    'name': 'Nombre del plan',
+    'description': 'Descripción del plan',
+    'difficulty': 'beginner/intermediate/advanced',
+    'weeks': [WEEK_EXAMPLE]
+})
+
+WEEKS_SCHEMA = schema({'weeks': [WEEK_EXAMPLE]})
+
+WORKOUT_DETAILED_SCHEMA = schema({
+    'name': 'Nombre atractivo del plan',
+    'description': 'Descripción motivadora del plan (2-3 líneas)',
+    'difficulty': 'beginner/intermediate/advanced',
+    'estimated_calories_per_session': 300,
+    'weeks': [{
+        'week': 1,
+        'focus': 'Adaptación y técnica',
+        'workouts': [{
+            'day': 'Lunes',
+            'name': 'Tren Superior - Fuerza',
+            'duration_minutes': 45,
+            'warm_up': [{'exercise': 'Movilidad articular', 'duration': '5 minutos', 'instructions': 'Círculos de brazos'}],
+            'main_exercises': [dict(EXERCISE_EXAMPLE, weight_guidance='Peso moderado',
+                                    muscle_groups=['pecho', 'tríceps'], difficulty='intermediate')],
+            'cool_down': [{'exercise': 'Estiramiento de pecho', 'duration': '30 segundos', 'instructions': 'Sin rebotes'}]
+        }]
+    }],
+    'nutrition_tips': ['Consejo'],
+    'safety_notes': ['Nota de seguridad']
+})
+
+NUTRITION_EXAMPLE = {
+    'name': 'Nombre del plan',
+    'description': 'Descripción del plan',
+    'daily_meals': [{'name': 'Desayuno', 'time': '08:00', 'calories': 400, 'foods': [FOOD_EXAMPLE]}],
+    'weekly_variations': [{'week': 1, 'notes': 'Semana de adaptación', 'meal_suggestions': ['Sugerencia']}]
+}
+
+NUTRITION_SCHEMA = schema(NUTRITION_EXAMPLE)
+
+NUTRITION_DETAILED_SCHEMA = schema({
+    'name': 'Nombre atractivo del plan nutricional',
+    'description': 'Descripción motivadora (2-3 líneas)',
+    'daily_structure': {'total_calories': 2000, 'macros': {'protein_grams': 150, 'carbs_grams': 200, 'fats_grams': 67}},
+    'daily_meals': [{
+        'name': 'Desayuno',
+        'time': '07:30',
+        'calories': 400,
+        'foods': [dict(FOOD_EXAMPLE, benefits='Rica en fibra')],
+        'alternatives': ['Yogur griego con granola'],
+        'preparation_tips': 'Consejo de preparación'
+    }],
+    'weekly_meal_prep': [{'day': 'Domingo', 'tasks': ['Cocinar proteínas para la semana']}],
+    'hydration_guide': {'daily_water_goal': '2.5-3 litros', 'timing': ['1 vaso al despertar']},
+    'supplements_suggestions': [{'name': 'Proteína en polvo', 'when': 'Post-entrenamiento', 'reason': 'Motivo', 'optional': True}],
+    'success_tips': ['Consejo']
+})
+
+USER_CONTEXT = """
+Usuario: {name}
+Objetivo: {fitness_goal}
+Nivel: {activity_level}
+Edad: {age}
+Peso: {weight} kg
+Altura: {height} cm
+"""
+
+PROMPTS: Dict[str, PromptTemplate] = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    PROMPTS[template.name] = template
+    return template
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    return PROMPTS[name]
+
+
+def render_prompt(prompt_name: str, /, max_tokens: Optional[int] = None, **values) -> RenderedPrompt:
+    return PROMPTS[prompt_name].render(max_tokens, **values)
+
+
+def nutrition_sections_schema(sections: List[str]) -> str:
+    """Formato JSON de solo las secciones pedidas del plan nutricional"""
+    example = {key: NUTRITION_EXAMPLE[key] for key in sections if key in NUTRITION_EXAMPLE}
+    return json.dumps(example, ensure_ascii=False, separators=(',', ':'))
+
+
+def slice_schema(key: str, example: Dict) -> str:
+    """Formato JSON de un único elemento de una lista del plan (``{key: [example]}``)"""
+    return json.dumps({key: [example]}, ensure_ascii=False, separators=(',', ':'))
+
+
+def profile_values(user: Dict) -> Dict:
+    """Valores del perfil del usuario con texto por defecto para los que faltan"""
+    return {
+        'name': user.get('name') or 'Usuario',
+        'age': user.get('age') or 'No especificada',
+        'gender': user.get('gender') or 'No especificado',
+        'weight': user.get('weight') or 'No especificado',
+        'height': user.get('height') or 'No especificada',
+        'fitness_goal': user.get('fitness_goal') or 'No especificado',
+        'activity_level': user.get('activity_level') or 'No especificado',
+        'dietary_restrictions': user.get('dietary_restrictions') or 'Ninguna'
+    }
+
+
+register(PromptTemplate(
+    name='workout_plan',
+    version=2,
+    use_case='workout_plan',
+    system="Eres un entrenador personal experto que crea planes de entrenamiento personalizados. Responde solo con JSON válido.",
+    user=f"""
+        Crea un plan de entrenamiento personalizado:
+        Usuario: objetivo {{fitness_goal}}; nivel {{activity_level}}; edad {{age}}; género {{gender}}
+        Plan: {{duration_weeks}} semanas; {{workouts_per_week}} entrenamientos por semana; equipo: {{equipment}}; enfoque: {{focus_areas}}
+        Responde con este formato JSON:
+        {WORKOUT_SCHEMA}
+        Asegúrate de que el plan sea progresivo, seguro y apropiado para el nivel del usuario.
+    """,
+    max_input_tokens=600
+))
+
+register(PromptTemplate(
+    name='workout_plan_weeks',
+    version=1,
+    use_case='workout_plan',
+    system="Eres un entrenador personal experto que completa planes de entrenamiento personalizados. Responde solo con JSON válido.",
+    user=f"""
+        Genera SOLO las semanas {{weeks}} de un plan de entrenamiento de {{duration_weeks}} semanas que ya tiene el resto:
+        Usuario: objetivo {{fitness_goal}}; nivel {{activity_level}}; edad {{age}}; género {{gender}}
+        Plan: {{workouts_per_week}} entrenamientos por semana; equipo: {{equipment}}; enfoque: {{focus_areas}}
+        Responde con este formato JSON:
+        {WEEKS_SCHEMA}
+        Mantén la progresión de las semanas anteriores y siguientes.
+    """,
+    max_input_tokens=600
+))
+
+register(PromptTemplate(
+    name='workout_plan_slice',
+    version=1,
+    use_case='workout_plan',
+    system="Eres un entrenador personal experto que ajusta planes de entrenamiento existentes. Responde solo con JSON válido.",
+    user="""
+        Rehaz SOLO {target} de un plan de entrenamiento; el resto del plan no cambia:
+        Usuario: objetivo {fitness_goal}; nivel {activity_level}; edad {age}; género {gender}
+        Plan: {plan_name}; {duration_weeks} semanas; {workouts_per_week} entrenamientos por semana; dificultad {difficulty}
+        Contexto: {context}
+        Versión actual: {current}
+        Cambios pedidos: {instructions}
+        Responde con este formato JSON:
+        {slice_schema}
+    """,
+    max_input_tokens=1500
+))
+
+register(PromptTemplate(
+    name='workout_plan_detailed',
+    version=2,
+    use_case='workout_plan_detailed',
+    system="Eres un entrenador personal experto. Respondes ÚNICAMENTE con JSON válido, sin explicaciones adicionales.",
+    user=f"""
+        Eres un entrenador personal certificado con 15 años de experiencia. Crea un plan de entrenamiento COMPLETO y DETALLADO.
+        PERFIL DEL USUARIO: edad {{age}} años; género {{gender}}; peso {{weight}} kg; altura {{height}} cm; nivel {{activity_level}}; objetivo {{fitness_goal}}
+        PLAN: {{duration_weeks}} semanas; {{workouts_per_week}} entrenamientos por semana; equipo: {{equipment}}; enfoque: {{focus_areas}}; {{session_duration}} minutos por sesión
+        INSTRUCCIONES: plan progresivo y seguro; calentamiento y enfriamiento en cada sesión; varía los ejercicios; ajusta la intensidad al nivel; combina ejercicios compuestos y de aislamiento; respeta la recuperación entre sesiones.
+        FORMATO (JSON estricto):
+        {WORKOUT_DETAILED_SCHEMA}
+        IMPORTANTE: Responde ÚNICAMENTE con el JSON válido, sin texto adicional.
+    """,
+    max_input_tokens=900
+))
+
+register(PromptTemplate(
+    name='nutrition_plan',
+    version=2,
+    use_case='nutrition_plan',
+    system="Eres un nutricionista experto que crea planes alimentarios personalizados. Responde solo con JSON válido.",
+    user=f"""
+        Crea un plan nutricional personalizado:
+        Usuario: objetivo {{goal}}; {{daily_calories}} kcal diarias; restricciones: {{dietary_restrictions}}; alergias: {{allergies}}; edad {{age}}; peso {{weight}} kg; altura {{height}} cm
+        Plan: {{meals_per_day}} comidas por día; {{duration_weeks}} semanas; macros {{protein_pct}}% proteína, {{carbs_pct}}% carbohidratos, {{fats_pct}}% grasas
+        Responde con este formato JSON:
+        {NUTRITION_SCHEMA}
+        Asegúrate de que el plan sea balanceado, variado y apropiado para el objetivo del usuario.
+    """,
+    max_input_tokens=600
+))
+
+register(PromptTemplate(
+    name='nutrition_plan_sections',
+    version=1,
+    use_case='nutrition_plan',
+    system="Eres un nutricionista experto que completa planes alimentarios personalizados. Responde solo con JSON válido.",
+    user="""
+        Genera SOLO estas secciones de un plan nutricional que ya tiene el resto: {sections}
+        Usuario: objetivo {goal}; {daily_calories} kcal diarias; restricciones: {dietary_restrictions}; alergias: {allergies}; edad {age}; peso {weight} kg; altura {height} cm
+        Plan: {meals_per_day} comidas por día; {duration_weeks} semanas; macros {protein_pct}% proteína, {carbs_pct}% carbohidratos, {fats_pct}% grasas
+        Responde con este formato JSON:
+        {sections_schema}
+    """,
+    max_input_tokens=600
+))
+
+register(PromptTemplate(
+    name='nutrition_plan_slice',
+    version=1,
+    use_case='nutrition_plan',
+    system="Eres un nutricionista experto que ajusta planes alimentarios existentes. Responde solo con JSON válido.",
+    user="""
+        Rehaz SOLO {target} de un plan nutricional; el resto del plan no cambia:
+        Usuario: objetivo {fitness_goal}; restricciones: {dietary_restrictions}; edad {age}; peso {weight} kg; altura {height} cm
+        Plan: {plan_name}; {daily_calories} kcal diarias; macros {protein_pct}% proteína, {carbs_pct}% carbohidratos, {fats_pct}% grasas
+        Contexto: {context}
+        Versión actual: {current}
+        Cambios pedidos: {instructions}
+        Responde con este formato JSON:
+        {slice_schema}
+    """,
+    max_input_tokens=1500
+))
+
+register(PromptTemplate(
+    name='nutrition_plan_detailed',
+    version=2,
+    use_case='nutrition_plan_detailed',
+    system="Eres un nutricionista experto. Respondes ÚNICAMENTE con JSON válido, sin explicaciones adicionales.",
+    user=f"""
+        Eres un nutricionista certificado con especialización en nutrición deportiva. Crea un plan nutricional COMPLETO y BALANCEADO.
+        PERFIL DEL USUARIO: edad {{age}} años; peso {{weight}} kg; altura {{height}} cm; actividad {{activity_level}}; objetivo {{goal}}
+        PLAN: {{daily_calories}} kcal diarias ({{protein_grams}} g proteína, {{carbs_grams}} g carbohidratos, {{fats_grams}} g grasas); {{meals_per_day}} comidas por día; {{duration_weeks}} semanas; restricciones: {{dietary_restrictions}}; alergias: {{allergies}}
+        INSTRUCCIONES: plan realista y sostenible; variedad de alimentos; timing de nutrientes; snacks saludables; alternativas para cada comida; consejos de hidratación.
+        FORMATO (JSON estricto):
+        {NUTRITION_DETAILED_SCHEMA}
+        IMPORTANTE: Responde ÚNICAMENTE con el JSON válido, sin texto adicional.
+    """,
+    max_input_tokens=1000
+))
+
+register(PromptTemplate(
+    name='chat',
+    version=2,
+    use_case='chat',
+    system="Eres un asistente de fitness y nutrición experto. Ayuda al usuario con consejos personalizados basados en su información:" + USER_CONTEXT,
+    user="{message}",
+    max_input_tokens=1200
+))
+
+register(PromptTemplate(
+    name='advice',
+    version=2,
+    use_case='advice',
+    system="""
+        Eres un entrenador personal y nutricionista experto con 15 años de experiencia.
+        Proporciona consejos personalizados, motivadores y basados en evidencia científica.
+    """ + USER_CONTEXT + """
+        Restricciones dietéticas: {dietary_restrictions}
+        INSTRUCCIONES: sé específico y práctico; tono motivador y profesional; adapta las recomendaciones al perfil; si falta información, pide más detalles; incluye consejos de seguridad cuando sea relevante; máximo 200 palabras.
+    """,
+    user="{message}",
+    max_input_tokens=1200
+))
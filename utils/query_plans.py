@@ -0,0 +1,88 @@
+"""Comprobación de los planes de ejecución de las consultas de las rutas.
+
+Reproduce las consultas frecuentes de los listados, estadísticas y registros
+de progreso y las pasa por EXPLAIN (EXPLAIN QUERY PLAN en SQLite). Una
+consulta falla si recorre entera alguna tabla en lugar de usar un índice.
+En Postgres se desactiva el seq scan durante la comprobación para que el
+planificador elija el índice aunque las tablas estén casi vacías.
+"""
+import logging
+import re
+from datetime import date, datetime
+from typing import Dict, List
+
+from app import db
+from models.progress_rollups import ProgressRollup
+from models.user import NutritionPlan, ProgressEntry, WorkoutPlan
+
+logger = logging.getLogger(__name__)
+
+_SQLITE_INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\S+)|USING (INTEGER PRIMARY KEY)')
+_POSTGRES_INDEX_RE = re.compile(r'Index (?:Only )?Scan(?: Backward)? using (\S+)|Bitmap Index Scan on (\S+)')
+
+
+def route_queries() -> Dict:
+    """Consultas representativas de las rutas, con valores de ejemplo"""
+    user_id, cursor = 1, (datetime(2024, 1, 1), 100)
+    queries = {}
+
+    for name, model in (('workouts', WorkoutPlan), ('nutrition', NutritionPlan)):
+        page = model.query.filter_by(user_id=user_id).order_by(model.created_at.desc(), model.id.desc()).limit(21)
+        queries[f'{name}: listado'] = page
+        queries[f'{name}: listado (página siguiente)'] = model.query.filter_by(user_id=user_id)\
+            .filter(db.tuple_(model.created_at, model.id) < db.tuple_(*cursor))\
+            .order_by(model.created_at.desc(), model.id.desc()).limit(21)
+        queries[f'{name}: listado por estado'] = model.query.filter_by(user_id=user_id, status='active')\
+            .order_by(model.created_at.desc(), model.id.desc()).limit(21)
+        queries[f'{name}: recuento por estado'] = db.session.query(db.func.count(model.id))\
+            .filter_by(user_id=user_id, status='completed')
+        queries[f'{name}: último plan'] = model.query.filter_by(user_id=user_id).order_by(model.created_at.desc())\
+            .limit(1)
+
+    queries['progress: listado'] = ProgressEntry.query.filter_by(user_id=user_id)\
+        .order_by(ProgressEntry.date.desc(), ProgressEntry.id.desc()).limit(21)
+    queries['progress: registro del día (upsert)'] = ProgressEntry.query.filter_by(user_id=user_id, date=date(2024, 1, 1))
+    queries['progress: histórico'] = ProgressEntry.query.filter_by(user_id=user_id).order_by(ProgressEntry.date)
+    queries['progress: analíticas (resúmenes)'] = ProgressRollup.query.filter(
+        ProgressRollup.user_id == user_id, ProgressRollup.granularity == 'month',
+        ProgressRollup.period_start >= date(2024, 1, 1), ProgressRollup.metric.in_(['weight', 'entries'])
+    ).order_by(ProgressRollup.period_start)
+    return queries
+
+
+def _explain(sql: str) -> List[str]:
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(db.text('SET LOCAL enable_seqscan = off'))
+        return [row[0] for row in db.session.execute(db.text(f'EXPLAIN {sql}'))]
+    return [row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+
+def explain_query(query) -> Dict:
+    """Plan de ejecución de una consulta: índices usados y tablas recorridas enteras"""
+    dialect = db.session.get_bind().dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    try:
+        plan = _explain(sql)
+    finally:
+        db.session.rollback()
+
+    if dialect.name == 'postgresql':
+        indexes = [a or b for a, b in _POSTGRES_INDEX_RE.findall('\n'.join(plan))]
+        full_scans = [line.strip() for line in plan if 'Seq Scan' in line]
+    else:
+        indexes = [a or b for a, b in _SQLITE_INDEX_RE.findall('\n'.join(plan))]
+        full_scans = [line for line in plan if line.startswith('SCAN') and 'USING' not in line]
+    return {'plan': plan, 'indexes': indexes, 'full_scans': full_scans}
+
+
+def check_query_plans() -> bool:
+    """Muestra el índice que usa cada consulta; False si alguna recorre una tabla entera"""
+    ok = True
+    for name, query in route_queries().items():
+        result = explain_query(query)
+        if result['full_scans']:
+            ok = False
+            print(f"FALLO  {name}: {'; '.join(result['full_scans'])}")
+        else:
+            print(f"OK     {name}: {', '.join(dict.fromkeys(result['indexes']))}")
+    return ok
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models.ai import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+# Peticiones rechazadas por nivel en este proceso
+_rejected: Dict[str, int] = {}
+_rejected_lock = threading.Lock()
+
+MAX_CAS_ATTEMPTS = 5
+
+
+def _read_bucket(connection, key: str):
+    table = RateLimitBucket.__table__
+    return connection.execute(
+        db.select(table.c.tokens, table.c.updated_at).where(table.c.bucket_key == key)
+    ).first()
+
+
+def consume(key: str, capacity: float, per_second: float, cost: float = 1) -> Tuple[bool, float]:
+    """Consume ``cost`` tokens del cubo si hay suficientes.
+
+    El cubo se rellena a ``per_second`` tokens por segundo hasta ``capacity``.
+    La actualización es condicional sobre ``updated_at`` (compare-and-swap),
+    así varios workers pueden compartir el mismo cubo sin bloqueos. Cada
+    intento va en su propia conexión y transacción, sin tocar la sesión de la
+    petición ni los cambios que tenga pendientes. Devuelve si se admitió la
+    petición y, si no, los segundos hasta que haya tokens.
+    """
+    if cost > capacity:
+        return False, cost / per_second
+
+    table = RateLimitBucket.__table__
+    for _ in range(MAX_CAS_ATTEMPTS):
+        now = time.time()
+        try:
+            with db.engine.begin() as connection:
+                row = _read_bucket(connection, key)
+
+                if row is None:
+                    connection.execute(table.insert().values(bucket_key=key, tokens=capacity - cost, updated_at=now))
+                    return True, 0.0
+
+                tokens = min(capacity, row.tokens + max(0.0, now - row.updated_at) * per_second)
+                if tokens < cost:
+                    return False, (cost - tokens) / per_second
+
+                updated = connection.execute(
+                    table.update()
+                    .where(table.c.bucket_key == key, table.c.updated_at == row.updated_at)
+                    .values(tokens=tokens - cost, updated_at=now)
+                ).rowcount
+        except IntegrityError:
+            # Otro worker creó el cubo a la vez
+            continue
+        if updated:
+            return True, 0.0
+
+    # Demasiada contención en el mismo cubo: tratarlo como límite alcanzado
+    return False, 1.0
+
+
+def refund(key: str, capacity: float, cost: float):
+    """Devuelve tokens a un cubo (p. ej. si otro límite rechazó la petición)"""
+    table = RateLimitBucket.__table__
+    refilled = table.c.tokens + cost
+    with db.engine.begin() as connection:
+        connection.execute(
+            table.update().where(table.c.bucket_key == key)
+            .values(tokens=db.case((refilled > capacity, capacity), else_=refilled))
+        )
+
+
+def check_ai_rate_limit(app, user_id: int, tier: str, cost: float = 1) -> Optional[float]:
+    """Aplica los límites por usuario y por nivel.
+
+    Devuelve None si la petición se admite o los segundos que hay que
+    esperar (para la cabecera Retry-After) si supera alguno de los límites.
+    """
+    limits = app.config['AI_RATE_LIMITS'].get(tier) or app.config['AI_RATE_LIMITS']['basic']
+
+    user_capacity = limits['user_per_minute']
+    allowed, retry_after = consume(f'user:{user_id}', user_capacity, user_capacity / 60, cost)
+
+    if allowed:
+        tier_capacity = limits['tier_per_minute']
+        allowed, retry_after = consume(f'tier:{tier}', tier_capacity, tier_capacity / 60, cost)
+        if not allowed:
+            refund(f'user:{user_id}', user_capacity, cost)
+
+    if allowed:
+        return None
+
+    with _rejected_lock:
+        _rejected[tier] = _rejected.get(tier, 0) + 1
+    logger.info(f"Límite de IA alcanzado para usuario {user_id} ({tier}), reintentar en {retry_after:.1f}s")
+    return retry_after
+
+
+def rate_limit_stats() -> Dict[str, int]:
+    with _rejected_lock:
+        return dict(_rejected)
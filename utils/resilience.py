@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+class LLMUnavailable(Exception):
+    """La llamada al LLM se rechaza sin llegar al proveedor"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailable):
+    """El circuito del caso de uso está abierto por fallos consecutivos"""
+
+
+class BulkheadFullError(LLMUnavailable):
+    """No quedan plazas de concurrencia para el caso de uso"""
+
+
+class CircuitBreaker:
+    """Circuito closed → open → half_open por caso de uso.
+
+    Tras ``failure_threshold`` fallos consecutivos se abre y rechaza las
+    llamadas durante ``reset_timeout`` segundos. Después deja pasar una única
+    llamada de prueba: si va bien se cierra, si falla se vuelve a abrir.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.total_rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Comprueba si se puede llamar; lanza CircuitOpenError si no"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.total_rejected += 1
+                    raise CircuitOpenError(f"Circuito abierto para {self.name}", retry_after=remaining)
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.total_rejected += 1
+                    raise CircuitOpenError(f"Circuito en prueba para {self.name}", retry_after=1.0)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Libera la prueba si la llamada terminó sin éxito ni fallo del proveedor"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            retry_after = None
+            if self.state == self.OPEN:
+                retry_after = max(0.0, round(self.opened_at + self.reset_timeout - time.monotonic(), 1))
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_after_seconds': retry_after,
+                'rejected': self.total_rejected
+            }
+
+
+class Bulkhead:
+    """Límite de llamadas simultáneas de un caso de uso"""
+
+    def __init__(self, name: str, max_concurrency: int, queue_timeout: float = 0.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.total_rejected = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        acquired = self._semaphore.acquire(timeout=self.queue_timeout) if self.queue_timeout > 0 \
+            else self._semaphore.acquire(blocking=False)
+        with self._lock:
+            if not acquired:
+                self.total_rejected += 1
+                raise BulkheadFullError(f"Demasiadas llamadas simultáneas a {self.name}", retry_after=1.0)
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def to_dict(self) -> Dict:
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'queue_timeout_seconds': self.queue_timeout,
+            'rejected': self.total_rejected
+        }
+
+
+class LatencyTracker:
+    """Ventana de latencias recientes para calcular el timeout adaptativo.
+
+    Hasta reunir ``min_samples`` se usa ``max_timeout``; después el timeout
+    es el p99 observado por ``multiplier``, acotado a [min_timeout, max_timeout].
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20, multiplier: float = 1.5,
+                 min_timeout: float = 5.0, max_timeout: float = 60.0):
+        self.min_samples = min_samples
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))
+        return samples[index]
+
+    @property
+    def timeout(self) -> float:
+        with self._lock:
+            count = len(self._samples)
+        if count < self.min_samples:
+            return self.max_timeout
+        adaptive = self.percentile(99) * self.multiplier
+        return round(min(self.max_timeout, max(self.min_timeout, adaptive)), 2)
+
+    def to_dict(self) -> Dict:
+        p50 = self.percentile(50)
+        p99 = self.percentile(99)
+        return {
+            'samples': len(self._samples),
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p99_ms': round(p99 * 1000, 1) if p99 is not None else None,
+            'timeout_seconds': self.timeout
+        }
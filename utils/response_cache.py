@@ -0,0 +1,136 @@
+"""Respuestas condicionales (ETag / 304) y caché de respuestas por usuario.
+
+Las rutas de lectura decoradas con ``conditional_get`` derivan su ETag de
+(usuario, ruta, parámetros, versión de datos del usuario, día): una consulta
+por clave primaria a users.data_version basta para responder 304 a un
+If-None-Match sin ejecutar la ruta. El día entra en la clave porque algunas
+respuestas (rachas, analíticas por periodo) dependen de la fecha.
+
+Los cuerpos calculados se guardan ya serializados en una caché LRU en
+memoria de cada worker, limitada en entradas y bytes. Como la versión forma
+parte de la clave, una escritura deja las entradas anteriores inaccesibles
+(y el LRU las acaba desalojando) sin tener que invalidar nada.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from typing import Dict, Hashable, Optional
+
+from flask import Response, make_response, request
+from flask_jwt_extended import get_jwt_identity
+
+from models.data_version import current_data_version
+
+
+class ResponseCache:
+    """Cuerpos JSON serializados con desalojo LRU por número de entradas y tamaño total"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_entries = 2000
+        self.max_bytes = 32 * 1024 * 1024
+        self._lru: 'OrderedDict[Hashable, bytes]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'not_modified': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', True)
+        self.max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 2000)
+        self.max_bytes = app.config.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+        self.clear()
+        app.extensions['response_cache'] = self
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self._bytes = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            body = self._lru.get(key)
+            if body is None:
+                self._stats['misses'] += 1
+                return None
+            self._lru.move_to_end(key)
+            self._stats['hits'] += 1
+            return body
+
+    def store(self, key: Hashable, body: bytes):
+        # Una respuesta que no cabe nunca desalojaría al resto
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._lru.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            while self._lru and (len(self._lru) >= self.max_entries or self._bytes + len(body) > self.max_bytes):
+                _, oldest = self._lru.popitem(last=False)
+                self._bytes -= len(oldest)
+                self._stats['evictions'] += 1
+            self._lru[key] = body
+            self._bytes += len(body)
+            self._stats['stores'] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._lru)
+            stats['memory_bytes'] = self._bytes
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+def _with_validators(response: Response, etag: str) -> Response:
+    response.set_etag(etag)
+    # El cliente puede guardar la respuesta, pero debe revalidarla siempre con el ETag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def conditional_get(view):
+    """ETag, 304 con If-None-Match y caché de la respuesta de una ruta GET del usuario.
+
+    Va debajo de @jwt_required(). Solo se cachean las respuestas 200 en JSON;
+    si el usuario no existe se ejecuta la ruta, que responde el error.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = get_jwt_identity()
+        version = current_data_version(user_id)
+        if version is None:
+            return view(*args, **kwargs)
+
+        key = (int(user_id), request.endpoint, tuple(sorted(kwargs.items())),
+               tuple(sorted(request.args.items(multi=True))), version, date.today().isoformat())
+        etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:32]
+
+        if request.if_none_match.contains(etag):
+            response_cache.count_not_modified()
+            return _with_validators(Response(status=304), etag)
+
+        body = response_cache.get(key) if response_cache.enabled else None
+        if body is not None:
+            return _with_validators(Response(body, mimetype='application/json'), etag)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or not response.is_json:
+            return response
+        if response_cache.enabled:
+            response_cache.store(key, response.get_data())
+        return _with_validators(response, etag)
+
+    return wrapper
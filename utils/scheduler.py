@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.resilience import LLMUnavailable, LatencyTracker
+
+# Trabajo sin usuario esperando (pre-generación del pool): detrás de cualquier petición
+BACKGROUND_TIER = 'background'
+
+# Menor número = se atiende antes
+TIER_PRIORITY = {'pro': 0, 'premium': 1, 'basic': 2, BACKGROUND_TIER: 3}
+
+
+def tier_priority(tier: Optional[str]) -> int:
+    return TIER_PRIORITY.get(tier or 'basic', TIER_PRIORITY['basic'])
+
+
+class SchedulerTimeout(LLMUnavailable):
+    """La llamada esperó en la cola más de lo permitido"""
+
+
+class _Waiter:
+    __slots__ = ('tier', 'event', 'granted')
+
+    def __init__(self, tier: str):
+        self.tier = tier
+        self.event = threading.Event()
+        self.granted = False
+
+
+class PriorityScheduler:
+    """Cola con prioridad por nivel delante de todas las llamadas al LLM.
+
+    Admite hasta ``max_concurrency`` llamadas simultáneas por proceso. Cuando
+    no hay plaza, las llamadas esperan y cada plaza liberada pasa a la de
+    mayor prioridad (pro, premium, basic y al final el trabajo en segundo
+    plano; FIFO dentro del mismo nivel).
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self._waiters: List = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {tier: self._new_stats() for tier in TIER_PRIORITY}
+
+    @staticmethod
+    def _new_stats() -> Dict:
+        return {'in_flight': 0, 'admitted': 0, 'timeouts': 0, 'waits': LatencyTracker(window=500)}
+
+    def _normalize(self, tier: Optional[str]) -> str:
+        return tier if tier in TIER_PRIORITY else 'basic'
+
+    def acquire(self, tier: Optional[str], timeout: float):
+        """Espera una plaza; lanza SchedulerTimeout si no llega a tiempo"""
+        tier = self._normalize(tier)
+        started = time.monotonic()
+
+        with self._lock:
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+                self._admit(tier, 0.0)
+                return
+            waiter = _Waiter(tier)
+            entry = (tier_priority(tier), next(self._seq), waiter)
+            heapq.heappush(self._waiters, entry)
+
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._stats[tier]['timeouts'] += 1
+                raise SchedulerTimeout(f"Cola del LLM llena para el nivel {tier}", retry_after=timeout or 1.0)
+            self._admit(tier, time.monotonic() - started)
+
+    def _admit(self, tier: str, waited: float):
+        stats = self._stats[tier]
+        stats['in_flight'] += 1
+        stats['admitted'] += 1
+        stats['waits'].record(waited)
+
+    def release(self, tier: Optional[str]):
+        """Libera la plaza y se la cede a la llamada en espera de mayor prioridad"""
+        tier = self._normalize(tier)
+        with self._lock:
+            self._stats[tier]['in_flight'] -= 1
+            if self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self.active -= 1
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            depth = {tier: 0 for tier in TIER_PRIORITY}
+            for _, _, waiter in self._waiters:
+                depth[waiter.tier] += 1
+            tiers = {}
+            for tier, stats in self._stats.items():
+                p50 = stats['waits'].percentile(50)
+                p95 = stats['waits'].percentile(95)
+                tiers[tier] = {
+                    'priority': TIER_PRIORITY[tier],
+                    'queue_depth': depth[tier],
+                    'in_flight': stats['in_flight'],
+                    'admitted': stats['admitted'],
+                    'timeouts': stats['timeouts'],
+                    'wait_p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+                    'wait_p95_ms': round(p95 * 1000, 1) if p95 is not None else None
+                }
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self.active,
+                'tiers': tiers
+            }
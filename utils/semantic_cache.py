@@ -0,0 +1,231 @@
+"""Caché semántica de respuestas del chat.
+
+Las preguntas se convierten en vectores locales (n-gramas de palabras y de
+caracteres con hashing, sin llamadas de red) y se buscan por similitud
+coseno dentro de su partición (objetivo + nivel del usuario). Solo se
+cachean preguntas genéricas: las que incluyen cifras o datos de salud del
+usuario se consideran personales y siempre van al LLM.
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'[a-z0-9ñ]+')
+_DIGIT_RE = re.compile(r'\d')
+
+# Palabras sin contenido que no ayudan a distinguir preguntas (las negaciones se conservan)
+STOP_WORDS = frozenset("""
+    el la los las lo un una unos unas de del al a por para en con y o u que me mi mis se te tu
+    es son ser debo deberia debe tengo tiene tener hay puedo puede hacer hago cual cuales como sobre muy
+    the an of to do does i my should is are for per in on and or be can what how much many
+""".split())
+
+# Indicios de que la pregunta depende de datos concretos del usuario
+PERSONAL_MARKERS = (
+    'mi peso', 'mi edad', 'mi altura', 'mis medidas', 'mi grasa', 'mi imc',
+    'lesion', 'dolor', 'me duele', 'embaraz', 'lactancia', 'diabet', 'hipertens',
+    'medicament', 'alergi', 'intoleran', 'enfermedad', 'operacion', 'cirugia',
+    'my weight', 'my age', 'injur', 'pain', 'pregnan'
+)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos ni signos de puntuación"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(_WORD_RE.findall(text))
+
+
+def is_personal(text: str) -> bool:
+    normalized = normalize_text(text)
+    return bool(_DIGIT_RE.search(normalized)) or any(marker in normalized for marker in PERSONAL_MARKERS)
+
+
+def _features(normalized: str):
+    words = [word for word in normalized.split() if word not in STOP_WORDS]
+    for word in words:
+        yield 'w:' + word
+    for first, second in zip(words, words[1:]):
+        yield f'b:{first} {second}'
+    padded = f' {" ".join(words)} '
+    for n in (3, 4):
+        for i in range(len(padded) - n + 1):
+            yield 'c:' + padded[i:i + n]
+
+
+def embed(text: str, dimensions: int) -> np.ndarray:
+    """Vector normalizado de n-gramas con hashing (tf sublineal)"""
+    counts = Counter(zlib.crc32(f.encode('utf-8')) % dimensions for f in _features(normalize_text(text)))
+    vector = np.zeros(dimensions, dtype=np.float32)
+    if counts:
+        index = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        vector[index] = 1 + np.log(values)
+        vector /= np.linalg.norm(vector)
+    return vector
+
+
+class _Entry:
+    __slots__ = ('partition', 'row', 'question', 'answer', 'tokens', 'created_at', 'hits')
+
+    def __init__(self, partition: Tuple, question: str, answer: str, tokens: int):
+        self.partition = partition
+        self.row = -1
+        self.question = question
+        self.answer = answer
+        self.tokens = tokens
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class _Partition:
+    """Matriz de vectores de una partición, con filas contiguas"""
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.zeros((8, dimensions), dtype=np.float32)
+        self.entries = []
+
+    def add(self, vector: np.ndarray, entry: _Entry):
+        size = len(self.entries)
+        if size == len(self.vectors):
+            grown = np.zeros((size * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:size] = self.vectors
+            self.vectors = grown
+        self.vectors[size] = vector
+        entry.row = size
+        self.entries.append(entry)
+
+    def remove(self, entry: _Entry):
+        """Quita la fila moviendo la última a su hueco"""
+        last = self.entries.pop()
+        if last is not entry:
+            self.vectors[entry.row] = self.vectors[last.row]
+            self.entries[entry.row] = last
+            last.row = entry.row
+
+    def nearest(self, vector: np.ndarray) -> Tuple[Optional[_Entry], float]:
+        if not self.entries:
+            return None, 0.0
+        similarities = self.vectors[:len(self.entries)] @ vector
+        best = int(np.argmax(similarities))
+        return self.entries[best], float(similarities[best])
+
+
+class SemanticCache:
+    """Índice vectorial en memoria con desalojo LRU y caducidad"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.threshold = 0.8
+        self.max_entries = 1000
+        self.ttl = 24 * 3600
+        self.dimensions = 2048
+        self._partitions: Dict[Tuple, _Partition] = {}
+        self._lru: 'OrderedDict[int, _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0,
+                       'skipped_personal': 0, 'tokens_saved': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CHAT_CACHE_ENABLED', True)
+        self.threshold = app.config.get('CHAT_CACHE_THRESHOLD', 0.8)
+        self.max_entries = app.config.get('CHAT_CACHE_MAX_ENTRIES', 1000)
+        self.ttl = app.config.get('CHAT_CACHE_TTL_SECONDS', 24 * 3600)
+        self.dimensions = app.config.get('CHAT_CACHE_DIMENSIONS', 2048)
+        self.clear()
+        app.extensions['chat_cache'] = self
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self._lru.clear()
+
+    @staticmethod
+    def partition_for(fitness_goal: Optional[str], activity_level: Optional[str]) -> Tuple:
+        return ((fitness_goal or 'none').lower(), (activity_level or 'none').lower())
+
+    def cacheable(self, question: str) -> bool:
+        """Indica si la pregunta es genérica; las personales se cuentan aparte"""
+        if not self.enabled:
+            return False
+        if is_personal(question):
+            with self._lock:
+                self._stats['skipped_personal'] += 1
+            return False
+        return True
+
+    def lookup(self, partition: Tuple, question: str) -> Optional[str]:
+        """Devuelve la respuesta de la pregunta más parecida si supera el umbral"""
+        vector = embed(question, self.dimensions)
+
+        with self._lock:
+            index = self._partitions.get(partition)
+            entry, similarity = index.nearest(vector) if index else (None, 0.0)
+
+            if entry is not None and similarity >= self.threshold:
+                if time.monotonic() - entry.created_at > self.ttl:
+                    self._remove(entry)
+                    self._stats['expired'] += 1
+                else:
+                    self._lru.move_to_end(id(entry))
+                    entry.hits += 1
+                    self._stats['hits'] += 1
+                    self._stats['tokens_saved'] += entry.tokens
+                    return entry.answer
+
+            self._stats['misses'] += 1
+            return None
+
+    def store(self, partition: Tuple, question: str, answer: str, tokens: int = 0):
+        """Guarda una respuesta; si ya hay una pregunta equivalente, la sustituye"""
+        vector = embed(question, self.dimensions)
+
+        with self._lock:
+            index = self._partitions.setdefault(partition, _Partition(self.dimensions))
+            existing, similarity = index.nearest(vector)
+            if existing is not None and similarity >= self.threshold:
+                self._remove(existing)
+
+            while len(self._lru) >= self.max_entries:
+                oldest = next(iter(self._lru.values()))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+            entry = _Entry(partition, question, answer, tokens)
+            index = self._partitions.setdefault(partition, index)
+            index.add(vector, entry)
+            self._lru[id(entry)] = entry
+            self._stats['stores'] += 1
+
+    def _remove(self, entry: _Entry):
+        self._lru.pop(id(entry), None)
+        index = self._partitions[entry.partition]
+        index.remove(entry)
+        # Las particiones vacías se descartan para liberar su matriz
+        if not index.entries:
+            del self._partitions[entry.partition]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._lru)
+            stats['partitions'] = sum(1 for p in self._partitions.values() if p.entries)
+            stats['memory_bytes'] = sum(p.vectors.nbytes for p in self._partitions.values())
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
+
+
+chat_cache = SemanticCache()